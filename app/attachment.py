@@ -0,0 +1,68 @@
+from copy import copy
+from io import BytesIO
+
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+
+from app.config import COLUMN_WIDTHS
+
+
+def copy_rows(
+    src_ws, ws, styles: dict = None, min_row: int = None, max_row: int = None
+):
+    """
+    Переносит строки листа (обычного или открытого в режиме read_only) вместе
+    со стилями в лист write_only. styles — кэш "стиль исходной книги -> стиль
+    новой", общий для листов одной книги
+    """
+    styles = {} if styles is None else styles
+    for src_row in src_ws.iter_rows(min_row=min_row, max_row=max_row):
+        row = []
+        for src_cell in src_row:
+            has_style = getattr(src_cell, "has_style", False)
+            if src_cell.value is None and not has_style:
+                row.append(None)
+                continue
+            cell = WriteOnlyCell(ws, value=src_cell.value)
+            if has_style:
+                # регистрация стиля в книге дорогая (хэш всех полей), поэтому
+                # каждый стиль исходной книги переносится один раз
+                key = getattr(src_cell, "_style_id", None)
+                if key is None:
+                    key = tuple(src_cell._style)
+                style = styles.get(key)
+                if style is None:
+                    # у обычных ячеек стили — прокси, в новую книгу идут копии
+                    cell.font = copy(src_cell.font)
+                    cell.fill = copy(src_cell.fill)
+                    cell.border = copy(src_cell.border)
+                    cell.alignment = copy(src_cell.alignment)
+                    cell.number_format = src_cell.number_format
+                    cell.protection = copy(src_cell.protection)
+                    style = styles[key] = copy(cell._style)
+                else:
+                    cell._style = copy(style)
+            row.append(cell)
+        ws.append(row)
+
+
+def build_attachment(src_ws, ranges: list = None) -> bytes:
+    """
+    Небольшая книга в памяти с одним листом: указанные диапазоны строк
+    [(первая, последняя)] через пустую строку или, без ranges, весь лист
+    """
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(src_ws.title)
+    for col_letter, width in COLUMN_WIDTHS.items():
+        ws.column_dimensions[col_letter].width = width
+    if ranges is None:
+        copy_rows(src_ws, ws)
+    else:
+        styles = {}
+        for min_row, max_row in ranges:
+            # как в отчёте: перед секцией и блоком прошлого года пустая строка
+            ws.append([])
+            copy_rows(src_ws, ws, styles, min_row, max_row)
+    buffer = BytesIO()
+    wb.save(buffer)
+    return buffer.getvalue()
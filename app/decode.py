@@ -0,0 +1,276 @@
+import json
+import math
+
+from datetime import datetime
+from operator import itemgetter
+
+from app import metrics
+from app.config import CITY_MAPPING
+from app.section_template import format_data_value, section_header, sheet_name_for
+from logger.logger import setup_logger
+
+try:
+    import numpy as np
+except ImportError:
+    # без numpy значения пачки считаются построчно теми же формулами
+    np = None
+
+logger = setup_logger(module_name=__name__)
+
+COUNT_FIELDS = ("ВСЕГО:", "Потеряно:", "Переведено:", "Успешно завершено:")
+WAIT_FIELDS = (
+    "Клиенты, не дождавшиеся ответа, ждали в среднем:",
+    "В среднем клиенты ждут:",
+    "В среднем разговор длится:",
+)
+# в этих пределах numpy считает ровно так же, как int и float Python;
+# строки со значениями больше (и inf/nan) считаются построчно
+EXACT_INT = 2**53
+EXACT_FLOAT = 2.0**52
+
+get_counts = itemgetter(*COUNT_FIELDS)
+get_waits = itemgetter(*WAIT_FIELDS)
+
+
+def parse_message(data: dict, city_mapping: dict = CITY_MAPPING) -> tuple:
+    """
+    Разбирает сообщение statScraper: (дата, город, значения метрик).
+    Для неизвестного города возвращает None
+    """
+    with metrics.timed("compute"):
+        date_str = data["Date"]
+        city_key = data["City"]
+        date = datetime.strptime(date_str, "%Y-%m-%d")
+        city_name = city_mapping.get(city_key)
+
+        if not city_name:
+            logger.warning(f"⚠️ unknown city: {city_key}")
+            return None
+
+        values = [
+            int(data["ВСЕГО:"]),
+            int(data["Потеряно:"]),
+            int(data["Переведено:"]),
+            int(data["Успешно завершено:"]),
+            math.floor(
+                float(data["Клиенты, не дождавшиеся ответа, ждали в среднем:"]) + 0.5
+            ),
+            math.floor(float(data["В среднем клиенты ждут:"]) + 0.5),
+            math.floor(float(data["В среднем разговор длится:"]) + 0.5),
+            round((int(data["Потеряно:"]) / int(data["ВСЕГО:"])) * 100, 1)
+            if int(data["ВСЕГО:"]) > 0
+            else 0,
+        ]
+        return date, city_name, values
+
+
+def row_values(counts: list, waits: list) -> list:
+    """
+    Значения строки по уже разобранным полям — те же формулы, что в parse_message
+    """
+    total, lost = counts[0], counts[1]
+    return (
+        counts
+        + [math.floor(wait + 0.5) for wait in waits]
+        + [round((lost / total) * 100, 1) if total > 0 else 0]
+    )
+
+
+class DecodedBatch:
+    """
+    Пачка сообщений по столбцам: номера сообщений в пачке, коды даты и города
+    (индексы в dates и cities) и по массиву numpy на каждый показатель в порядке
+    HEADERS. Строки со значениями вне точного диапазона float64 (и все строки
+    без numpy) лежат в extra: [(номер, код даты, код города, значения)].
+    errors — [(номер сообщения, ошибка)]
+    """
+
+    def __init__(self):
+        self.dates = []
+        self.cities = []
+        self.positions = []
+        self.date_codes = []
+        self.city_codes = []
+        self.columns = []
+        self.extra = []
+        self.errors = []
+
+    def __len__(self) -> int:
+        return len(self.positions) + len(self.extra)
+
+    def rows(self) -> list:
+        """
+        Строки в порядке сообщений: [(дата, город, значения)], как у parse_message
+        """
+        rows = list(self.extra)
+        if len(self.positions):
+            columns = [column.tolist() for column in self.columns]
+            for position, date, city, *values in zip(
+                self.positions.tolist(),
+                self.date_codes.tolist(),
+                self.city_codes.tolist(),
+                *columns,
+            ):
+                if values[0] <= 0:
+                    # доля потерь без звонков — целый 0, как в parse_message
+                    values[-1] = 0
+                rows.append((position, date, city, values))
+        rows.sort(key=lambda row: row[0])
+        return [
+            (self.dates[date], self.cities[city], values)
+            for _, date, city, values in rows
+        ]
+
+    def sections(self) -> dict:
+        """
+        Значения ячеек для записи: {лист: {заголовок секции: {город: ячейки}}}.
+        Для повторов (дата, город) остаётся последнее сообщение
+        """
+        sheets = {}
+        for date, city, values in self.rows():
+            section = sheets.setdefault(sheet_name_for(date), {}).setdefault(
+                section_header(date), {}
+            )
+            section[city] = [
+                format_data_value(value, i) for i, value in enumerate(values)
+            ]
+        return sheets
+
+
+def decode_batch(payloads: list, city_mapping: dict = CITY_MAPPING) -> DecodedBatch:
+    """
+    Разбирает пачку сообщений (dict или JSON) разом: каждое поле читается один
+    раз, дата разбирается один раз на значение, округление ожиданий и доля потерь
+    считаются по столбцам. Результат и тексты ошибок совпадают с parse_message
+    """
+    batch = DecodedBatch()
+    date_ids, city_ids = {}, {}
+    # разобранные поля строк и сами сообщения — для текста ошибки
+    positions, date_codes, city_codes, counts, waits, sources = [], [], [], [], [], []
+
+    with metrics.timed("compute"):
+        for position, data in enumerate(payloads):
+            try:
+                if isinstance(data, (bytes, str)):
+                    data = json.loads(data)
+                date_str = data["Date"]
+                city_key = data["City"]
+                date_id = date_ids.get(date_str)
+                if date_id is None:
+                    batch.dates.append(datetime.strptime(date_str, "%Y-%m-%d"))
+                    date_id = date_ids[date_str] = len(batch.dates) - 1
+                city_name = city_mapping.get(city_key)
+                if not city_name:
+                    batch.errors.append((position, f"unknown city: {city_key}"))
+                    continue
+                row_counts = list(map(int, get_counts(data)))
+                row_waits = list(map(float, get_waits(data)))
+            except Exception as e:
+                batch.errors.append((position, scalar_error(data, city_mapping, e)))
+                continue
+            city_id = city_ids.get(city_name)
+            if city_id is None:
+                batch.cities.append(city_name)
+                city_id = city_ids[city_name] = len(batch.cities) - 1
+            positions.append(position)
+            date_codes.append(date_id)
+            city_codes.append(city_id)
+            counts.append(row_counts)
+            waits.append(row_waits)
+            sources.append(data)
+
+        exact = [False] * len(positions)
+        if np is not None and positions:
+            exact = fill_columns(
+                batch, positions, date_codes, city_codes, counts, waits
+            )
+        # строки вне точного диапазона и все строки без numpy
+        for i in (i for i, row_exact in enumerate(exact) if not row_exact):
+            try:
+                values = row_values(counts[i], waits[i])
+            except Exception as e:
+                error = scalar_error(sources[i], city_mapping, e)
+                batch.errors.append((positions[i], error))
+                continue
+            batch.extra.append((positions[i], date_codes[i], city_codes[i], values))
+
+    batch.errors.sort(key=lambda error: error[0])
+    return batch
+
+
+def fill_columns(
+    batch: DecodedBatch,
+    positions: list,
+    date_codes: list,
+    city_codes: list,
+    counts: list,
+    waits: list,
+) -> list:
+    """
+    Заполняет столбцы пачки строками, которые numpy считает точно.
+    Возвращает признак такой строки для каждой строки
+    """
+    try:
+        counts = np.array(counts, dtype=np.int64)
+    except OverflowError:
+        # такие строки всё равно уйдут в extra, в массив кладём границу
+        counts = np.array(
+            [
+                [max(-EXACT_INT, min(value, EXACT_INT)) for value in row]
+                for row in counts
+            ],
+            dtype=np.int64,
+        )
+    waits = np.array(waits, dtype=np.float64)
+    # сравнение с nan ложно, поэтому nan и inf тоже не проходят
+    exact = ((counts > -EXACT_INT) & (counts < EXACT_INT)).all(axis=1) & (
+        (waits > -EXACT_FLOAT) & (waits < EXACT_FLOAT)
+    ).all(axis=1)
+
+    batch.positions = np.array(positions, dtype=np.int64)[exact]
+    batch.date_codes = np.array(date_codes, dtype=np.int32)[exact]
+    batch.city_codes = np.array(city_codes, dtype=np.int32)[exact]
+    batch.columns = compute_columns(counts[exact], waits[exact])
+    return exact.tolist()
+
+
+def scalar_error(data, city_mapping: dict, error: Exception) -> str:
+    """
+    Текст ошибки строки так, как её выдал бы parse_message: порядок проверок
+    у пачки другой, поэтому упавшая строка разбирается ещё раз
+    """
+    if isinstance(data, dict):
+        try:
+            parse_message(data, city_mapping)
+        except Exception as e:
+            error = e
+    return f"{type(error).__name__}: {error}"
+
+
+def compute_columns(counts, waits) -> list:
+    """
+    Массивы показателей по матрицам разобранных полей (строка — сообщение)
+    """
+    total, lost = counts[:, 0], counts[:, 1]
+    counted = total > 0
+
+    percent = np.zeros(len(total))
+    np.divide(lost, total, out=percent, where=counted)
+    percent *= 100
+    # round(x, 1) округляет точное значение x, а x * 10 считается с погрешностью:
+    # строки, где она может сменить направление округления (x * 10 у половины
+    # или x слишком велик), досчитываются встроенным round
+    tenths = percent * 10
+    rounded = np.rint(tenths) / 10
+    unsure = (np.abs(tenths - np.floor(tenths) - 0.5) < 1e-6) | (
+        np.abs(percent) >= 2.0**20
+    )
+    for i in np.flatnonzero(unsure & counted).tolist():
+        rounded[i] = round(float(percent[i]), 1)
+
+    columns = [counts[:, i] for i in range(len(COUNT_FIELDS))]
+    columns += [
+        np.floor(waits[:, i] + 0.5).astype(np.int64) for i in range(len(WAIT_FIELDS))
+    ]
+    columns.append(np.where(counted, rounded, 0.0))
+    return columns
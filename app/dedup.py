@@ -0,0 +1,177 @@
+import os
+import sqlite3
+import threading
+
+from collections import OrderedDict
+
+from app.journal import Journal
+from logger.logger import setup_logger
+
+logger = setup_logger(module_name=__name__)
+
+
+def file_signature(path: str) -> tuple:
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class FingerprintCache:
+    """
+    Отпечатки (дата, город) -> хэш значений, которые уже есть в книге.
+    Ограниченный LRU в памяти; на диск (SQLite) попадают только отпечатки,
+    сохранённые вместе с файлом. Если файл книги изменился без нас
+    (подпись mtime/размер не совпала), его отпечатки при запуске отбрасываются
+    """
+
+    def __init__(self, path: str, capacity: int):
+        self.path = path
+        self.capacity = max(capacity, 1)
+        self.entries = OrderedDict()
+        # изменения с последнего сохранения книги
+        self.changed = set()
+        self.evicted = set()
+        self.sequence = 0
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS fingerprints (
+                date TEXT NOT NULL,
+                city TEXT NOT NULL,
+                digest TEXT NOT NULL,
+                file_path TEXT NOT NULL,
+                last_used INTEGER NOT NULL,
+                PRIMARY KEY (date, city)
+            )
+            """
+        )
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS files (
+                file_path TEXT PRIMARY KEY,
+                mtime_ns INTEGER NOT NULL,
+                size INTEGER NOT NULL
+            )
+            """
+        )
+        self._load()
+
+    def _load(self):
+        stale = [
+            file_path
+            for file_path, mtime_ns, size in self.conn.execute(
+                "SELECT file_path, mtime_ns, size FROM files"
+            )
+            if file_signature(file_path) != (mtime_ns, size)
+        ]
+        if stale:
+            logger.warning(
+                f"workbook changed outside statHandler, fingerprints dropped: {stale}"
+            )
+            with self.conn:
+                for file_path in stale:
+                    self.conn.execute(
+                        "DELETE FROM fingerprints WHERE file_path = ?", (file_path,)
+                    )
+                    self.conn.execute(
+                        "DELETE FROM files WHERE file_path = ?", (file_path,)
+                    )
+
+        rows = self.conn.execute(
+            "SELECT date, city, digest, file_path, last_used FROM fingerprints "
+            "ORDER BY last_used DESC LIMIT ?",
+            (self.capacity,),
+        ).fetchall()
+        for date, city, digest, file_path, last_used in reversed(rows):
+            self.entries[(date, city)] = (digest, file_path)
+            self.sequence = max(self.sequence, last_used)
+        if len(rows) == self.capacity:
+            # размер кэша уменьшили — лишнее удаляем и с диска
+            with self.conn:
+                self.conn.execute(
+                    "DELETE FROM fingerprints WHERE last_used < ?", (rows[-1][4],)
+                )
+        logger.info(f"{len(self.entries)} fingerprints loaded from {self.path}")
+
+    @staticmethod
+    def key(date, city: str) -> tuple:
+        return date.strftime("%Y-%m-%d"), city
+
+    def seen(self, date, city: str, values: list) -> bool:
+        """
+        True, если в книге уже записаны ровно эти значения
+        """
+        key = self.key(date, city)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] != Journal.digest(values):
+                return False
+            self.entries.move_to_end(key)
+            self.changed.add(key)
+            return True
+
+    def remember(self, date, city: str, values: list, file_path: str):
+        key = self.key(date, city)
+        with self.lock:
+            self.entries[key] = (Journal.digest(values), file_path)
+            self.entries.move_to_end(key)
+            self.changed.add(key)
+            self.evicted.discard(key)
+            while len(self.entries) > self.capacity:
+                old_key, _ = self.entries.popitem(last=False)
+                self.changed.discard(old_key)
+                self.evicted.add(old_key)
+
+    def take_changes(self) -> tuple:
+        """
+        Изменения с прошлого сохранения: (строки для записи, вытесненные ключи)
+        """
+        with self.lock:
+            rows = []
+            for key in self.changed:
+                entry = self.entries.get(key)
+                if entry is not None:
+                    self.sequence += 1
+                    rows.append((*key, *entry, self.sequence))
+            evicted = list(self.evicted)
+            self.changed.clear()
+            self.evicted.clear()
+            return rows, evicted
+
+    def persist(self, saved: list, changes: tuple = None):
+        """
+        Записывает отпечатки после сохранения книги вместе с подписями файлов.
+        changes — результат take_changes на момент сохранения
+        """
+        rows, evicted = self.take_changes() if changes is None else changes
+        with self.lock:
+            with self.conn:
+                self.conn.executemany(
+                    "INSERT INTO fingerprints "
+                    "(date, city, digest, file_path, last_used) VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT (date, city) DO UPDATE SET "
+                    "digest = excluded.digest, file_path = excluded.file_path, "
+                    "last_used = excluded.last_used",
+                    rows,
+                )
+                self.conn.executemany(
+                    "DELETE FROM fingerprints WHERE date = ? AND city = ?", evicted
+                )
+                for file_path in saved:
+                    signature = file_signature(file_path)
+                    if signature is None:
+                        continue
+                    self.conn.execute(
+                        "INSERT INTO files (file_path, mtime_ns, size) VALUES (?, ?, ?) "
+                        "ON CONFLICT (file_path) DO UPDATE SET "
+                        "mtime_ns = excluded.mtime_ns, size = excluded.size",
+                        (file_path, *signature),
+                    )
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
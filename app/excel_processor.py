@@ -1,58 +1,374 @@
 import openpyxl
 import os
+import time
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from datetime import timedelta
+from io import BytesIO
 from openpyxl.utils import get_column_letter
-import math
 
 from app.config import (
     EXCEL_PATH_LAST_YEAR,
+    EXCEL_FLUSH_MAX_MESSAGES,
+    EXCEL_FLUSH_INTERVAL,
+    EXCEL_INDEX_SIDECAR,
+    EXCEL_ROLLUPS,
+    HISTORY_PATH,
+    HISTORY_YEARS,
     CITY_ORDER,
     CITY_MAPPING,
+    COLUMN_WIDTHS,
     MONTH_NAMES,
-    WEEKDAYS,
     HEADERS,
-    HEADER_FILL,
-    HEADER_FONT,
-    HEADER_ALIGNMENT,
-    METRIC_FILL,
-    METRIC_ALIGNMENT,
-    DATA_ALIGNMENT,
-    THICK_BORDER,
 )
-from app.send_email import send_email_with_attachment
+from app import metrics
+from app.attachment import build_attachment
+from app.decode import decode_batch, parse_message
+from app.dedup import FingerprintCache
+from app.journal import Journal
+from app.history import HistoryStore
+from app.previous_year import PreviousYearReader, same_weekday_years_back
+from app.rollups import ROLLUP_SHEETS, Rollups, canonical_city
+from app.outbox import ReportOutbox
+from app.send_email import EMAIL_ATTACHMENT_MODE, MailSettings, send_report
+from app.section_template import (
+    SectionTemplate,
+    format_data_value,
+    section_header,
+    sheet_name_for,
+)
+from app.sheet_index import SheetIndex
+from app.sidecar import read_sidecar, write_sidecar
+from app.snapshot import SnapshotSaver, replace_file
 from logger.logger import setup_logger
-from openpyxl.styles import Font, PatternFill
 
 logger = setup_logger(module_name=__name__)
 
 
+def format_previous_year_value(label, value):
+    """
+    В файле прошлого года "% потерь" хранится долей — переводим в проценты
+    """
+    if "% потерь" not in str(label).lower():
+        return value
+    try:
+        num = float(value) * 100
+        if num == int(num):
+            return f"{int(num)}%"
+        else:
+            return f"{num:.1f}".replace(".", ",").rstrip("0").rstrip(",") + "%"
+    except (ValueError, TypeError):
+        return value
+
+
+def open_workbook(file_path):
+    """
+    Загружает книгу; если файла ещё нет — пустая книга без листов
+    """
+    try:
+        return openpyxl.load_workbook(file_path)
+    except FileNotFoundError:
+        # файл появится при первом сохранении: книгу без листов openpyxl не сохраняет
+        wb = openpyxl.Workbook()
+        if "Sheet" in wb.sheetnames:
+            del wb["Sheet"]
+        return wb
+
+
 class ExcelProcessor:
-    def __init__(self, file_path):
+    def __init__(
+        self,
+        file_path,
+        flush_max_messages: int = EXCEL_FLUSH_MAX_MESSAGES,
+        flush_interval: float = EXCEL_FLUSH_INTERVAL,
+        journal: Journal = None,
+        fingerprints: FingerprintCache = None,
+        previous_year_blocks: bool = True,
+        snapshots: SnapshotSaver = None,
+        index_sidecar: bool = EXCEL_INDEX_SIDECAR,
+        attachment_mode: str = EMAIL_ATTACHMENT_MODE,
+        rollups: bool = EXCEL_ROLLUPS,
+        name: str = "",
+        city_mapping: dict = None,
+        city_order: list = None,
+        last_year_path: str = EXCEL_PATH_LAST_YEAR,
+        history_path: str = HISTORY_PATH,
+        history_years: int = HISTORY_YEARS,
+        outbox: ReportOutbox = None,
+        mail: MailSettings = None,
+    ):
         self.file_path = file_path
-        try:
-            self.wb = openpyxl.load_workbook(file_path)
-        except FileNotFoundError:
-            self.wb = openpyxl.Workbook()
-            if "Sheet" in self.wb.sheetnames:
-                del self.wb["Sheet"]
-            self.wb.save(file_path)
+        # имя отчёта в режиме нескольких отчётов: попадает в тему письма
+        self.name = name
+        # ключи городов из сообщений -> столбцы отчёта
+        self.city_mapping = city_mapping or CITY_MAPPING
+        # столбцы городов в секции, с B: дата заполнена, когда заполнены все они
+        self.city_order = list(city_order or CITY_ORDER)
+        self.flush_max_messages = flush_max_messages
+        self.flush_interval = flush_interval
+        # изменения, ещё не записанные на диск
+        self.pending_messages = 0
+        self.dirty_since = None
+        # индексы листов текущей книги, строятся при первом обращении к листу
+        self.sheet_indexes = {}
+        # индексы из файлов-спутников по названию листа: заменяют сканирование листа
+        self.index_sidecar = index_sidecar
+        self.saved_indexes = {}
+        # индексы сохраняемых книг, которые пишутся в спутники после записи файлов
+        self.sidecars = []
+        # номер последнего сериализованного снимка каждого файла: спутник
+        # устаревшего снимка не пишется, иначе он подписал бы чужой файл
+        self.sidecar_versions = {}
+        # шаблоны секций по книгам
+        self.templates = {}
+        # письма, которые отправляются после сохранения файла:
+        # (тема, текст, дата, лист, диапазоны строк секции и блока прошлого года)
+        self.pending_reports = []
+        self.attachment_mode = attachment_mode
+        # отметки об отправке писем: неотправленные уходят заново при запуске
+        self.outbox = outbox
+        # получатели, отправитель и SMTP-сервер отчёта (None — из переменных окружения)
+        self.mail = mail
+        # блоки прошлых лет: из архива history_path (несколько лет подряд)
+        # или из книги прошлого года
+        if history_path:
+            self.previous_year = HistoryStore(history_path)
+            self.history_years = max(history_years, 1)
+        else:
+            self.previous_year = PreviousYearReader(
+                last_year_path, 1 + len(self.city_order)
+            )
+            self.history_years = 1
+        self.previous_year_blocks = previous_year_blocks
+        # итоги по неделям и месяцам: восстанавливаются при первой записи
+        self.rollups_enabled = rollups
+        self.rollups = None
+        # журнал метрик: книга строится из него, версия — до какой строки применено
+        self.journal = journal
+        self.journal_version = journal.applied_version() if journal else 0
+        # отпечатки уже записанных значений: повторная доставка не трогает книгу
+        self.fingerprints = fingerprints
+        # фоновая запись: книга сериализуется в память, на диск её пишет SnapshotSaver;
+        # saving — Future последнего снимка, snapshot_files — файлы текущего сохранения
+        self.snapshots = snapshots
+        self.saving = None
+        self.snapshot_files = []
+        self._wb = None
+        self.loading = None
+        if index_sidecar:
+            # книга грузится в фоне, первое обращение к self.wb дождётся её
+            executor = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix="workbook-loader"
+            )
+            self.loading = executor.submit(self.load_workbook)
+            executor.shutdown(wait=False)
+        else:
+            self._wb = self.load_workbook()
 
         # устанавливаем ширину столбцов
-        self.column_widths = {
-            "A": 54.14,
-            "B": 18.29,
-            "C": 11.43,
-            "D": 14.57,
-            "E": 17.86,
-            "F": 19.71,
-        }
+        self.column_widths = COLUMN_WIDTHS
+        # общий файл пересобирается по таймеру только у хранения по месяцам
+        self.assemble_interval = 0
+
+    @property
+    def wb(self):
+        if self.loading is not None:
+            self._wb = self.loading.result()
+            self.loading = None
+            logger.info(f"workbook loaded: {self.file_path}")
+        return self._wb
+
+    def load_workbook(self):
+        self.load_saved_indexes(self.file_path)
+        return open_workbook(self.file_path)
+
+    def load_saved_indexes(self, path: str):
+        if self.index_sidecar:
+            self.saved_indexes.update(read_sidecar(path) or {})
+
+    def save(self) -> list:
+        """
+        Записывает книгу на диск. Возвращает пути сохранённых файлов
+        """
+        self.write_file(self.wb, self.file_path)
+        return [self.file_path]
+
+    def write_file(self, wb, path: str):
+        """
+        Записывает книгу атомарно, а в фоновом режиме — только сериализует
+        её в память: файл запишет SnapshotSaver
+        """
+        if self.index_sidecar:
+            indexes = {ws.title: self.get_sheet_index(ws).to_dict() for ws in wb}
+            version = self.sidecar_versions.get(path, 0) + 1
+            self.sidecar_versions[path] = version
+            self.sidecars.append((path, indexes, version))
+        if self.snapshots is None:
+            replace_file(path, wb.save)
+            return
+        buffer = BytesIO()
+        wb.save(buffer)
+        self.snapshot_files.append((path, buffer.getvalue()))
+
+    def wait_saved(self):
+        """
+        Дожидается записи последнего снимка (перед чтением файлов с диска)
+        """
+        if self.saving is not None:
+            self.saving.result()
+
+    def owns(self, ws) -> bool:
+        return ws.parent is self.wb
+
+    def get_worksheet(self, date: datetime):
+        sheet_name = sheet_name_for(date)
+        if sheet_name not in self.wb.sheetnames:
+            return self.create_new_sheet(sheet_name)
+        return self.wb[sheet_name]
+
+    def has_worksheet(self, date: datetime) -> bool:
+        return sheet_name_for(date) in self.wb.sheetnames
+
+    def report_path(self) -> str:
+        """
+        Файл, который уходит во вложении письма
+        """
+        return self.file_path
+
+    def storage_path(self, date: datetime) -> str:
+        """
+        Файл, в котором хранятся данные за дату
+        """
+        return self.file_path
+
+    def assemble_report(self) -> bool:
+        """
+        Собирает file_path, если он отстал от сохранённых данных.
+        Здесь file_path и есть хранилище, поэтому собирать нечего
+        """
+        return False
+
+    @property
+    def is_dirty(self) -> bool:
+        return self.dirty_since is not None
+
+    def mark_dirty(self):
+        if self.dirty_since is None:
+            self.dirty_since = time.monotonic()
+        self.pending_messages += 1
+
+    def flush_due(self) -> bool:
+        if not self.is_dirty:
+            return False
+        if 0 < self.flush_max_messages <= self.pending_messages:
+            return True
+        if self.flush_interval > 0:
+            return time.monotonic() - self.dirty_since >= self.flush_interval
+        return self.flush_max_messages <= 0
+
+    def flush(self) -> bool:
+        """
+        Сохраняет книгу, если в ней есть несохранённые изменения
+        """
+        if not self.is_dirty:
+            return False
+        with metrics.timed("save"):
+            saved = self.save()
+        metrics.inc("saves_total")
+        after_save = self.after_save(saved)
+        if self.snapshots is None:
+            if metrics.enabled:
+                metrics.inc("bytes_written_total", sum(map(os.path.getsize, saved)))
+            logger.debug(
+                "💾 excel was saved ({messages} messages)",
+                messages=self.pending_messages,
+            )
+            after_save()
+        else:
+            files, self.snapshot_files = self.snapshot_files, []
+            self.saving = self.snapshots.submit(files, after_save)
+            logger.debug(
+                "excel snapshot queued ({messages} messages)",
+                messages=self.pending_messages,
+            )
+        self.pending_messages = 0
+        self.dirty_since = None
+        return True
+
+    def after_save(self, saved: list):
+        """
+        Действия, которые выполняются, когда сохранённые файлы уже на диске.
+        Состояние берётся на момент сохранения: в фоновом режиме книга к тому
+        времени может уйти вперёд
+        """
+        changes = self.fingerprints.take_changes() if self.fingerprints else None
+        journal_version = self.journal_version
+        sidecars, self.sidecars = self.sidecars, []
+
+        def run():
+            for path, indexes, version in sidecars:
+                # снимки слились в один: файл уже записан более новым снимком,
+                # и спутник напишет его действие
+                if self.sidecar_versions.get(path) == version:
+                    write_sidecar(path, indexes)
+            if changes is not None:
+                self.fingerprints.persist(saved, changes)
+            if self.journal is not None:
+                self.journal.mark_applied(journal_version)
+
+        return run
+
+    def maybe_flush(self) -> bool:
+        if self.flush_due():
+            return self.flush()
+        return False
+
+    def get_template(self, ws) -> SectionTemplate:
+        """
+        Шаблон секций книги листа; стили регистрируются в книге один раз
+        """
+        template = self.templates.get(ws.parent)
+        if template is None:
+            template = SectionTemplate(ws.parent, self.city_order)
+            self.templates[ws.parent] = template
+        return template
+
+    def update_rollups(self, date: datetime, city_name: str, values: list):
+        """
+        Обновляет листы итогов значениями города за дату
+        """
+        rollups = self.get_rollups()
+        with metrics.timed("rollups"):
+            rollups.apply(date, canonical_city(city_name, self.city_order), values)
+
+    def get_rollups(self) -> Rollups:
+        if self.rollups is None:
+            with metrics.timed("rollups_rebuild"):
+                rollups = Rollups(self.wb, self.get_template, self.city_order)
+                for ws in self.wb.worksheets:
+                    if ws.title not in ROLLUP_SHEETS:
+                        rollups.scan(ws)
+                rollups.render()
+            self.rollups = rollups
+        return self.rollups
+
+    def get_sheet_index(self, ws) -> SheetIndex:
+        index = self.sheet_indexes.get(ws)
+        if index is None:
+            saved = self.saved_indexes.pop(ws.title, None)
+            index = (
+                SheetIndex.from_dict(saved, len(self.city_order))
+                if saved
+                else SheetIndex(ws, len(self.city_order))
+            )
+            self.sheet_indexes[ws] = index
+        return index
 
     def find_data_section(self, ws, target_date: datetime) -> int:
-        date_str = target_date.strftime("%d.%m.%Y")
-        weekday = WEEKDAYS[target_date.weekday()]
-        search_value = f"{date_str} ({weekday})"
+        search_value = section_header(target_date)
+
+        if self.owns(ws):
+            return self.get_sheet_index(ws).find_section(search_value)
 
         for row in range(1, ws.max_row + 1):
             cell_value = ws.cell(row, 1).value
@@ -61,6 +377,9 @@ class ExcelProcessor:
         return None
 
     def get_city_column(self, ws, row: int, city: str) -> int:
+        if self.owns(ws):
+            return self.get_sheet_index(ws).find_city(row, city)
+
         city = city.lower().strip()
         for col in range(2, ws.max_column + 1):
             cell_value = ws.cell(row, col).value
@@ -71,300 +390,435 @@ class ExcelProcessor:
         return None
 
     def create_new_data_section(self, ws, date: datetime) -> int:
-        last_row = ws.max_row
+        index = self.get_sheet_index(ws)
+        last_row = index.last_row
 
         # добавляет ТОЛЬКО ОДНУ пустую строку перед новой секцией
         if last_row > 0:
             # проверяем, что последняя строка не пустая
-            if any(ws.cell(last_row, col).value for col in range(1, ws.max_column + 1)):
+            if any(
+                ws.cell(last_row, col).value for col in range(1, index.max_column + 1)
+            ):
                 ws.append([])
                 last_row += 1
 
         date_row = last_row + 1
-        date_str = date.strftime("%d.%m.%Y")
-        weekday = WEEKDAYS[date.weekday()]
-        ws.cell(date_row, 1).value = f"{date_str} ({weekday})"
-        ws.cell(date_row, 1).fill = HEADER_FILL
-        ws.cell(date_row, 1).font = HEADER_FONT
-        ws.cell(date_row, 1).alignment = HEADER_ALIGNMENT
-        ws.cell(date_row, 1).border = THICK_BORDER
-
-        for col, city in enumerate(CITY_ORDER, start=2):
-            ws.cell(date_row, col).value = city
-            ws.cell(date_row, col).fill = HEADER_FILL
-            ws.cell(date_row, col).font = HEADER_FONT
-            ws.cell(date_row, col).alignment = HEADER_ALIGNMENT
-            ws.cell(date_row, col).border = THICK_BORDER
-
-        for i, metric in enumerate(HEADERS, start=1):
-            cell = ws.cell(date_row + i, 1)
-            cell.value = metric
-            cell.fill = METRIC_FILL
-            cell.alignment = METRIC_ALIGNMENT
-            cell.border = THICK_BORDER
+        self.get_template(ws).stamp_section(ws, date_row, section_header(date))
 
+        index.add_section(ws.cell(date_row, 1).value, date_row)
+        for col, city in enumerate(self.city_order, start=2):
+            index.add_city(date_row, city, col)
+        index.touch(date_row + len(HEADERS), 1)
         return date_row
 
     def create_new_sheet(
-        self, sheet_name: str
+        self, sheet_name: str, wb: openpyxl.Workbook = None
     ) -> openpyxl.worksheet.worksheet.Worksheet:
-        ws = self.wb.create_sheet(sheet_name)
+        if wb is None:
+            wb = self.wb
+        # листы итогов остаются в конце книги, новый месяц встаёт перед ними
+        rollup_positions = [
+            wb.sheetnames.index(title)
+            for title in ROLLUP_SHEETS
+            if title in wb.sheetnames
+        ]
+        ws = wb.create_sheet(sheet_name, min(rollup_positions, default=None))
         logger.info(f"new list created {sheet_name}")
 
         for col_letter, width in self.column_widths.items():
             ws.column_dimensions[col_letter].width = width
+        self.sheet_indexes[ws] = SheetIndex(ws, len(self.city_order))
         return ws
 
     def format_data_cell(self, cell, value, index: int):
-        cell.border = THICK_BORDER
-        cell.alignment = DATA_ALIGNMENT
-
-        if index in [4, 5, 6]:
-            cell.value = f"{value} сек."
-        elif index == 7:
-            try:
-                num = float(value)
-                if num == int(num):
-                    cell.value = f"{int(num)}%"
-                else:
-                    cell.value = f"{num:.1f}%".replace(".", ",")
-            except (ValueError, TypeError):
-                cell.value = value
-        else:
-            cell.value = value
+        self.get_template(cell.parent).apply(cell, "data")
+        cell.value = format_data_value(value, index)
 
-    def get_previous_year_same_weekday(self, date):
-        prev_year_date = date.replace(year=date.year - 1)
-        while prev_year_date.weekday() != date.weekday():
-            prev_year_date += timedelta(days=1)
-        return prev_year_date
+    def get_previous_year_same_weekday(self, date, years: int = 1):
+        return same_weekday_years_back(date, years)
+
+    def previous_year_dates(self, date) -> list:
+        return [
+            self.get_previous_year_same_weekday(date, years)
+            for years in range(1, self.history_years + 1)
+        ]
 
     def get_month_name(self, month):
         return MONTH_NAMES[month]
 
-    def insert_previous_year_block(self, ws, data_row, date):
+    def insert_previous_year_block(self, ws, data_row, date) -> list:
+        """
+        Вставляет блоки прошлых лет под секцией даты.
+        Возвращает диапазоны строк вставленных блоков
+        """
         logger.info(
             f"[prev] starting insertion of previous year block for date: {date}"
         )
-        prev_date = self.get_previous_year_same_weekday(date)
-        prev_file = EXCEL_PATH_LAST_YEAR
-        logger.info(f"[prev] prev year file: {prev_file}, date: {prev_date}")
+        prev_file = self.previous_year.file_path
         if not os.path.exists(prev_file):
             logger.warning(f"[prev] previous year file not found: {prev_file}")
-            return
-        prev_wb = openpyxl.load_workbook(prev_file)
-        prev_wb_values = openpyxl.load_workbook(prev_file, data_only=True)
-        prev_sheet_name = (
-            self.get_month_name(prev_date.month) + " " + str(prev_date.year)
-        )
-        logger.info(f"[prev] prev year sheet: {prev_sheet_name}")
-        if prev_sheet_name not in prev_wb.sheetnames:
-            logger.warning(
-                f"[prev] sheet {prev_sheet_name} not found in previous year file"
+            return []
+        blocks = []
+        for prev_date in self.previous_year_dates(date):
+            logger.debug(
+                "[prev] prev year file: {file}, date: {date}",
+                file=prev_file,
+                date=prev_date,
+            )
+            prev_rows = self.previous_year.get_section(prev_date)
+            if prev_rows:
+                blocks.append(prev_rows)
+            else:
+                logger.warning(
+                    f"[prev] section for date {prev_date} not found in previous year file"
+                )
+        if not blocks:
+            return []
+        index = self.get_sheet_index(ws)
+        template = self.get_template(ws)
+        target_row = index.last_row
+        ranges = []
+        for prev_rows in blocks:
+            # пропускаем одну пустую строку перед блоком
+            target_row += 1
+            block_row = target_row + 1
+            logger.debug("[prev] copying {rows} rows", rows=len(prev_rows))
+            for src_index, values in enumerate(prev_rows):
+                logger.debug("[prev] inserting row: {values}", values=values)
+                target_row += 1
+                for col in range(1, 2 + len(self.city_order)):
+                    value = values[col - 1] if col <= len(values) else None
+                    if col != 1:
+                        value = format_previous_year_value(values[0], value)
+                    style = template.previous_year_style(src_index, col)
+                    template.put(ws, target_row, col, value, style)
+                if src_index == 0 and isinstance(values[0], str):
+                    index.add_section(values[0], target_row)
+                index.touch(target_row, len(values))
+            ranges.append((block_row, target_row))
+        self.mark_dirty()
+        logger.success(f"previous year blocks inserted: {len(blocks)}")
+        return ranges
+
+    def report_ranges(self, ws, data_row: int, date: datetime) -> list:
+        """
+        Диапазоны строк письма: секция даты и блоки прошлых лет сразу под ней
+        """
+        index = self.get_sheet_index(ws)
+        expected_headers = {
+            section_header(prev_date) for prev_date in self.previous_year_dates(date)
+        }
+        current_section_end = data_row + len(HEADERS)
+        ranges = [(data_row, current_section_end)]
+        next_block_row = index.next_header_row(current_section_end)
+        while next_block_row:
+            next_block_value = ws.cell(row=next_block_row, column=1).value
+            if next_block_value not in expected_headers:
+                break
+            logger.info(
+                f"previous year block found at row {next_block_row}: {next_block_value}"
             )
+            block_end = next_block_row + len(HEADERS)
+            ranges.append((next_block_row, block_end))
+            next_block_row = index.next_header_row(block_end)
+        return ranges
+
+    def queue_report(self, date: datetime, ws, ranges: list, body: str):
+        """
+        Ставит письмо за дату в очередь; в outbox дата попадает до сохранения
+        книги и подтверждения сообщений
+        """
+        if self.outbox is not None:
+            self.outbox.add(date)
+        subject = self.report_subject(date)
+        self.pending_reports.append((subject, body, date, ws, ranges))
+
+    def resend_unsent(self) -> int:
+        """
+        Отправляет письма за даты, которые были заполнены, но письмо по которым
+        не ушло (сбой до отправки). Даты, которых в файле нет или которые в нём
+        ещё не заполнены, ждут повторной доставки сообщений
+        """
+        if self.outbox is None:
+            return 0
+        sent = 0
+        for date in self.outbox.unsent():
+            if not self.has_worksheet(date):
+                continue
+            ws = self.get_worksheet(date)
+            data_row = self.find_data_section(ws, date)
+            if data_row is None or not self.get_sheet_index(ws).is_complete(data_row):
+                continue
+            logger.info(f"resending report for {date:%Y-%m-%d}")
+            body = f"Все данные заполнены для даты {date.strftime('%d.%m.%Y')}.\nФайл во вложении."
+            self.queue_report(date, ws, self.report_ranges(ws, data_row, date), body)
+            sent += 1
+        self.send_pending_reports()
+        return sent
+
+    def report_subject(self, date: datetime) -> str:
+        # тема письма — ещё и ключ склейки в диспетчере, поэтому у отчётов она разная
+        prefix = f"[{self.name}] " if self.name else ""
+        return f"{prefix}Отчет с данными за {date.strftime('%d.%m.%Y')}"
+
+    def send_pending_reports(self):
+        reports, self.pending_reports = self.pending_reports, []
+        if not reports:
             return
-        prev_ws = prev_wb[prev_sheet_name]
-        prev_ws_values = prev_wb_values[prev_sheet_name]
-        prev_data_row = self.find_data_section(prev_ws, prev_date)
-        logger.info(f"[prev] prev year data row: {prev_data_row}")
-        if not prev_data_row:
-            logger.warning(
-                f"[prev] section for date {prev_date} not found in previous year file"
+        if self.attachment_mode != "full":
+            # вложение собирается сразу, пока книгу не изменили следующие сообщения
+            reports = [
+                (subject, body, date, *self.build_attachment(date, ws, ranges))
+                for subject, body, date, ws, ranges in reports
+            ]
+        if self.snapshots is not None and self.saving is not None:
+            # письмо уходит, когда снимок с этими данными записан на диск
+            self.saving.add_done_callback(
+                lambda future: future.exception() or self.deliver_reports(reports)
             )
             return
-        # Определяем конец секции: первая полностью пустая строка после prev_data_row
-        start_row = prev_data_row
-        end_row = start_row
-        while True:
-            if all(
-                prev_ws.cell(row=end_row, column=col).value in (None, "")
-                for col in range(1, 7)
-            ):
-                logger.info(f"[prev] prev year section end at row: {end_row}")
-                break
-            end_row += 1
-        ws.append([])
-        logger.info(f"[prev] copying rows: {start_row}-{end_row - 1}")
-        for src_row in range(start_row, end_row):
-            values = []
-            for col in range(1, 7):
-                cell = prev_ws.cell(row=src_row, column=col)
-                cell_value = cell.value
-                if cell.data_type == "f":
-                    cell_value = prev_ws_values.cell(row=src_row, column=col).value
-                values.append(cell_value)
-            logger.info(f"[prev] inserting row: {values}")
-            ws.append(values)
-            for col in range(1, 7):
-                cell = ws.cell(row=ws.max_row, column=col)
-                if src_row == start_row:
-                    cell.fill = HEADER_FILL
-                    cell.font = HEADER_FONT
-                    cell.alignment = HEADER_ALIGNMENT
-                elif col == 1:
-                    cell.fill = METRIC_FILL
-                    cell.font = Font(bold=False)
-                    cell.alignment = METRIC_ALIGNMENT
-                else:
-                    cell.fill = PatternFill(fill_type=None)
-                    cell.font = Font(bold=False)
-                    cell.alignment = DATA_ALIGNMENT
-                cell.border = THICK_BORDER
-                if (
-                    col != 1
-                    and "% потерь"
-                    in str(ws.cell(row=ws.max_row, column=1).value).lower()
-                ):
-                    val = cell.value
-                    try:
-                        num = float(val) * 100
-                        if num == int(num):
-                            cell.value = f"{int(num)}%"
-                        else:
-                            cell.value = (
-                                f"{num:.1f}".replace(".", ",").rstrip("0").rstrip(",")
-                                + "%"
-                            )
-                    except (ValueError, TypeError):
-                        pass
-        self.wb.save(self.file_path)
-        logger.success("excel was saved after inserting previous year block")
-        subject = f"Отчет с данными за {date.strftime('%d.%m.%Y')}"
-        body = f"Добавлены данные за прошлый год для даты {date.strftime('%d.%m.%Y')}.\nФайл во вложении."
-        send_email_with_attachment(subject, body, self.file_path)
-
-    def check_all_cities_filled(self, ws, data_row):
-        for col in range(2, 7):
-            all_metrics_filled = True
-            for i in range(1, len(HEADERS) + 1):
-                if ws.cell(row=data_row + i, column=col).value is None:
-                    all_metrics_filled = False
-                    break
-
-            if not all_metrics_filled:
-                return False
-
-        return True
+        self.deliver_reports(reports)
+
+    def build_attachment(self, date: datetime, ws, ranges: list) -> tuple:
+        """
+        Вложение письма в памяти: (имя файла, содержимое). Режим date — секция
+        даты и блок прошлого года, month — лист месяца целиком
+        """
+        stem = os.path.splitext(os.path.basename(self.file_path))[0]
+        with metrics.timed("attachment"):
+            if self.attachment_mode == "month":
+                return f"{stem}_{date:%Y-%m}.xlsx", build_attachment(ws)
+            return f"{stem}_{date:%Y-%m-%d}.xlsx", build_attachment(ws, ranges)
+
+    def sent_callback(self, date: datetime):
+        if self.outbox is None:
+            return None
+        return lambda: self.outbox.mark_sent(date)
+
+    def deliver_reports(self, reports: list):
+        if self.attachment_mode != "full":
+            for subject, body, date, filename, payload in reports:
+                on_sent = self.sent_callback(date)
+                send_report(
+                    subject,
+                    body,
+                    filename,
+                    payload=payload,
+                    on_sent=on_sent,
+                    mail=self.mail,
+                )
+            return
+        file_path = self.report_path()
+        for subject, body, date, *_ in reports:
+            send_report(
+                subject,
+                body,
+                file_path,
+                on_sent=self.sent_callback(date),
+                mail=self.mail,
+            )
 
     def process_message(self, data: dict):
+        completed = self.apply_message(data)
+        if completed:
+            # дата заполнена полностью: сохраняем сразу, письмо уходит с актуальным файлом
+            self.flush()
+        else:
+            self.maybe_flush()
+        self.send_pending_reports()
+
+    def process_batch(self, batch: list):
+        """
+        Применяет пачку сообщений как одно целое: пачка разбирается по столбцам
+        (decode_batch), затем одно сохранение и письма
+        """
+        for parsed in self.parse_batch(batch):
+            self.apply_parsed(*parsed)
+        self.flush()
+        self.send_pending_reports()
+
+    def refresh_from_journal(self, full: bool = False) -> int:
+        """
+        Применяет к книге строки журнала, которых в ней ещё нет.
+        full=True перестраивает книгу по всему журналу
+        """
+        if full:
+            self.journal_version = 0
+        rows = self.journal.since(self.journal_version)
+        completed = False
+        for version, date, city_name, values in rows:
+            completed = self.apply_values(date, city_name, values) or completed
+            self.journal_version = version
+        if completed:
+            self.flush()
+        else:
+            self.maybe_flush()
+        if rows and not self.is_dirty:
+            self.journal.mark_applied(self.journal_version)
+        self.send_pending_reports()
+        return len(rows)
+
+    def parse(self, data: dict) -> tuple:
+        return parse_message(data, self.city_mapping)
+
+    def parse_batch(self, batch: list) -> list:
+        """
+        Разбирает пачку по столбцам: [(дата, город, значения)] в порядке сообщений,
+        ошибки строк пишутся в лог
+        """
+        decoded = decode_batch(batch, self.city_mapping)
+        for _, error in decoded.errors:
+            if error.startswith("unknown city"):
+                logger.warning(f"⚠️ {error}")
+            else:
+                logger.error(f"❌ message processing error: {error}")
+        return decoded.rows()
+
+    def is_duplicate(self, data: dict) -> bool:
+        """
+        True, если ровно эти значения города за дату уже записаны в книгу
+        """
+        if self.fingerprints is None:
+            return False
         try:
-            date_str = data["Date"]
-            city_key = data["City"]
-            date = datetime.strptime(date_str, "%Y-%m-%d")
-            city_name = CITY_MAPPING.get(city_key)
-
-            if not city_name:
-                logger.warning(f"⚠️ unknown city: {city_key}")
-                return
-
-            values = [
-                int(data["ВСЕГО:"]),
-                int(data["Потеряно:"]),
-                int(data["Переведено:"]),
-                int(data["Успешно завершено:"]),
-                math.floor(
-                    float(data["Клиенты, не дождавшиеся ответа, ждали в среднем:"])
-                    + 0.5
-                ),
-                math.floor(float(data["В среднем клиенты ждут:"]) + 0.5),
-                math.floor(float(data["В среднем разговор длится:"]) + 0.5),
-                round((int(data["Потеряно:"]) / int(data["ВСЕГО:"])) * 100, 1)
-                if int(data["ВСЕГО:"]) > 0
-                else 0,
-            ]
+            parsed = self.parse(data)
+        except Exception:
+            # разбор упадёт ещё раз в apply_message и будет залогирован там
+            return False
+        return parsed is not None and self.fingerprints.seen(*parsed)
+
+    def apply_message(self, data: dict) -> bool:
+        """
+        Записывает данные сообщения в книгу без сохранения.
+        Возвращает True, если после записи все города за дату заполнены
+        """
+        try:
+            parsed = self.parse(data)
+            if parsed is None:
+                return False
+            return self.apply_parsed(*parsed)
+        except Exception as e:
+            logger.error(f"❌ error: {str(e)}")
+            import traceback
 
-            sheet_name = f"{MONTH_NAMES[date.month]} {date.year}"
+            traceback.print_exc()
+            return False
+
+    def apply_parsed(self, date: datetime, city_name: str, values: list) -> bool:
+        """
+        Записывает разобранное сообщение, если таких значений ещё нет в книге
+        """
+        if self.fingerprints is not None and self.fingerprints.seen(
+            date, city_name, values
+        ):
+            logger.debug(
+                "⏭️ {date:%Y-%m-%d} ({city}) already in workbook, skipped",
+                date=date,
+                city=city_name,
+            )
+            metrics.inc("duplicates_total")
+            return False
+        return self.apply_values(date, city_name, values)
+
+    def apply_values(self, date: datetime, city_name: str, values: list) -> bool:
+        """
+        Записывает уже посчитанные значения города за дату без сохранения.
+        Возвращает True, если после записи все города за дату заполнены
+        """
+        try:
+            date_str = date.strftime("%Y-%m-%d")
+            sheet_name = sheet_name_for(date)
 
-            if sheet_name not in self.wb.sheetnames:
-                ws = self.create_new_sheet(sheet_name)
-            else:
-                ws = self.wb[sheet_name]
+            ws = self.get_worksheet(date)
 
-            logger.info(
-                f"🔍 process data for {date_str} ({city_name}) on sheet {sheet_name}"
+            logger.debug(
+                "🔍 process data for {date} ({city}) on sheet {sheet}",
+                date=date_str,
+                city=city_name,
+                sheet=sheet_name,
             )
-            data_row = self.find_data_section(ws, date)
+            with metrics.timed("section_lookup"):
+                data_row = self.find_data_section(ws, date)
 
             if data_row is None:
                 logger.info(f"⚠️ date {date_str} not found, create new section")
                 data_row = self.create_new_data_section(ws, date)
                 logger.success(f"✅ new section created at row: {data_row}")
 
-            city_col = self.get_city_column(ws, data_row, city_name)
+            index = self.get_sheet_index(ws)
+            with metrics.timed("city_lookup"):
+                city_col = self.get_city_column(ws, data_row, city_name)
 
             if not city_col:
                 logger.warning(f"⚠️ col for city '{city_name}' not found, adding new")
-                # ищем последний занятый столбец в строке с датой
-                last_col = 1
-                for col in range(2, ws.max_column + 1):
-                    if ws.cell(data_row, col).value:
-                        last_col = col
-
-                city_col = last_col + 1
-
-                cell = ws.cell(data_row, city_col)
-                cell.value = city_name
-                cell.fill = HEADER_FILL
-                cell.font = HEADER_FONT
-                cell.alignment = HEADER_ALIGNMENT
-                cell.border = THICK_BORDER
+                # последний занятый столбец в строке с датой
+                city_col = index.last_city_column(data_row) + 1
+
+                self.get_template(ws).put(ws, data_row, city_col, city_name, "header")
+                index.add_city(data_row, city_name, city_col)
                 logger.info(
                     f"add new column {get_column_letter(city_col)} for city: {city_name}"
                 )
 
             start_row = data_row + 1
-            for i, value in enumerate(values):
-                cell = ws.cell(row=start_row + i, column=city_col)
-                self.format_data_cell(cell, value, i)
-
-            logger.success(
-                f"✅ data has been added {get_column_letter(city_col)}{start_row + i}"
+            with metrics.timed("cell_write"):
+                for i, value in enumerate(values):
+                    cell = ws.cell(row=start_row + i, column=city_col)
+                    self.format_data_cell(cell, value, i)
+
+            index.fill(data_row, city_col, len(values))
+            if self.rollups_enabled:
+                self.update_rollups(date, city_name, values)
+
+            logger.debug(
+                "✅ data has been added {column}{row}",
+                column=get_column_letter(city_col),
+                row=start_row + i,
             )
-            self.wb.save(self.file_path)
-            logger.success("💾 excel was saved")
-
-            if self.check_all_cities_filled(ws, data_row):
-                logger.info("all cities (B-F) filled for current date")
-
-                prev_date = self.get_previous_year_same_weekday(date)
-                prev_date_str = prev_date.strftime("%d.%m.%Y")
-                weekday = WEEKDAYS[prev_date.weekday()]
-                expected_header = f"{prev_date_str} ({weekday})"
-
-                current_section_end = data_row + len(HEADERS)
-                next_block_row = None
-
-                for row in range(current_section_end + 1, ws.max_row + 1):
-                    if ws.cell(row=row, column=1).value is not None:
-                        next_block_row = row
-                        break
-
-                block_exists = False
-                if next_block_row:
-                    next_block_value = ws.cell(row=next_block_row, column=1).value
-                    if next_block_value == expected_header:
-                        block_exists = True
-                        logger.info(
-                            f"previous year block found at row {next_block_row}: {next_block_value}"
-                        )
-
-                if not block_exists:
-                    logger.info("inserting previous year block")
-                    self.insert_previous_year_block(ws, data_row, date)
-                else:
-                    logger.info(
-                        "previous year block already exists, sending email anyway"
-                    )
-                    subject = f"Отчет с данными за {date.strftime('%d.%m.%Y')}"
-                    body = f"Все данные заполнены для даты {date.strftime('%d.%m.%Y')}.\nФайл во вложении."
-                    send_email_with_attachment(subject, body, self.file_path)
-            else:
-                logger.info(
-                    "not all cities (B-F) filled yet, skipping previous year block"
+            self.mark_dirty()
+            metrics.inc("rows_applied_total")
+            if self.fingerprints is not None:
+                self.fingerprints.remember(
+                    date, city_name, values, self.storage_path(date)
                 )
 
+            with metrics.timed("check_filled"):
+                filled = index.is_complete(data_row)
+                first_completion = filled and index.complete_once(data_row)
+            if not filled:
+                logger.debug("not all cities filled yet, skipping previous year block")
+                return False
+            if not first_completion:
+                # блок прошлого года и письмо уже были при первом заполнении даты
+                logger.debug("date was already complete, no new report")
+                return False
+
+            logger.info("all cities filled for current date")
+            # блоки прошлых лет идут сразу под секцией даты
+            ranges = self.report_ranges(ws, data_row, date)
+            body = f"Все данные заполнены для даты {date.strftime('%d.%m.%Y')}.\nФайл во вложении."
+            if len(ranges) > 1:
+                logger.info("previous year block already exists, sending email anyway")
+            elif self.previous_year_blocks:
+                logger.info("inserting previous year block")
+                try:
+                    with metrics.timed("previous_year"):
+                        inserted = self.insert_previous_year_block(ws, data_row, date)
+                except Exception as e:
+                    # дата уже отмечена заполненной: письмо уходит и без блока,
+                    # иначе оно потерялось бы насовсем
+                    logger.error(f"❌ previous year block error: {str(e)}")
+                    inserted = []
+                if inserted:
+                    ranges += inserted
+                    body = f"Добавлены данные за прошлый год для даты {date.strftime('%d.%m.%Y')}.\nФайл во вложении."
+            # письмо уходит при любом заполнении даты, даже без блоков прошлых лет
+            self.queue_report(date, ws, ranges, body)
+            return True
+
         except Exception as e:
             logger.error(f"❌ error: {str(e)}")
             import traceback
 
             traceback.print_exc()
+            return False
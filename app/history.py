@@ -0,0 +1,207 @@
+import argparse
+import bisect
+import json
+import os
+import struct
+import sys
+
+from array import array
+from datetime import date, datetime
+
+from app.config import HISTORY_PATH
+from app.dedup import file_signature
+from app.previous_year import (
+    SECTION_WIDTH,
+    PreviousYearReader,
+    same_weekday_years_back,
+)
+from app.snapshot import replace_file
+from logger.logger import setup_logger
+
+logger = setup_logger(module_name=__name__)
+
+MAGIC = b"STATHIST1\n"
+HEADER = struct.Struct("<I")
+
+
+def as_date(value) -> date:
+    return value.date() if isinstance(value, datetime) else value
+
+
+class HistoryStore:
+    """
+    Архив секций отчётов за прошлые годы в одном файле. Значения лежат по
+    столбцам: массив номеров из общего пула значений на каждый столбец секции,
+    даты — отсортированный массив, поэтому поиск не открывает ни одного xlsx.
+    Число столбцов задаётся при сборке и хранится в заголовке архива.
+    Интерфейс get_section тот же, что у PreviousYearReader
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.mtime = None
+        self.clear()
+
+    def clear(self, width: int = SECTION_WIDTH):
+        self.dates = array("i")
+        self.starts = array("I")
+        self.counts = array("H")
+        self.columns = [array("I") for _ in range(width)]
+        self.pool = []
+
+    @staticmethod
+    def build(target: str, sources: list, width: int = SECTION_WIDTH) -> int:
+        """
+        Собирает архив из годовых книг. Если дата есть в нескольких книгах,
+        берётся секция из книги, указанной позже. width — столбцов секции
+        (названия метрик и города). Возвращает число дат
+        """
+        sections = {}
+        for source in sources:
+            reader = PreviousYearReader(source, width)
+            if not reader.refresh():
+                raise FileNotFoundError(source)
+            sections.update(reader.sections)
+
+        pool, pool_ids = [], {}
+        dates, starts, counts = array("i"), array("I"), array("H")
+        columns = [array("I") for _ in range(width)]
+        row_count = 0
+        for section_date in sorted(sections):
+            rows = sections[section_date]
+            dates.append(section_date.toordinal())
+            starts.append(row_count)
+            counts.append(len(rows))
+            row_count += len(rows)
+            for row in rows:
+                for column, value in zip(columns, row):
+                    # 1 и 1.0 равны как ключи словаря, поэтому тип входит в ключ
+                    key = (type(value), value)
+                    if key not in pool_ids:
+                        pool_ids[key] = len(pool)
+                        pool.append(value)
+                    column.append(pool_ids[key])
+
+        header = {
+            "sources": [
+                [os.path.abspath(source), *file_signature(source)] for source in sources
+            ],
+            "dates": len(dates),
+            "rows": row_count,
+            "width": width,
+            "pool": pool,
+        }
+        meta = json.dumps(header, ensure_ascii=False, default=str).encode()
+
+        def write(f):
+            f.write(MAGIC)
+            f.write(HEADER.pack(len(meta)))
+            f.write(meta)
+            for values in (dates, starts, counts, *columns):
+                if sys.byteorder == "big":
+                    values = array(values.typecode, values)
+                    values.byteswap()
+                f.write(values.tobytes())
+
+        replace_file(target, write)
+        logger.success(
+            f"[history] {len(dates)} dates, {row_count} rows, "
+            f"{len(pool)} distinct values written to {target}"
+        )
+        return len(dates)
+
+    def _load(self):
+        with open(self.file_path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{self.file_path} is not a history file")
+            (size,) = HEADER.unpack(f.read(HEADER.size))
+            header = json.loads(f.read(size))
+            # архивы без width собирались по SECTION_WIDTH столбцов
+            width = header.get("width", SECTION_WIDTH)
+            self.clear(width)
+            lengths = [header["dates"]] * 3 + [header["rows"]] * width
+            for values, length in zip(
+                (self.dates, self.starts, self.counts, *self.columns), lengths
+            ):
+                values.frombytes(f.read(length * values.itemsize))
+                if sys.byteorder == "big":
+                    values.byteswap()
+        self.pool = header["pool"]
+
+        changed = [
+            path
+            for path, mtime_ns, size in header["sources"]
+            if file_signature(path) not in (None, (mtime_ns, size))
+        ]
+        if changed:
+            logger.warning(
+                f"[history] source workbooks changed since build, rebuild it: {changed}"
+            )
+        logger.info(
+            f"[history] loaded {len(self.dates)} sections from {self.file_path}"
+        )
+
+    def refresh(self) -> bool:
+        """
+        Перечитывает архив, если он изменился. Возвращает False, если файла нет
+        """
+        try:
+            mtime = os.stat(self.file_path).st_mtime_ns
+        except FileNotFoundError:
+            self.mtime = None
+            self.clear()
+            return False
+        if mtime != self.mtime:
+            self._load()
+            self.mtime = mtime
+        return True
+
+    def _position(self, target_date) -> int:
+        target_date = as_date(target_date)
+        if not isinstance(target_date, date) or not self.refresh():
+            return None
+        ordinal = target_date.toordinal()
+        pos = bisect.bisect_left(self.dates, ordinal)
+        if pos == len(self.dates) or self.dates[pos] != ordinal:
+            return None
+        return pos
+
+    def get_section(self, target_date) -> tuple:
+        pos = self._position(target_date)
+        if pos is None:
+            return None
+        start = self.starts[pos]
+        pool = self.pool
+        return tuple(
+            tuple(pool[column[row]] for column in self.columns)
+            for row in range(start, start + self.counts[pos])
+        )
+
+    def lookup(self, target_date, city: str, years: int = 1) -> dict:
+        """
+        Значения города за тот же день недели years лет назад:
+        {показатель: значение} или None
+        """
+        rows = self.get_section(same_weekday_years_back(as_date(target_date), years))
+        if not rows or city not in rows[0]:
+            return None
+        col = rows[0].index(city)
+        return {row[0]: row[col] for row in rows[1:]}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Сборка архива прошлых лет из годовых отчётов Excel"
+    )
+    parser.add_argument("sources", nargs="+", help="годовые xlsx, от старых к новым")
+    parser.add_argument("--output", default=HISTORY_PATH, help="файл архива")
+    parser.add_argument(
+        "--cities",
+        type=int,
+        default=SECTION_WIDTH - 1,
+        help="число городов в секциях отчёта (по умолчанию из CITY_ORDER)",
+    )
+    args = parser.parse_args()
+    if not args.output:
+        parser.error("укажите --output или HISTORY_PATH")
+    HistoryStore.build(args.output, args.sources, args.cities + 1)
@@ -0,0 +1,159 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+
+from datetime import datetime
+
+from logger.logger import setup_logger
+
+logger = setup_logger(module_name=__name__)
+
+
+class Journal:
+    """
+    Журнал метрик в SQLite — источник истины для отчёта.
+    Каждая строка (дата, город) хранится один раз; повторная доставка тех же
+    значений ничего не меняет, изменённые значения получают новую версию.
+    Книга Excel — материализованное представление журнала: в meta хранится
+    версия, до которой изменения уже сохранены в файл
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        # SQLite не создаёт папку файла сам
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        # FULL: коммит возвращается только после fsync журнала WAL
+        self.conn.execute("PRAGMA synchronous=FULL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS metrics (
+                date TEXT NOT NULL,
+                city TEXT NOT NULL,
+                metric_values TEXT NOT NULL,
+                digest TEXT NOT NULL,
+                version INTEGER NOT NULL,
+                received_at TEXT NOT NULL,
+                PRIMARY KEY (date, city)
+            )
+            """
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS metrics_version ON metrics (version)"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER)"
+        )
+        self.version = self.conn.execute(
+            "SELECT COALESCE(MAX(version), 0) FROM metrics"
+        ).fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    @staticmethod
+    def digest(values: list) -> str:
+        return hashlib.sha1(json.dumps(values).encode()).hexdigest()
+
+    def append_many(self, rows: list) -> int:
+        """
+        Записывает строки (дата, город, значения) одной транзакцией.
+        Возвращает число строк, которые действительно изменились
+        """
+        changed = 0
+        received_at = datetime.now().isoformat(timespec="seconds")
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                for date, city, values in rows:
+                    date_key = date.strftime("%Y-%m-%d")
+                    digest = self.digest(values)
+                    row = self.conn.execute(
+                        "SELECT digest FROM metrics WHERE date = ? AND city = ?",
+                        (date_key, city),
+                    ).fetchone()
+                    if row is not None and row[0] == digest:
+                        continue
+                    self.version += 1
+                    self.conn.execute(
+                        """
+                        INSERT INTO metrics
+                            (date, city, metric_values, digest, version, received_at)
+                        VALUES (?, ?, ?, ?, ?, ?)
+                        ON CONFLICT (date, city) DO UPDATE SET
+                            metric_values = excluded.metric_values,
+                            digest = excluded.digest,
+                            version = excluded.version,
+                            received_at = excluded.received_at
+                        """,
+                        (
+                            date_key,
+                            city,
+                            json.dumps(values),
+                            digest,
+                            self.version,
+                            received_at,
+                        ),
+                    )
+                    changed += 1
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                self.version = self.conn.execute(
+                    "SELECT COALESCE(MAX(version), 0) FROM metrics"
+                ).fetchone()[0]
+                raise
+        return changed
+
+    def since(self, version: int) -> list:
+        """
+        Строки, изменённые после указанной версии, в порядке версий
+        """
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT version, date, city, metric_values FROM metrics "
+                "WHERE version > ? ORDER BY version",
+                (version,),
+            ).fetchall()
+        return [
+            (row_version, datetime.strptime(date, "%Y-%m-%d"), city, json.loads(values))
+            for row_version, date, city, values in rows
+        ]
+
+    def between(self, start: datetime, end: datetime) -> list:
+        """
+        Строки за даты из [start, end) в том же виде, что у since
+        """
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT version, date, city, metric_values FROM metrics "
+                "WHERE date >= ? AND date < ? ORDER BY version",
+                (start.strftime("%Y-%m-%d"), end.strftime("%Y-%m-%d")),
+            ).fetchall()
+        return [
+            (row_version, datetime.strptime(date, "%Y-%m-%d"), city, json.loads(values))
+            for row_version, date, city, values in rows
+        ]
+
+    def applied_version(self) -> int:
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT value FROM meta WHERE key = 'applied_version'"
+            ).fetchone()
+        return row[0] if row else 0
+
+    def mark_applied(self, version: int):
+        """
+        Запоминает, что изменения до version включительно сохранены в книгу
+        """
+        with self.lock:
+            self.conn.execute(
+                "INSERT INTO meta (key, value) VALUES ('applied_version', ?) "
+                "ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+                (version,),
+            )
@@ -0,0 +1,123 @@
+import asyncio
+
+
+class InMemoryMessage:
+    """
+    Сообщение в памяти с тем же интерфейсом подтверждения, что и у aio_pika.
+    queue — очередь, из которой оно получено: туда же оно вернётся при nack
+    """
+
+    def __init__(self, channel, body: bytes, delivery_tag: int, queue=None):
+        self.channel = channel
+        self.body = body
+        self.delivery_tag = delivery_tag
+        self.queue = queue
+
+    async def ack(self, multiple: bool = False):
+        self.channel.ack(self.delivery_tag, multiple)
+
+    async def nack(self, requeue: bool = True):
+        self.channel.nack(self, requeue)
+
+
+class InMemoryQueue:
+    def __init__(self, channel, name: str):
+        self.channel = channel
+        self.name = name
+        self.messages = asyncio.Queue()
+        self.closed = False
+
+    def publish(self, body: bytes):
+        self.messages.put_nowait(body)
+
+    def close(self):
+        """
+        Завершает итерацию, когда опубликованные сообщения закончатся
+        """
+        self.closed = True
+        self.messages.put_nowait(None)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> InMemoryMessage:
+        body = await self.messages.get()
+        if body is None:
+            raise StopAsyncIteration
+        # как и брокер, не выдаём больше prefetch_count неподтверждённых сообщений
+        await self.channel.wait_for_capacity()
+        return self.channel.deliver(body, self)
+
+
+class InMemoryExchange:
+    """
+    Обменник по умолчанию: routing_key — имя очереди
+    """
+
+    def __init__(self, channel):
+        self.channel = channel
+
+    async def publish(self, message, routing_key: str):
+        queue = self.channel.queues.get(routing_key)
+        if queue is None:
+            raise LookupError(f"no queue {routing_key}")
+        queue.publish(message.body)
+
+
+class InMemoryChannel:
+    """
+    Заменитель канала RabbitMQ для тестов и бенчмарков: очереди в памяти,
+    prefetch и multi-ack ведут себя так же, как у брокера
+    """
+
+    def __init__(self):
+        self.queues = {}
+        self.prefetch_count = 0
+        self.unacked = {}
+        self.acked = 0
+        self.last_tag = 0
+        self.capacity = asyncio.Condition()
+        self.default_exchange = InMemoryExchange(self)
+
+    async def set_qos(self, prefetch_count: int = 0):
+        self.prefetch_count = prefetch_count
+
+    async def declare_queue(self, name: str, durable: bool = False) -> InMemoryQueue:
+        if name not in self.queues:
+            self.queues[name] = InMemoryQueue(self, name)
+        return self.queues[name]
+
+    async def wait_for_capacity(self):
+        async with self.capacity:
+            await self.capacity.wait_for(
+                lambda: (
+                    not self.prefetch_count or len(self.unacked) < self.prefetch_count
+                )
+            )
+
+    def deliver(self, body: bytes, queue: InMemoryQueue = None) -> InMemoryMessage:
+        self.last_tag += 1
+        message = InMemoryMessage(self, body, self.last_tag, queue)
+        self.unacked[self.last_tag] = message
+        return message
+
+    def ack(self, delivery_tag: int, multiple: bool = False):
+        if multiple:
+            tags = [tag for tag in self.unacked if tag <= delivery_tag]
+        else:
+            tags = [delivery_tag] if delivery_tag in self.unacked else []
+        for tag in tags:
+            del self.unacked[tag]
+        self.acked += len(tags)
+        asyncio.get_running_loop().create_task(self._notify())
+
+    def nack(self, message: InMemoryMessage, requeue: bool = True):
+        if self.unacked.pop(message.delivery_tag, None) is None:
+            return
+        if requeue and message.queue is not None:
+            message.queue.publish(message.body)
+        asyncio.get_running_loop().create_task(self._notify())
+
+    async def _notify(self):
+        async with self.capacity:
+            self.capacity.notify_all()
@@ -0,0 +1,268 @@
+import threading
+import time
+
+from bisect import bisect_left
+from contextlib import nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from app.config import (
+    LOG_SUMMARY_INTERVAL,
+    METRICS_ENABLED,
+    METRICS_HOST,
+    METRICS_PORT,
+)
+from logger.logger import setup_logger
+
+logger = setup_logger(module_name=__name__)
+
+PREFIX = "stathandler"
+# границы корзин гистограмм этапов, секунды
+BUCKETS = (
+    0.0001,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+COUNTERS = {
+    "messages_total": "messages received from the queue",
+    "decode_errors_total": "messages that could not be decoded",
+    "rows_applied_total": "city rows written to the workbook",
+    "duplicates_total": "redelivered messages already reflected in the workbook",
+    "saves_total": "workbook saves",
+    "bytes_written_total": "bytes written by workbook saves",
+    "snapshots_dropped_total": "background snapshots replaced by a newer one before writing",
+    "snapshot_errors_total": "failed background snapshot writes",
+    "emails_sent_total": "reports sent by email",
+    "email_errors_total": "reports that failed to send",
+    "errors_total": "error records written to the log",
+}
+GAUGES = {
+    "writer_queue_depth": "messages waiting for the writer thread",
+    "unacked_messages": "messages applied but not yet acknowledged",
+    "email_queue_depth": "reports waiting for the email dispatcher",
+}
+
+enabled = METRICS_ENABLED
+# счётчики нужны и сводке в логе, даже если эндпоинт метрик выключен
+counting = METRICS_ENABLED
+_NULL_TIMER = nullcontext()
+
+
+class Histogram:
+    def __init__(self, buckets: tuple = BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value: float):
+        i = bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    def snapshot(self) -> tuple:
+        with self.lock:
+            return list(self.counts), self.sum
+
+
+class Value:
+    """
+    Счётчик или текущее значение
+    """
+
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def set(self, value):
+        self.value = value
+
+
+class Timer:
+    __slots__ = ("histogram", "started")
+
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started)
+        return False
+
+
+stages = {}
+_stages_lock = threading.Lock()
+values = {name: Value() for name in list(COUNTERS) + list(GAUGES)}
+
+
+def stage_histogram(stage: str) -> Histogram:
+    histogram = stages.get(stage)
+    if histogram is None:
+        with _stages_lock:
+            histogram = stages.setdefault(stage, Histogram())
+    return histogram
+
+
+def timed(stage: str):
+    """
+    Контекстный менеджер, замеряющий длительность этапа.
+    При выключенных метриках возвращает пустой контекст
+    """
+    if not enabled:
+        return _NULL_TIMER
+    return Timer(stage_histogram(stage))
+
+
+def inc(name: str, amount=1):
+    if counting:
+        values[name].inc(amount)
+
+
+def set_gauge(name: str, value):
+    if enabled:
+        values[name].set(value)
+
+
+def render() -> str:
+    """
+    Текущие значения в текстовом формате Prometheus
+    """
+    lines = [
+        f"# HELP {PREFIX}_stage_seconds time spent in each processing stage",
+        f"# TYPE {PREFIX}_stage_seconds histogram",
+    ]
+    for stage, histogram in sorted(stages.items()):
+        counts, total = histogram.snapshot()
+        cumulative = 0
+        for bound, count in zip(histogram.buckets, counts):
+            cumulative += count
+            lines.append(
+                f'{PREFIX}_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}'
+            )
+        cumulative += counts[-1]
+        lines.append(
+            f'{PREFIX}_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {cumulative}'
+        )
+        lines.append(f'{PREFIX}_stage_seconds_sum{{stage="{stage}"}} {total}')
+        lines.append(f'{PREFIX}_stage_seconds_count{{stage="{stage}"}} {cumulative}')
+
+    for kind, names in (("counter", COUNTERS), ("gauge", GAUGES)):
+        for name, help_text in names.items():
+            lines.append(f"# HELP {PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {PREFIX}_{name} {kind}")
+            lines.append(f"{PREFIX}_{name} {values[name].value}")
+    return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # запросы сборщика метрик не пишем в лог
+        pass
+
+
+class LogSummary:
+    """
+    Сводка в лог раз в interval секунд вместо строки на каждое сообщение:
+    сообщения в секунду, записанные строки, сохранения, повторы и ошибки
+    """
+
+    FIELDS = {
+        "messages": "messages_total",
+        "rows": "rows_applied_total",
+        "saves": "saves_total",
+        "duplicates": "duplicates_total",
+        "errors": "errors_total",
+    }
+
+    def __init__(self, interval: float = LOG_SUMMARY_INTERVAL):
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="log-summary", daemon=True)
+        self.sink_id = None
+
+    def totals(self) -> dict:
+        return {field: values[name].value for field, name in self.FIELDS.items()}
+
+    def start(self):
+        global counting
+        counting = True
+        # ошибки считаются по записям лога: их пишут разные модули
+        self.sink_id = logger.add(
+            lambda _: values["errors_total"].inc(), level="ERROR", format="{message}"
+        )
+        self.last = self.totals()
+        self.last_time = time.monotonic()
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        self.report()
+        logger.remove(self.sink_id)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.report()
+
+    def report(self):
+        now = time.monotonic()
+        current = self.totals()
+        delta = {field: current[field] - self.last[field] for field in current}
+        elapsed = max(now - self.last_time, 1e-9)
+        self.last, self.last_time = current, now
+        if not any(delta.values()):
+            return
+        logger.info(
+            "📊 {messages} messages ({rate:.1f}/s), {rows} rows, {saves} saves, "
+            "{duplicates} duplicates, {errors} errors in {elapsed:.0f}s",
+            rate=delta["messages"] / elapsed,
+            elapsed=elapsed,
+            **delta,
+        )
+
+
+def start_server(host: str = METRICS_HOST, port: int = METRICS_PORT):
+    """
+    Запускает HTTP-сервер метрик в фоновом потоке, если метрики включены
+    """
+    if not enabled:
+        return None
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    thread = threading.Thread(
+        target=server.serve_forever, name="metrics-server", daemon=True
+    )
+    thread.start()
+    logger.info(f"metrics available at http://{host}:{port}/metrics")
+    return server
@@ -1,33 +1,88 @@
+import asyncio
+
 import aio_pika
-import json
 
-from app.config import RABBITMQ_URL, QUEUE_NAME
+from app.config import RABBITMQ_URL, QUEUE_NAME, RABBITMQ_PREFETCH_COUNT
 from app.excel_processor import ExcelProcessor
+from app.writer import ExcelWriter
 from logger.logger import setup_logger
 
 logger = setup_logger(module_name=__name__)
 
 
-async def process_messages(processor: ExcelProcessor):
+async def consume(
+    channel,
+    processor: ExcelProcessor,
+    queue_name: str = QUEUE_NAME,
+    prefetch_count: int = RABBITMQ_PREFETCH_COUNT,
+    writer: ExcelWriter = None,
+):
+    """
+    Читает очередь канала и передаёт сообщения потоку-писателю.
+    Канал может быть каналом aio_pika или InMemoryChannel
+    """
+    writer = writer or ExcelWriter(processor)
+    if prefetch_count:
+        # брокер не выдаст больше prefetch неподтверждённых сообщений,
+        # поэтому пачка или порог сохранения больше prefetch не наберётся:
+        # без таймера сохранения приём остановился бы навсегда
+        if writer.batch_max_size > prefetch_count:
+            logger.warning(
+                f"batch size {writer.batch_max_size} lowered to prefetch {prefetch_count}"
+            )
+            writer.batch_max_size = prefetch_count
+        if processor.flush_max_messages > prefetch_count:
+            logger.warning(
+                f"flush threshold {processor.flush_max_messages} lowered "
+                f"to prefetch {prefetch_count}"
+            )
+            processor.flush_max_messages = prefetch_count
+        await channel.set_qos(prefetch_count=prefetch_count)
+    queue = await channel.declare_queue(queue_name, durable=True)
+
+    logger.info(
+        f"waiting for messages in the queue {queue_name}. To exit, press CTRL+C"
+    )
+
+    # книгу обрабатывает отдельный поток, event loop только принимает сообщения
+    writer.start()
+    try:
+        async for message in queue:
+            await writer.submit(message)
+        await writer.queue.join()
+    finally:
+        await writer.stop()
+
+
+async def process_messages(processor: ExcelProcessor, queue_name: str = QUEUE_NAME):
     connection = await aio_pika.connect_robust(RABBITMQ_URL)
-    queue_name = QUEUE_NAME
 
     async with connection:
         channel = await connection.channel()
-        queue = await channel.declare_queue(queue_name, durable=True)
+        await consume(channel, processor, queue_name)
 
-        logger.info(
-            f"waiting for messages in the queue {queue_name}. To exit, press CTRL+C"
-        )
 
-        async for message in queue:
-            async with message.process():
-                try:
-                    data = json.loads(message.body.decode())
-                    logger.info(f"📩 received message: {data['Date']} {data['City']}")
-                    processor.process_message(data)
-                except Exception as e:
-                    logger.error(f"❌ message processing error: {str(e)}")
-                    import traceback
-
-                    traceback.print_exc()
+async def consume_reports(connection, reports: list):
+    """
+    Читает очереди нескольких отчётов: на каждый отчёт свой канал (и свой
+    prefetch) и свой поток-писатель, отчёты обрабатываются параллельно.
+    reports — [(обработчик, очередь)]
+    """
+    tasks = []
+    for processor, queue_name in reports:
+        channel = await connection.channel()
+        tasks.append(asyncio.create_task(consume(channel, processor, queue_name)))
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        # ошибка одного отчёта останавливает остальные, их писатели дописывают своё
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def process_reports(reports: list):
+    connection = await aio_pika.connect_robust(RABBITMQ_URL)
+
+    async with connection:
+        await consume_reports(connection, reports)
@@ -0,0 +1,74 @@
+import os
+import sqlite3
+import threading
+
+from datetime import datetime
+
+from logger.logger import setup_logger
+
+logger = setup_logger(module_name=__name__)
+
+
+def default_outbox_path(file_path: str, suffix: str = "") -> str:
+    return f"{os.path.splitext(file_path)[0]}{suffix}.outbox.sqlite3"
+
+
+class ReportOutbox:
+    """
+    Письма о заполненных датах (SQLite). Дата записывается, когда письмо
+    поставлено в очередь — до сохранения книги и подтверждения сообщений,
+    а отметка sent_at ставится только после успешной отправки. Даты без
+    отметки отправляются заново при запуске
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # отметки ставит поток отправки писем, даты добавляет поток-писатель
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS reports (
+                date TEXT PRIMARY KEY,
+                completed_at TEXT NOT NULL,
+                sent_at TEXT
+            )
+            """
+        )
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def add(self, date: datetime):
+        """
+        Запоминает, что письмо за дату ещё предстоит отправить
+        """
+        now = datetime.now().isoformat(timespec="seconds")
+        with self.lock:
+            self.conn.execute(
+                """
+                INSERT INTO reports (date, completed_at) VALUES (?, ?)
+                ON CONFLICT (date) DO UPDATE SET
+                    completed_at = excluded.completed_at,
+                    sent_at = NULL
+                """,
+                (date.strftime("%Y-%m-%d"), now),
+            )
+
+    def mark_sent(self, date: datetime):
+        now = datetime.now().isoformat(timespec="seconds")
+        with self.lock:
+            self.conn.execute(
+                "UPDATE reports SET sent_at = ? WHERE date = ?",
+                (now, date.strftime("%Y-%m-%d")),
+            )
+
+    def unsent(self) -> list:
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT date FROM reports WHERE sent_at IS NULL ORDER BY date"
+            ).fetchall()
+        return [datetime.strptime(date, "%Y-%m-%d") for (date,) in rows]
@@ -0,0 +1,99 @@
+import asyncio
+import json
+import os
+
+import aio_pika
+
+from app.config import PARTITIONS, QUEUE_NAME, RABBITMQ_PREFETCH_COUNT, RABBITMQ_URL
+from logger.logger import setup_logger
+
+logger = setup_logger(module_name=__name__)
+
+
+def partition_queue_name(partition: int, queue_name: str = QUEUE_NAME) -> str:
+    return f"{queue_name}.p{partition}"
+
+
+def partition_path(path: str, partition: int) -> str:
+    """
+    Свой файл воркера партиции (журнал, кэш отпечатков, outbox): data/journal.sqlite3
+    -> data/journal.p0.sqlite3. Процессы не делят SQLite-файлы и отметки применения
+    """
+    stem, ext = os.path.splitext(path)
+    return f"{stem}.p{partition}{ext}"
+
+
+def partition_key(data: dict) -> int:
+    """
+    Ключ — порядковый номер месяца даты: воркер целиком владеет книгами своих месяцев
+    """
+    year, month = str(data["Date"]).split("-")[:2]
+    return int(year) * 12 + int(month) - 1
+
+
+def partition_for(key: int, partitions: int) -> int:
+    # соседние месяцы попадают в разные партиции, поэтому загрузка за период
+    # делится между воркерами поровну
+    return key % partitions
+
+
+def route_body(body: bytes, partitions: int) -> int:
+    try:
+        data = json.loads(body.decode())
+        return partition_for(partition_key(data), partitions)
+    except Exception as e:
+        # воркер залогирует и подтвердит такое сообщение, как и без партиций
+        logger.error(f"❌ message routing error: {str(e)}")
+        return 0
+
+
+async def route(
+    channel,
+    partitions: int = PARTITIONS,
+    queue_name: str = QUEUE_NAME,
+    prefetch_count: int = RABBITMQ_PREFETCH_COUNT,
+):
+    """
+    Перекладывает сообщения из общей очереди в очереди партиций.
+    Исходное сообщение подтверждается только после того, как брокер принял копию
+    """
+    if partitions <= 0:
+        raise ValueError("PARTITIONS должно быть больше нуля")
+    if prefetch_count:
+        await channel.set_qos(prefetch_count=prefetch_count)
+    source = await channel.declare_queue(queue_name, durable=True)
+    targets = [partition_queue_name(i, queue_name) for i in range(partitions)]
+    for name in targets:
+        await channel.declare_queue(name, durable=True)
+
+    logger.info(f"routing {queue_name} into {partitions} partitions")
+    async for message in source:
+        target = targets[route_body(message.body, partitions)]
+        try:
+            await channel.default_exchange.publish(
+                aio_pika.Message(
+                    message.body, delivery_mode=aio_pika.DeliveryMode.PERSISTENT
+                ),
+                routing_key=target,
+            )
+        except Exception as e:
+            logger.error(f"❌ publish to {target} failed: {str(e)}")
+            await message.nack(requeue=True)
+            continue
+        await message.ack()
+
+
+async def run_router():
+    connection = await aio_pika.connect_robust(RABBITMQ_URL)
+
+    async with connection:
+        # подтверждения публикации включены: publish ждёт ack брокера
+        channel = await connection.channel(publisher_confirms=True)
+        await route(channel)
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(run_router())
+    except KeyboardInterrupt:
+        logger.info("router stopped by user")
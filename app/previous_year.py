@@ -0,0 +1,101 @@
+import os
+
+from datetime import date, datetime, timedelta
+
+import openpyxl
+
+from app.config import CITY_ORDER
+from app.sheet_index import SECTION_HEADER_RE
+from logger.logger import setup_logger
+
+logger = setup_logger(module_name=__name__)
+
+# столбцов в секции по умолчанию: названия метрик и города CITY_ORDER
+SECTION_WIDTH = 1 + len(CITY_ORDER)
+
+
+def parse_section_date(value) -> date:
+    """
+    Дата из заголовка секции вида "01.03.2024 (Пт)" или None
+    """
+    if not isinstance(value, str) or not SECTION_HEADER_RE.match(value):
+        return None
+    try:
+        return datetime.strptime(value[:10], "%d.%m.%Y").date()
+    except ValueError:
+        return None
+
+
+def same_weekday_years_back(target_date, years: int):
+    """
+    Тот же день недели years лет назад: ближайший не раньше той же даты
+    """
+    prev_date = target_date.replace(year=target_date.year - years)
+    while prev_date.weekday() != target_date.weekday():
+        prev_date += timedelta(days=1)
+    return prev_date
+
+
+class PreviousYearReader:
+    """
+    Кэш секций отчёта за прошлый год: дата -> строки секции (уже вычисленные значения).
+    Файл читается один раз в потоковом режиме и перечитывается только при смене mtime.
+    width — столбцов секции: названия метрик и города отчёта
+    """
+
+    def __init__(self, file_path, width: int = SECTION_WIDTH):
+        self.file_path = file_path
+        self.width = width
+        self.mtime = None
+        self.sections = {}
+
+    def _load(self):
+        sections = {}
+        wb = openpyxl.load_workbook(self.file_path, read_only=True, data_only=True)
+        try:
+            for ws in wb.worksheets:
+                # секции, которые ещё не закрыты пустой строкой
+                open_sections = []
+                for row in ws.iter_rows(max_col=self.width, values_only=True):
+                    row = tuple(row) + (None,) * (self.width - len(row))
+                    # секция заканчивается на первой полностью пустой строке
+                    if all(value in (None, "") for value in row):
+                        open_sections = []
+                        continue
+                    header = row[0]
+                    section_date = parse_section_date(header)
+                    if section_date is not None:
+                        if section_date not in sections:
+                            sections[section_date] = []
+                            open_sections.append(sections[section_date])
+                    for rows in open_sections:
+                        rows.append(row)
+        finally:
+            wb.close()
+
+        self.sections = {key: tuple(rows) for key, rows in sections.items()}
+        logger.info(
+            f"[prev] loaded {len(self.sections)} sections from {self.file_path}"
+        )
+
+    def refresh(self) -> bool:
+        """
+        Перечитывает файл, если он изменился. Возвращает False, если файла нет
+        """
+        try:
+            mtime = os.stat(self.file_path).st_mtime_ns
+        except FileNotFoundError:
+            self.mtime = None
+            self.sections = {}
+            return False
+        if mtime != self.mtime:
+            self._load()
+            self.mtime = mtime
+        return True
+
+    def get_section(self, target_date) -> tuple:
+        if isinstance(target_date, datetime):
+            target_date = target_date.date()
+        if not isinstance(target_date, date) or not self.refresh():
+            return None
+        return self.sections.get(target_date)
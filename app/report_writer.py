@@ -0,0 +1,240 @@
+import argparse
+import os
+
+from io import BytesIO
+
+import openpyxl
+
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+
+from app.attachment import copy_rows
+from app.config import (
+    CITY_ORDER,
+    COLUMN_WIDTHS,
+    EXCEL_PATH_LAST_YEAR,
+    HEADERS,
+    HISTORY_PATH,
+    HISTORY_YEARS,
+    JOURNAL_PATH,
+)
+from app.excel_processor import (
+    format_data_value,
+    format_previous_year_value,
+    section_header,
+    sheet_name_for,
+)
+from app.history import HistoryStore
+from app.journal import Journal
+from app.previous_year import PreviousYearReader, same_weekday_years_back
+from app.section_template import SectionTemplate, sheet_month
+from app.snapshot import replace_file
+from logger.logger import setup_logger
+
+logger = setup_logger(module_name=__name__)
+
+
+def collect_sections(
+    rows, previous_year=None, years: int = 1, city_order=CITY_ORDER
+) -> dict:
+    """
+    Группирует строки (дата, город, значения) по листам.
+    Возвращает {лист: [(дата, {город: значения}, [строки блоков прошлых лет])]}
+    в хронологическом порядке; блоки прошлых лет есть только у заполненных дат
+    (есть все города city_order).
+    previous_year — PreviousYearReader или HistoryStore, years — сколько лет назад
+    """
+    by_date = {}
+    for date, city, values in rows:
+        by_date.setdefault(date, {})[city] = values
+
+    sheets = {}
+    for date in sorted(by_date):
+        cities = by_date[date]
+        prev_blocks = []
+        if previous_year is not None and all(city in cities for city in city_order):
+            for n in range(1, years + 1):
+                prev_rows = previous_year.get_section(same_weekday_years_back(date, n))
+                if prev_rows:
+                    prev_blocks.append(prev_rows)
+        sheets.setdefault(sheet_name_for(date), []).append((date, cities, prev_blocks))
+    return sheets
+
+
+def template_cell(ws, template: SectionTemplate, value, key: str) -> WriteOnlyCell:
+    cell = WriteOnlyCell(ws, value=value)
+    template.apply(cell, key)
+    return cell
+
+
+def section_rows(
+    ws, template: SectionTemplate, date, cities: dict, city_order=CITY_ORDER
+):
+    """
+    Строки секции за дату в том же виде, что даёт create_new_data_section
+    """
+    columns = list(city_order) + [city for city in cities if city not in city_order]
+    yield [
+        template_cell(ws, template, value, "header")
+        for value in [section_header(date)] + columns
+    ]
+    for i, metric in enumerate(HEADERS):
+        row = [template_cell(ws, template, metric, "metric")]
+        for city in columns:
+            if city in cities:
+                value = format_data_value(cities[city][i], i)
+                row.append(template_cell(ws, template, value, "data"))
+            else:
+                row.append(None)
+        yield row
+
+
+def previous_year_rows(ws, template: SectionTemplate, prev_rows, width: int):
+    """
+    Блок прошлого года в том же виде, что даёт insert_previous_year_block:
+    width столбцов — названия метрик и города отчёта
+    """
+    for src_index, values in enumerate(prev_rows):
+        row = []
+        for col, value in enumerate(values[:width], start=1):
+            if col != 1:
+                value = format_previous_year_value(values[0], value)
+            key = template.previous_year_style(src_index, col)
+            row.append(template_cell(ws, template, value, key))
+        yield row
+
+
+def write_report(target, sheets: dict, city_order=CITY_ORDER):
+    """
+    Записывает отчёт в режиме write_only: строки уходят в файл по мере
+    формирования, поэтому память не зависит от размера отчёта.
+    target — путь или файловый объект (например, BytesIO)
+    """
+    wb = Workbook(write_only=True)
+    template = SectionTemplate(wb, city_order)
+    for sheet_name, sections in sheets.items():
+        ws = wb.create_sheet(sheet_name)
+        for col_letter, width in COLUMN_WIDTHS.items():
+            ws.column_dimensions[col_letter].width = width
+
+        # на новом листе первая секция начинается со второй строки
+        ws.append([])
+        for i, (date, cities, prev_blocks) in enumerate(sections):
+            if i:
+                ws.append([])
+            for row in section_rows(ws, template, date, cities, city_order):
+                ws.append(row)
+            for prev_rows in prev_blocks:
+                ws.append([])
+                for row in previous_year_rows(
+                    ws, template, prev_rows, 1 + len(city_order)
+                ):
+                    ws.append(row)
+    wb.save(target)
+
+
+def assemble_workbooks(sources: list, target: str):
+    """
+    Собирает листы нескольких книг в один файл, читая и записывая их потоково.
+    Файл подменяется целиком, поэтому читатель не увидит его наполовину записанным
+    """
+    wb = Workbook(write_only=True)
+    for source in sources:
+        src = openpyxl.load_workbook(source, read_only=True)
+        styles = {}
+        try:
+            for src_ws in src.worksheets:
+                ws = wb.create_sheet(src_ws.title)
+                for col_letter, width in COLUMN_WIDTHS.items():
+                    ws.column_dimensions[col_letter].width = width
+                copy_rows(src_ws, ws, styles)
+        finally:
+            src.close()
+    replace_file(target, wb.save)
+
+
+def replace_sheets(target: str, sheets: dict, city_order=CITY_ORDER):
+    """
+    Подменяет в готовом отчёте только перестроенные листы: остальные листы
+    переносятся потоково без изменений, новые листы добавляются в конец
+    """
+    rebuilt = BytesIO()
+    write_report(rebuilt, sheets, city_order)
+    new = openpyxl.load_workbook(rebuilt, read_only=True)
+    old = openpyxl.load_workbook(target, read_only=True)
+    wb = Workbook(write_only=True)
+    try:
+        titles = old.sheetnames + [
+            title for title in new.sheetnames if title not in old.sheetnames
+        ]
+        new_styles, old_styles = {}, {}
+        for title in titles:
+            if title in new.sheetnames:
+                src_ws, styles = new[title], new_styles
+            else:
+                src_ws, styles = old[title], old_styles
+            ws = wb.create_sheet(title)
+            for col_letter, width in COLUMN_WIDTHS.items():
+                ws.column_dimensions[col_letter].width = width
+            copy_rows(src_ws, ws, styles)
+    finally:
+        new.close()
+        old.close()
+    replace_file(target, wb.save)
+
+
+def regenerate_report(
+    journal: Journal,
+    target,
+    sheet_names: list = None,
+    previous_year=None,
+    years: int = 1,
+    city_order=CITY_ORDER,
+):
+    """
+    Перестраивает весь отчёт или указанные листы по журналу метрик.
+    Для листов из журнала читаются только их месяцы; если target уже есть,
+    в нём подменяются только эти листы. city_order — столбцы городов отчёта
+    """
+    if not sheet_names:
+        journal_rows = journal.since(0)
+    else:
+        journal_rows = []
+        for name in sheet_names:
+            bounds = sheet_month(name)
+            if bounds is None:
+                logger.warning(f"unknown sheet name: {name}")
+                continue
+            journal_rows += journal.between(*bounds)
+    rows = [(date, city, values) for _, date, city, values in journal_rows]
+    sheets = collect_sections(rows, previous_year, years, city_order)
+    if sheet_names and isinstance(target, str) and os.path.exists(target):
+        replace_sheets(target, sheets, city_order)
+    else:
+        write_report(target, sheets, city_order)
+    logger.success(f"report regenerated: {len(sheets)} sheets, {len(rows)} rows")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Перестроение отчёта Excel по журналу метрик"
+    )
+    parser.add_argument("output", help="путь к создаваемому xlsx")
+    parser.add_argument("--journal", default=JOURNAL_PATH)
+    parser.add_argument("--sheet", action="append", help="лист, например 'Март 2025'")
+    parser.add_argument(
+        "--no-previous-year",
+        action="store_true",
+        help="не добавлять блоки прошлого года",
+    )
+    args = parser.parse_args()
+
+    journal = Journal(args.journal)
+    if args.no_previous_year:
+        previous_year, years = None, 1
+    elif HISTORY_PATH:
+        previous_year, years = HistoryStore(HISTORY_PATH), max(HISTORY_YEARS, 1)
+    else:
+        previous_year, years = PreviousYearReader(EXCEL_PATH_LAST_YEAR), 1
+    regenerate_report(journal, args.output, args.sheet, previous_year, years)
+    journal.close()
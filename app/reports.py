@@ -0,0 +1,174 @@
+import json
+
+from app.config import (
+    CITY_MAPPING,
+    CITY_ORDER,
+    DEDUP_CACHE_SIZE,
+    EXCEL_BACKGROUND_SAVE,
+    EXCEL_STORAGE,
+    HISTORY_YEARS,
+)
+from app.dedup import FingerprintCache
+from app.excel_processor import ExcelProcessor
+from app.journal import Journal
+from app.outbox import ReportOutbox, default_outbox_path
+from app.send_email import MailSettings
+from app.sharded_processor import ShardedExcelProcessor
+from app.snapshot import SnapshotSaver
+from logger.logger import setup_logger
+
+logger = setup_logger(module_name=__name__)
+
+# ключ отчёта -> значение по умолчанию (None — обязательный ключ)
+REPORT_KEYS = {
+    "name": None,
+    "queue": None,
+    "excel_path": None,
+    "storage": EXCEL_STORAGE,
+    "shard_dir": "",
+    "cities": None,
+    "city_order": None,
+    "last_year_path": "",
+    "history_path": "",
+    "history_years": HISTORY_YEARS,
+    "journal_path": "",
+    "dedup_cache_path": "",
+    "outbox_path": "",
+    "recipients": None,
+    "from_address": "",
+    "email_password": "",
+    "smtp_server": "",
+    "smtp_port": 0,
+}
+# ключи почты отчёта: пустые берутся из переменных окружения
+MAIL_KEYS = ("recipients", "from_address", "email_password", "smtp_server", "smtp_port")
+
+
+def load_reports(path: str) -> list:
+    """
+    Читает список отчётов из JSON и дополняет значениями по умолчанию.
+    Ошибки конфигурации — ValueError с именем отчёта
+    """
+    with open(path, encoding="utf-8") as f:
+        entries = json.load(f)
+    if not isinstance(entries, list) or not entries:
+        raise ValueError(f"{path}: expected a non-empty list of reports")
+
+    reports = []
+    for number, entry in enumerate(entries, start=1):
+        name = entry.get("name") or f"#{number}"
+        unknown = set(entry) - set(REPORT_KEYS)
+        if unknown:
+            raise ValueError(f"report {name}: unknown keys {sorted(unknown)}")
+        report = {key: entry.get(key, default) for key, default in REPORT_KEYS.items()}
+        missing = [key for key in ("name", "queue", "excel_path") if not report[key]]
+        if missing:
+            raise ValueError(f"report {name}: missing {missing}")
+        if not report["last_year_path"] and not report["history_path"]:
+            raise ValueError(f"report {name}: set last_year_path or history_path")
+        if report["storage"] not in ("single", "monthly"):
+            raise ValueError(f"report {name}: unknown storage {report['storage']}")
+        if report["cities"]:
+            # без city_order столбцы идут в порядке городов из cities
+            order = report["city_order"] or list(
+                dict.fromkeys(report["cities"].values())
+            )
+        else:
+            report["cities"] = CITY_MAPPING
+            order = report["city_order"] or CITY_ORDER
+        # дата заполнена, когда пришли все города city_order: город, которого нет
+        # в cities, не придёт никогда, и письмо по дате не уйдёт
+        unreachable = [city for city in order if city not in report["cities"].values()]
+        if unreachable:
+            raise ValueError(
+                f"report {name}: city_order cities not in cities {unreachable}"
+            )
+        if len(set(order)) != len(order):
+            raise ValueError(f"report {name}: city_order has duplicates")
+        report["city_order"] = list(order)
+        if isinstance(report["recipients"], str):
+            report["recipients"] = [
+                address.strip()
+                for address in report["recipients"].split(",")
+                if address.strip()
+            ]
+        report["outbox_path"] = report["outbox_path"] or default_outbox_path(
+            report["excel_path"]
+        )
+        reports.append(report)
+
+    # у отчётов не должно быть общих очередей и файлов: писатели независимы
+    for key in (
+        "name",
+        "queue",
+        "excel_path",
+        "journal_path",
+        "dedup_cache_path",
+        "outbox_path",
+    ):
+        values = [report[key] for report in reports if report[key]]
+        if len(values) != len(set(values)):
+            raise ValueError(f"{path}: {key} must be unique across reports")
+    return reports
+
+
+def create_mail(report: dict) -> MailSettings:
+    """
+    Почта отчёта; None, если у отчёта нет своих получателей и сервера
+    """
+    if not any(report[key] for key in MAIL_KEYS):
+        return None
+    return MailSettings(
+        recipients=report["recipients"],
+        from_address=report["from_address"],
+        password=report["email_password"],
+        server=report["smtp_server"],
+        port=report["smtp_port"],
+    )
+
+
+def create_processor(report: dict) -> ExcelProcessor:
+    """
+    Обработчик отчёта со своими журналом, кэшем отпечатков и фоновой записью
+    """
+    journal = Journal(report["journal_path"]) if report["journal_path"] else None
+    fingerprints = (
+        FingerprintCache(report["dedup_cache_path"], DEDUP_CACHE_SIZE)
+        if report["dedup_cache_path"]
+        else None
+    )
+    # медленная запись одной книги не задерживает снимки других
+    snapshots = SnapshotSaver().start() if EXCEL_BACKGROUND_SAVE else None
+    kwargs = dict(
+        journal=journal,
+        fingerprints=fingerprints,
+        snapshots=snapshots,
+        name=report["name"],
+        city_mapping=report["cities"],
+        city_order=report["city_order"],
+        last_year_path=report["last_year_path"],
+        history_path=report["history_path"],
+        history_years=report["history_years"],
+        outbox=ReportOutbox(report["outbox_path"]),
+        mail=create_mail(report),
+    )
+    if report["storage"] == "monthly":
+        return ShardedExcelProcessor(
+            report["excel_path"], shard_dir=report["shard_dir"], **kwargs
+        )
+    return ExcelProcessor(report["excel_path"], **kwargs)
+
+
+def open_reports(path: str) -> list:
+    """
+    Обработчики всех отчётов из файла: [(обработчик, очередь)]
+    """
+    reports = load_reports(path)
+    opened = []
+    for report in reports:
+        opened.append((create_processor(report), report["queue"]))
+        logger.info(
+            f"report {report['name']}: queue {report['queue']}, "
+            f"workbook {report['excel_path']}"
+        )
+    return opened
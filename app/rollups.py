@@ -0,0 +1,203 @@
+import math
+
+from datetime import timedelta
+
+from app.config import CITY_ORDER, COLUMN_WIDTHS, HEADERS, MONTH_NAMES
+from app.previous_year import parse_section_date
+from app.section_template import format_data_value
+from logger.logger import setup_logger
+
+logger = setup_logger(module_name=__name__)
+
+WEEK_SHEET = "Итоги по неделям"
+MONTH_SHEET = "Итоги по месяцам"
+ROLLUP_SHEETS = (WEEK_SHEET, MONTH_SHEET)
+# средние взвешиваются числом звонков: ожидание потерянных — по потерянным,
+# ожидание — по всем, разговор — по успешно завершённым (метрика -> вес)
+WEIGHTS = {4: 1, 5: 0, 6: 3}
+COUNTS = 4
+# вклад даты в итог: 4 счётчика и суммы средних, умноженных на вес
+SUMS = COUNTS + len(WEIGHTS)
+
+
+def contribution(values: list) -> tuple:
+    return tuple(values[:COUNTS]) + tuple(
+        values[metric] * values[weight] for metric, weight in WEIGHTS.items()
+    )
+
+
+def parse_seconds(value) -> int:
+    """
+    Значение ячейки с секундами ("14 сек." или число)
+    """
+    if isinstance(value, str):
+        value = value.split()[0] if value.strip() else 0
+    return int(float(value or 0))
+
+
+def period_label(sheet: str, key: tuple) -> str:
+    if sheet == MONTH_SHEET:
+        year, month = key
+        return f"{MONTH_NAMES[month]} {year}"
+    monday = key[2]
+    sunday = monday + timedelta(days=6)
+    return f"{monday:%d.%m.%Y} – {sunday:%d.%m.%Y} (неделя {key[1]})"
+
+
+def periods(date) -> tuple:
+    """
+    Секции итогов, в которые входит дата: (лист, ключ периода)
+    """
+    year, week, _ = date.isocalendar()
+    monday = date - timedelta(days=date.weekday())
+    if hasattr(monday, "date"):
+        monday = monday.date()
+    return (WEEK_SHEET, (year, week, monday)), (MONTH_SHEET, (date.year, date.month))
+
+
+class Rollups:
+    """
+    Итоги по неделям и месяцам для каждого города. Суммы периодов ведутся
+    на лету: новая запись города за дату вычитает прежний вклад этой даты
+    и добавляет новый, после чего переписывается только столбец города
+    в двух секциях итогов. При запуске суммы восстанавливаются по секциям
+    дат в книге (scan), формулы и пересчёт листов не используются.
+    city_order — столбцы городов отчёта, с B
+    """
+
+    def __init__(self, wb, get_template, city_order=CITY_ORDER):
+        self.wb = wb
+        self.get_template = get_template
+        self.city_order = list(city_order)
+        # (дата, город) -> вклад, уже учтённый в суммах
+        self.contributions = {}
+        # (лист, период) -> {город: суммы}
+        self.sums = {}
+        # (лист, период) -> строка заголовка секции и столбцы городов на листе итогов
+        self.rows = {}
+        self.columns = {}
+        self.last_rows = {}
+
+    def add(self, date, city: str, values: list) -> bool:
+        """
+        Учитывает значения города за дату в суммах. False, если они не изменились
+        """
+        key = (date.strftime("%Y-%m-%d"), city)
+        new = contribution(values)
+        old = self.contributions.get(key)
+        if new == old:
+            return False
+        self.contributions[key] = new
+        for period in periods(date):
+            sums = self.sums.setdefault(period, {}).setdefault(city, [0] * SUMS)
+            for i in range(SUMS):
+                sums[i] += new[i] - (old[i] if old else 0)
+        return True
+
+    def apply(self, date, city: str, values: list) -> bool:
+        """
+        Обновляет суммы и столбец города в секциях недели и месяца
+        """
+        if not self.add(date, city, values):
+            return False
+        for period in periods(date):
+            self.write_city(period, city)
+        return True
+
+    def scan(self, ws):
+        """
+        Добавляет в суммы секции дат листа месяца (блоки прошлого года пропускаются).
+        Лист может быть открыт в режиме read_only
+        """
+        section_date, cities, metrics = None, None, []
+        for row in ws.iter_rows(values_only=True):
+            header = row[0] if row else None
+            date = parse_section_date(header)
+            if date is not None:
+                self.scan_section(section_date, cities, metrics)
+                metrics = []
+                # дата своего месяца — секция данных, иначе блок прошлых лет
+                own = f"{MONTH_NAMES[date.month]} {date.year}" == ws.title
+                section_date = date if own else None
+                cities = row[1:]
+            elif section_date is not None and len(metrics) < len(HEADERS):
+                metrics.append(row[1:])
+        self.scan_section(section_date, cities, metrics)
+
+    def scan_section(self, date, cities, metrics: list):
+        if date is None or len(metrics) < COUNTS + len(WEIGHTS):
+            return
+        for col, city in enumerate(cities):
+            # строки листа в режиме read_only бывают короче заголовка
+            column = [row[col] if col < len(row) else None for row in metrics]
+            if not city or column[0] is None:
+                continue
+            values = [int(value or 0) for value in column[:COUNTS]] + [
+                parse_seconds(value) for value in column[COUNTS:SUMS]
+            ]
+            self.add(date, canonical_city(str(city), self.city_order), values)
+
+    def render(self):
+        """
+        Пересоздаёт листы итогов по текущим суммам, периоды по порядку
+        """
+        for title in ROLLUP_SHEETS:
+            if title in self.wb.sheetnames:
+                del self.wb[title]
+        self.rows.clear()
+        self.columns.clear()
+        self.last_rows.clear()
+        for title in ROLLUP_SHEETS:
+            self.sheet(title)
+        for period in sorted(self.sums):
+            for city in self.sums[period]:
+                self.write_city(period, city)
+        logger.info(f"rollups rebuilt: {len(self.sums)} periods")
+
+    def sheet(self, title: str):
+        if title in self.wb.sheetnames:
+            return self.wb[title]
+        ws = self.wb.create_sheet(title)
+        for col_letter, width in COLUMN_WIDTHS.items():
+            ws.column_dimensions[col_letter].width = width
+        return ws
+
+    def write_city(self, period: tuple, city: str):
+        title, key = period
+        ws = self.sheet(title)
+        template = self.get_template(ws)
+        row = self.rows.get(period)
+        if row is None:
+            # новая секция через пустую строку, первая — со второй строки
+            row = self.last_rows.get(title, 0) + 2
+            template.stamp_section(ws, row, period_label(title, key))
+            self.rows[period] = row
+            self.columns[period] = {c: col for col, c in enumerate(self.city_order, 2)}
+            self.last_rows[title] = row + len(HEADERS)
+        columns = self.columns[period]
+        col = columns.get(city)
+        if col is None:
+            col = columns[city] = max(columns.values()) + 1
+            template.put(ws, row, col, city, "header")
+
+        sums = self.sums[period][city]
+        values = list(sums[:COUNTS])
+        for i, weight in enumerate(WEIGHTS.values(), start=COUNTS):
+            weight_sum = sums[weight]
+            values.append(math.floor(sums[i] / weight_sum + 0.5) if weight_sum else 0)
+        total, lost = sums[0], sums[1]
+        values.append(round(lost / total * 100, 1) if total > 0 else 0)
+        for i, value in enumerate(values):
+            template.put(ws, row + 1 + i, col, format_data_value(value, i), "data")
+
+
+def canonical_city(name: str, city_order=CITY_ORDER) -> str:
+    """
+    Город из заголовка секции в написании city_order (заголовок может
+    содержать не только город, например "Москва (МСК)")
+    """
+    lowered = name.lower().strip()
+    for city in city_order:
+        if city.lower() in lowered:
+            return city
+    return name
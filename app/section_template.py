@@ -0,0 +1,156 @@
+from copy import copy
+from datetime import datetime
+
+from openpyxl.styles import Font, NamedStyle, PatternFill
+from openpyxl.styles.fonts import DEFAULT_FONT
+
+from app.config import (
+    CITY_ORDER,
+    DATA_ALIGNMENT,
+    HEADER_ALIGNMENT,
+    HEADER_FILL,
+    HEADER_FONT,
+    HEADERS,
+    METRIC_ALIGNMENT,
+    METRIC_FILL,
+    MONTH_NAMES,
+    THICK_BORDER,
+    WEEKDAYS,
+)
+
+
+def section_styles() -> dict:
+    """
+    Именованные стили отчёта. Объекты создаются заново для каждой книги:
+    openpyxl привязывает NamedStyle к книге, в которую его добавили
+    """
+    return {
+        "header": NamedStyle(
+            name="stat_header",
+            font=HEADER_FONT,
+            fill=HEADER_FILL,
+            alignment=HEADER_ALIGNMENT,
+            border=THICK_BORDER,
+        ),
+        "metric": NamedStyle(
+            name="stat_metric",
+            font=DEFAULT_FONT,
+            fill=METRIC_FILL,
+            alignment=METRIC_ALIGNMENT,
+            border=THICK_BORDER,
+        ),
+        "data": NamedStyle(
+            name="stat_data",
+            font=DEFAULT_FONT,
+            alignment=DATA_ALIGNMENT,
+            border=THICK_BORDER,
+        ),
+        "prev_metric": NamedStyle(
+            name="stat_prev_metric",
+            font=Font(bold=False),
+            fill=METRIC_FILL,
+            alignment=METRIC_ALIGNMENT,
+            border=THICK_BORDER,
+        ),
+        "prev_data": NamedStyle(
+            name="stat_prev_data",
+            font=Font(bold=False),
+            fill=PatternFill(fill_type=None),
+            alignment=DATA_ALIGNMENT,
+            border=THICK_BORDER,
+        ),
+    }
+
+
+def section_header(date) -> str:
+    return f"{date.strftime('%d.%m.%Y')} ({WEEKDAYS[date.weekday()]})"
+
+
+def sheet_name_for(date) -> str:
+    return f"{MONTH_NAMES[date.month]} {date.year}"
+
+
+def sheet_month(name: str) -> tuple:
+    """
+    Первый день месяца листа и первый день следующего месяца;
+    для листа с другим именем — None
+    """
+    month_name, _, year = name.rpartition(" ")
+    months = {title: month for month, title in MONTH_NAMES.items()}
+    if month_name not in months or not year.isdigit():
+        return None
+    start = datetime(int(year), months[month_name], 1)
+    if start.month == 12:
+        return start, datetime(start.year + 1, 1, 1)
+    return start, datetime(start.year, start.month + 1, 1)
+
+
+def format_data_value(value, index: int):
+    """
+    Значение ячейки с данными: секунды с подписью, доля потерь в процентах
+    """
+    if index in [4, 5, 6]:
+        return f"{value} сек."
+    elif index == 7:
+        try:
+            num = float(value)
+            if num == int(num):
+                return f"{int(num)}%"
+            else:
+                return f"{num:.1f}%".replace(".", ",")
+        except (ValueError, TypeError):
+            return value
+    return value
+
+
+def section_layout(cities) -> tuple:
+    """
+    Раскладка секции за дату относительно строки заголовка:
+    (строка, столбец, значение, стиль); ячейка A заголовка (дата)
+    заполняется при штамповке
+    """
+    return tuple(
+        [(0, col, city, "header") for col, city in enumerate(cities, start=2)]
+        + [(i, 1, metric, "metric") for i, metric in enumerate(HEADERS, start=1)]
+    )
+
+
+class SectionTemplate:
+    """
+    Шаблон секций для одной книги: стили регистрируются один раз,
+    ячейки получают уже готовый набор идентификаторов стилей без пересчёта.
+    cities — столбцы городов в заголовке секции
+    """
+
+    def __init__(self, wb, cities=CITY_ORDER):
+        self.layout = section_layout(cities)
+        self.styles = {}
+        for key, style in section_styles().items():
+            if style.name in wb.named_styles:
+                # книга уже сохранялась с этими стилями
+                style = wb._named_styles[style.name]
+            else:
+                wb.add_named_style(style)
+            self.styles[key] = style.as_tuple()
+
+    def apply(self, cell, key: str):
+        cell._style = copy(self.styles[key])
+
+    def put(self, ws, row: int, col: int, value, key: str):
+        cell = ws.cell(row=row, column=col)
+        cell.value = value
+        cell._style = copy(self.styles[key])
+        return cell
+
+    def stamp_section(self, ws, row: int, header: str):
+        """
+        Заголовок секции с городами и названия метрик
+        """
+        self.put(ws, row, 1, header, "header")
+        for offset, col, value, key in self.layout:
+            self.put(ws, row + offset, col, value, key)
+
+    def previous_year_style(self, row_index: int, col: int) -> str:
+        if row_index == 0:
+            return "header"
+        return "prev_metric" if col == 1 else "prev_data"
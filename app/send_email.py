@@ -1,68 +1,389 @@
 import smtplib
+import queue
+import threading
+import time
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.mime.base import MIMEBase
-from email import encoders
+from email import encoders, policy
 import os
 
+from app import metrics
 from logger.logger import setup_logger
 
 logger = setup_logger(module_name=__name__)
 
-EMAIL_RECIPIENTS = os.getenv(
-    "EMAIL_RECIPIENTS", "email1@example.com,email2@example.com,email3@example.com"
-).split(",")
+EMAIL_RECIPIENTS = [
+    address.strip()
+    for address in os.getenv(
+        "EMAIL_RECIPIENTS", "email1@example.com,email2@example.com,email3@example.com"
+    ).split(",")
+    if address.strip()
+]
 FROM_ADDRESS = os.getenv("FROM_ADDRESS", "your_email@example.com")
 EMAIL_PASSWORD = os.getenv("EMAIL_PASSWORD", "your_password")
 SMTP_SERVER = os.getenv("SMTP_SERVER", "smtp.gmail.com")
 SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "true").lower() == "true"
+SMTP_LOGIN = os.getenv("SMTP_LOGIN", "true").lower() == "true"
+SMTP_TIMEOUT = float(os.getenv("SMTP_TIMEOUT", "30"))
 
+# тестовый режим: локальный SMTP без TLS и авторизации,
+# например `python -m aiosmtpd -n -l localhost:8025`
+EMAIL_TEST_MODE = os.getenv("EMAIL_TEST_MODE", "false").lower() == "true"
+if EMAIL_TEST_MODE:
+    SMTP_SERVER = os.getenv("SMTP_TEST_SERVER", "localhost")
+    SMTP_PORT = int(os.getenv("SMTP_TEST_PORT", "8025"))
+    SMTP_STARTTLS = False
+    SMTP_LOGIN = False
 
-def send_email_with_attachment(subject, body, file_path):
+# фоновая отправка: размер очереди и окно склейки писем за одну дату (секунды)
+EMAIL_ASYNC = os.getenv("EMAIL_ASYNC", "true").lower() == "true"
+EMAIL_QUEUE_SIZE = int(os.getenv("EMAIL_QUEUE_SIZE", "10"))
+EMAIL_COALESCE_WINDOW = float(os.getenv("EMAIL_COALESCE_WINDOW", "2"))
+# сколько ждать места в заполненной очереди (секунды), потом письмо уходит сразу
+EMAIL_SUBMIT_TIMEOUT = float(os.getenv("EMAIL_SUBMIT_TIMEOUT", "30"))
+# вложение: date — секция даты и блок прошлого года, month — лист месяца,
+# full — файл отчёта целиком
+EMAIL_ATTACHMENT_MODE = os.getenv("EMAIL_ATTACHMENT_MODE", "date").lower()
+
+
+class MailSettings:
+    """
+    Получатели, отправитель и SMTP-сервер отчёта.
+    Не указанные параметры берутся из переменных окружения
+    """
+
+    def __init__(
+        self,
+        recipients: list = None,
+        from_address: str = None,
+        password: str = None,
+        server: str = None,
+        port: int = None,
+    ):
+        self.recipients = list(recipients or EMAIL_RECIPIENTS)
+        self.from_address = from_address or FROM_ADDRESS
+        self.password = password or EMAIL_PASSWORD
+        self.server = server or SMTP_SERVER
+        self.port = int(port or SMTP_PORT)
+
+    @property
+    def key(self) -> tuple:
+        """
+        Отчёты с одинаковым ключом отправляют письма через одно соединение
+        """
+        return self.server, self.port, self.from_address
+
+    def connect(self) -> smtplib.SMTP:
+        server = smtplib.SMTP(self.server, self.port, timeout=SMTP_TIMEOUT)
+        if SMTP_STARTTLS:
+            server.starttls()
+        if SMTP_LOGIN:
+            server.login(self.from_address, self.password)
+        return server
+
+
+DEFAULT_MAIL = MailSettings()
+
+
+def smtp_connect() -> smtplib.SMTP:
+    return DEFAULT_MAIL.connect()
+
+
+def get_mime_type(filename: str) -> tuple:
+    if filename.lower().endswith(".xlsx"):
+        return "application", "vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    elif filename.lower().endswith(".xls"):
+        return "application", "vnd.ms-excel"
+    return "application", "octet-stream"
+
+
+def build_message(
+    subject, body, filename, payload: bytes, mail: MailSettings = DEFAULT_MAIL
+) -> bytes:
     """
-    Отправляет email с вложением на несколько адресов
+    Собирает письмо с вложением один раз для всех получателей
     """
+    msg = MIMEMultipart()
+    msg["From"] = mail.from_address
+    msg["To"] = ", ".join(mail.recipients)
+    msg["Subject"] = subject
+    msg.attach(MIMEText(body, "plain"))
+
+    maintype, subtype = get_mime_type(filename)
+    logger.info(f"attaching file: {filename} with MIME type: {maintype}/{subtype}")
+
+    part = MIMEBase(maintype, subtype)
+    part.set_payload(payload)
+    encoders.encode_base64(part)
+    part.add_header("Content-Disposition", f'attachment; filename="{filename}"')
+    msg.attach(part)
+    # smtplib не исправляет переводы строк в bytes, поэтому сразу пишем CRLF
+    return msg.as_bytes(policy=policy.compat32.clone(linesep="\r\n"))
+
+
+class SMTPConnection:
+    """
+    Долгоживущее авторизованное SMTP-соединение.
+    Переподключается, если сервер закрыл соединение. Им пользуются потоки-писатели
+    отчётов и поток записи снимков, поэтому обращения идут под блокировкой
+    """
+
+    def __init__(self, connect=smtp_connect):
+        self.connect = connect
+        self.server = None
+        self.lock = threading.RLock()
+
+    def get(self):
+        if self.server is not None:
+            try:
+                if self.server.noop()[0] == 250:
+                    return self.server
+            except (smtplib.SMTPException, OSError):
+                pass
+            self.close()
+        self.server = self.connect()
+        return self.server
+
+    def close(self):
+        with self.lock:
+            if self.server is None:
+                return
+            try:
+                self.server.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self.server = None
+
+    def send(self, recipients: list, message: bytes, from_address: str = None):
+        from_address = from_address or FROM_ADDRESS
+        with self.lock:
+            try:
+                self.get().sendmail(from_address, recipients, message)
+            except (smtplib.SMTPServerDisconnected, OSError):
+                # соединение оборвалось между проверкой и отправкой — одна повторная попытка
+                self.close()
+                self.get().sendmail(from_address, recipients, message)
+
+
+class SMTPConnections:
+    """
+    SMTP-соединения по серверу и отправителю: у отчётов могут быть свои.
+    Письма с настройками по умолчанию идут через default
+    """
+
+    def __init__(self, default: SMTPConnection = None):
+        self.default = default or SMTPConnection()
+        self.connections = {}
+        self.lock = threading.Lock()
+
+    def get(self, mail: MailSettings) -> SMTPConnection:
+        if mail.key == DEFAULT_MAIL.key:
+            return self.default
+        with self.lock:
+            connection = self.connections.get(mail.key)
+            if connection is None:
+                connection = self.connections[mail.key] = SMTPConnection(mail.connect)
+        return connection
+
+    def close(self):
+        self.default.close()
+        for connection in list(self.connections.values()):
+            connection.close()
+
+
+_connections = SMTPConnections()
+
+
+def send_email_with_attachment(
+    subject, body, file_path, payload: bytes = None, mail: MailSettings = None
+) -> bool:
+    """
+    Отправляет email с вложением на несколько адресов. Если передан payload,
+    file_path — только имя вложения; mail — настройки отчёта.
+    Возвращает True, если письмо отправлено
+    """
+    mail = mail or DEFAULT_MAIL
+    connection = _connections.get(mail)
     try:
-        msg = MIMEMultipart()
-        msg["From"] = FROM_ADDRESS
-        msg["Subject"] = subject
-        msg.attach(MIMEText(body, "plain"))
-
-        filename = os.path.basename(file_path)
-
-        if filename.lower().endswith(".xlsx"):
-            maintype = "application"
-            subtype = "vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-        elif filename.lower().endswith(".xls"):
-            maintype = "application"
-            subtype = "vnd.ms-excel"
-        else:
-            maintype = "application"
-            subtype = "octet-stream"
-
-        logger.info(f"attaching file: {filename} with MIME type: {maintype}/{subtype}")
-
-        with open(file_path, "rb") as attachment:
-            part = MIMEBase(maintype, subtype)
-            part.set_payload(attachment.read())
-
-        encoders.encode_base64(part)
-        part.add_header("Content-Disposition", f'attachment; filename="{filename}"')
-        msg.attach(part)
-
-        server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT)
-        server.starttls()
-        server.login(FROM_ADDRESS, EMAIL_PASSWORD)
-
-        for to_address in EMAIL_RECIPIENTS:
-            to_address = to_address.strip()
-            msg["To"] = to_address
-            text = msg.as_string()
-            server.sendmail(FROM_ADDRESS, to_address, text)
-            del msg["To"]
-
-        server.quit()
-        logger.success(f"excel file sent to {len(EMAIL_RECIPIENTS)} addresses")
+        if payload is None:
+            with open(file_path, "rb") as attachment:
+                payload = attachment.read()
+        with metrics.timed("email"):
+            message = build_message(
+                subject, body, os.path.basename(file_path), payload, mail
+            )
+            connection.send(mail.recipients, message, mail.from_address)
+        metrics.inc("emails_sent_total")
+        logger.success(f"excel file sent to {len(mail.recipients)} addresses")
+        return True
 
     except Exception as e:
+        connection.close()
+        metrics.inc("email_errors_total")
         logger.error(f"failed to send file via email: {e}")
+        return False
+
+
+class EmailDispatcher:
+    """
+    Фоновая отправка писем: ограниченная очередь, одно переиспользуемое
+    SMTP-соединение и склейка подряд идущих отчётов за одну дату
+    """
+
+    def __init__(
+        self,
+        maxsize: int = EMAIL_QUEUE_SIZE,
+        coalesce_window: float = EMAIL_COALESCE_WINDOW,
+        connection: SMTPConnection = None,
+        submit_timeout: float = EMAIL_SUBMIT_TIMEOUT,
+    ):
+        self.queue = queue.Queue(maxsize)
+        self.coalesce_window = coalesce_window
+        self.submit_timeout = submit_timeout
+        self.connections = SMTPConnections(connection)
+        self.thread = threading.Thread(
+            target=self.run, name="email-dispatcher", daemon=True
+        )
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self, timeout: float = None):
+        """
+        Отправляет то, что уже в очереди, и останавливает поток
+        """
+        self.queue.put(None)
+        self.thread.join(timeout)
+
+    def submit(
+        self,
+        subject,
+        body,
+        file_path,
+        key=None,
+        payload: bytes = None,
+        on_sent=None,
+        mail: MailSettings = None,
+    ) -> bool:
+        # файл читается сразу: к моменту отправки его может перезаписать следующее сохранение
+        if payload is None:
+            try:
+                with open(file_path, "rb") as attachment:
+                    payload = attachment.read()
+            except OSError as e:
+                logger.error(f"failed to read attachment {file_path}: {e}")
+                return False
+        # on_sent вызывается в потоке отправки после успешной отправки письма
+        job = (
+            key or subject,
+            subject,
+            body,
+            os.path.basename(file_path),
+            payload,
+            on_sent,
+            mail or DEFAULT_MAIL,
+        )
+        try:
+            # заполненная очередь притормаживает писателя, а не теряет отчёт
+            self.queue.put(job, timeout=self.submit_timeout)
+        except queue.Full:
+            logger.warning(f"email queue is full, sending synchronously: {subject}")
+            return self.deliver(job)
+        metrics.set_gauge("email_queue_depth", self.queue.qsize())
+        return True
+
+    def collect(self, first) -> tuple:
+        """
+        Добирает задания в течение окна склейки; для одного ключа остаётся последнее
+        """
+        jobs = {first[0]: first}
+        deadline = time.monotonic() + self.coalesce_window
+        while True:
+            timeout = deadline - time.monotonic()
+            try:
+                if timeout > 0:
+                    job = self.queue.get(timeout=timeout)
+                else:
+                    job = self.queue.get_nowait()
+            except queue.Empty:
+                return jobs, False
+            if job is None:
+                return jobs, True
+            if job[0] in jobs:
+                logger.info(f"coalesced email for {job[0]}")
+            jobs[job[0]] = job
+
+    def deliver(self, job) -> bool:
+        _, subject, body, filename, payload, on_sent, mail = job
+        connection = self.connections.get(mail)
+        try:
+            with metrics.timed("email"):
+                message = build_message(subject, body, filename, payload, mail)
+                connection.send(mail.recipients, message, mail.from_address)
+            metrics.inc("emails_sent_total")
+            logger.success(f"excel file sent to {len(mail.recipients)} addresses")
+        except Exception as e:
+            connection.close()
+            metrics.inc("email_errors_total")
+            logger.error(f"failed to send file via email: {e}")
+            return False
+        if on_sent is not None:
+            try:
+                on_sent()
+            except Exception as e:
+                logger.error(f"failed to mark email as sent: {e}")
+        return True
+
+    def run(self):
+        stopping = False
+        while not stopping:
+            first = self.queue.get()
+            if first is None:
+                break
+            jobs, stopping = self.collect(first)
+            metrics.set_gauge("email_queue_depth", self.queue.qsize())
+            for job in jobs.values():
+                self.deliver(job)
+        self.connections.close()
+
+
+_dispatcher = None
+
+
+def start_dispatcher(**kwargs) -> EmailDispatcher:
+    global _dispatcher
+    if _dispatcher is None:
+        _dispatcher = EmailDispatcher(**kwargs).start()
+    return _dispatcher
+
+
+def stop_dispatcher(timeout: float = None):
+    global _dispatcher
+    if _dispatcher is not None:
+        _dispatcher.stop(timeout)
+        _dispatcher = None
+
+
+def send_report(
+    subject,
+    body,
+    file_path,
+    key=None,
+    payload: bytes = None,
+    on_sent=None,
+    mail: MailSettings = None,
+):
+    """
+    Отправляет отчёт через фоновый диспетчер, если он запущен, иначе сразу.
+    payload — готовое вложение, тогда file_path задаёт только его имя;
+    on_sent вызывается после успешной отправки; mail — получатели,
+    отправитель и SMTP-сервер отчёта (по умолчанию из переменных окружения)
+    """
+    if _dispatcher is not None:
+        _dispatcher.submit(subject, body, file_path, key, payload, on_sent, mail)
+    elif send_email_with_attachment(subject, body, file_path, payload, mail):
+        if on_sent is not None:
+            on_sent()
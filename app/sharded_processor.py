@@ -0,0 +1,256 @@
+import argparse
+import os
+import re
+import threading
+
+from collections import OrderedDict
+from io import BytesIO
+
+import openpyxl
+
+from app import metrics
+from app.config import (
+    COLUMN_WIDTHS,
+    EXCEL_ASSEMBLE_INTERVAL,
+    EXCEL_PATH,
+    EXCEL_SHARD_DIR,
+    EXCEL_SHARDS_LOADED,
+    MONTH_NAMES,
+    PARTITIONS,
+)
+from app.excel_processor import ExcelProcessor, open_workbook, sheet_name_for
+from app.attachment import copy_rows
+from app.report_writer import assemble_workbooks
+from app.rollups import Rollups
+from app.section_template import SectionTemplate
+from logger.logger import setup_logger
+
+logger = setup_logger(module_name=__name__)
+
+SHARD_FILE_RE = re.compile(r"^\d{4}-\d{2}\.xlsx$")
+MONTH_NUMBERS = {name: number for number, name in MONTH_NAMES.items()}
+
+
+def shard_key(date) -> str:
+    return f"{date.year}-{date.month:02d}"
+
+
+def shard_key_for_sheet(sheet_name: str) -> str:
+    """
+    Ключ месяца по названию листа вида "Март 2025" или None
+    """
+    parts = sheet_name.split()
+    if len(parts) != 2 or parts[0] not in MONTH_NUMBERS or not parts[1].isdigit():
+        return None
+    return f"{parts[1]}-{MONTH_NUMBERS[parts[0]]:02d}"
+
+
+def default_shard_dir(file_path: str) -> str:
+    return f"{os.path.splitext(file_path)[0]}_months"
+
+
+class ShardedExcelProcessor(ExcelProcessor):
+    """
+    Хранит каждый месяц в отдельной книге и загружает только те месяцы,
+    в которые идёт запись. Общий файл отчёта (file_path) собирается из книг
+    месяцев перед письмом с вложением full, по таймеру и при остановке
+    """
+
+    def __init__(
+        self,
+        file_path,
+        shard_dir: str = EXCEL_SHARD_DIR,
+        max_loaded: int = EXCEL_SHARDS_LOADED,
+        assemble_interval: float = EXCEL_ASSEMBLE_INTERVAL,
+        partitioned: bool = PARTITIONS > 0,
+        **kwargs,
+    ):
+        self.shard_dir = shard_dir or default_shard_dir(file_path)
+        self.max_loaded = max(max_loaded, 1)
+        # загруженные книги месяцев, последняя — та, куда писали последней
+        self.shards = OrderedDict()
+        self.dirty_shards = set()
+        os.makedirs(self.shard_dir, exist_ok=True)
+        super().__init__(file_path, **kwargs)
+        self.assemble_interval = assemble_interval
+        # книги месяцев сохранялись после последней сборки file_path
+        self.report_stale = False
+        # у воркера партиции только свои месяцы: итоги собираются при сборке
+        # по книгам всех воркеров. Иначе суммы итогов ведутся на лету в книге
+        # в памяти, а книги месяцев сканируются один раз — при запуске
+        self.partitioned = partitioned
+        # книгу итогов дополняет поток-писатель, а сериализует и поток снимков
+        # (письмо с вложением full)
+        self.rollups_lock = threading.Lock()
+
+    def load_workbook(self):
+        # общая книга не загружается: месяцы открываются по требованию
+        return None
+
+    def shard_path(self, key: str) -> str:
+        return os.path.join(self.shard_dir, f"{key}.xlsx")
+
+    def storage_path(self, date) -> str:
+        return self.shard_path(shard_key(date))
+
+    def has_worksheet(self, date) -> bool:
+        # в книге месяца один лист, поэтому достаточно самой книги
+        return shard_key(date) in self.shards or os.path.exists(self.storage_path(date))
+
+    def shard_files(self) -> list:
+        return [
+            os.path.join(self.shard_dir, name)
+            for name in sorted(os.listdir(self.shard_dir))
+            if SHARD_FILE_RE.match(name)
+        ]
+
+    def update_rollups(self, date, city_name: str, values: list):
+        if self.partitioned:
+            # у воркеров партиций разные месяцы, а неделя может захватить два
+            # месяца: итоги считаются при сборке отчёта
+            return
+        with self.rollups_lock:
+            super().update_rollups(date, city_name, values)
+
+    def get_rollups(self) -> Rollups:
+        if self.rollups is None:
+            with metrics.timed("rollups_rebuild"):
+                self.rollups = self.scan_rollups()
+        return self.rollups
+
+    def scan_rollups(self) -> Rollups:
+        """
+        Итоги по всем книгам месяцев на диске (в том числе книгам других
+        воркеров) в отдельной книге в памяти
+        """
+        wb = openpyxl.Workbook()
+        del wb["Sheet"]
+        template = SectionTemplate(wb, self.city_order)
+        rollups = Rollups(wb, lambda ws: template, self.city_order)
+        for path in self.shard_files():
+            src = openpyxl.load_workbook(path, read_only=True)
+            try:
+                for ws in src.worksheets:
+                    rollups.scan(ws)
+            finally:
+                src.close()
+        rollups.render()
+        return rollups
+
+    def build_rollups(self) -> BytesIO:
+        """
+        Книга с листами итогов для сборки отчёта, в памяти
+        """
+        buffer = BytesIO()
+        if self.partitioned:
+            self.scan_rollups().wb.save(buffer)
+            return buffer
+        with self.rollups_lock:
+            self.get_rollups().wb.save(buffer)
+        return buffer
+
+    def owns(self, ws) -> bool:
+        return any(ws.parent is wb for wb in self.shards.values())
+
+    def get_worksheet(self, date):
+        key = shard_key(date)
+        wb = self.shards.get(key)
+        if wb is None:
+            # выгруженный месяц мог ещё не дойти до диска в фоновом снимке
+            self.wait_saved()
+            self.load_saved_indexes(self.shard_path(key))
+            wb = open_workbook(self.shard_path(key))
+            self.shards[key] = wb
+            logger.info(f"month workbook loaded: {key}")
+        self.shards.move_to_end(key)
+        # лист берут только для записи, поэтому месяц сразу считается изменённым
+        self.dirty_shards.add(key)
+
+        sheet_name = sheet_name_for(date)
+        if sheet_name not in wb.sheetnames:
+            return self.create_new_sheet(sheet_name, wb)
+        return wb[sheet_name]
+
+    def save(self) -> list:
+        saved = []
+        for key in sorted(self.dirty_shards):
+            path = self.shard_path(key)
+            # атомарная подмена: сборщик отчёта в другом процессе не увидит
+            # наполовину записанный файл месяца
+            self.write_file(self.shards[key], path)
+            saved.append(path)
+        self.dirty_shards.clear()
+        if saved:
+            self.report_stale = True
+        self.evict()
+        return saved
+
+    def evict(self):
+        """
+        Выгружает сохранённые месяцы сверх max_loaded, начиная с самых давних
+        """
+        while len(self.shards) > self.max_loaded:
+            key, wb = self.shards.popitem(last=False)
+            for ws in wb.worksheets:
+                self.sheet_indexes.pop(ws, None)
+            self.templates.pop(wb, None)
+            logger.info(f"month workbook unloaded: {key}")
+
+    def report_path(self) -> str:
+        with metrics.timed("assemble"):
+            sources = self.shard_files()
+            if self.rollups_enabled:
+                sources.append(self.build_rollups())
+            assemble_workbooks(sources, self.file_path)
+        self.report_stale = False
+        logger.info(f"report assembled from month workbooks: {self.file_path}")
+        return self.file_path
+
+    def assemble_report(self) -> bool:
+        # в фоновом режиме последние книги месяцев могут ещё писаться на диск
+        self.wait_saved()
+        if not self.report_stale:
+            return False
+        self.report_path()
+        return True
+
+
+def split_workbook(source: str, shard_dir: str) -> int:
+    """
+    Раскладывает листы общей книги по книгам месяцев. Возвращает число листов
+    """
+    os.makedirs(shard_dir, exist_ok=True)
+    src = openpyxl.load_workbook(source, read_only=True)
+    count = 0
+    try:
+        for src_ws in src.worksheets:
+            key = shard_key_for_sheet(src_ws.title)
+            if key is None:
+                logger.warning(f"sheet skipped, not a month: {src_ws.title}")
+                continue
+            wb = openpyxl.Workbook(write_only=True)
+            ws = wb.create_sheet(src_ws.title)
+            for col_letter, width in COLUMN_WIDTHS.items():
+                ws.column_dimensions[col_letter].width = width
+            copy_rows(src_ws, ws)
+            wb.save(os.path.join(shard_dir, f"{key}.xlsx"))
+            count += 1
+    finally:
+        src.close()
+    logger.success(f"{count} sheets split into {shard_dir}")
+    return count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Книги Excel по месяцам")
+    parser.add_argument("command", choices=["split", "assemble"])
+    parser.add_argument("--excel", default=EXCEL_PATH, help="общий файл отчёта")
+    parser.add_argument("--shard-dir", default=EXCEL_SHARD_DIR)
+    args = parser.parse_args()
+
+    shard_dir = args.shard_dir or default_shard_dir(args.excel)
+    if args.command == "split":
+        split_workbook(args.excel, shard_dir)
+    else:
+        processor = ShardedExcelProcessor(args.excel, shard_dir=shard_dir)
+        processor.report_path()
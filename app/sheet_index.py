@@ -0,0 +1,161 @@
+import re
+
+from bisect import bisect_right, insort
+
+from app.config import CITY_ORDER, HEADERS
+
+SECTION_HEADER_RE = re.compile(r"^\d{2}\.\d{2}\.\d{4} \(.+\)$")
+
+
+class SheetIndex:
+    """
+    Индекс листа: заголовок секции -> строка, строка заголовка -> столбцы городов.
+    Строится один раз при первом обращении к листу и дополняется при записи,
+    чтобы поиск не зависел от размера листа.
+    city_count — число городов отчёта: дата заполнена, когда во всех столбцах
+    городов, начиная с B, есть все метрики
+    """
+
+    def __init__(self, ws, city_count: int = len(CITY_ORDER)):
+        self.set_city_count(city_count)
+        self.sections = {}
+        self.header_rows = []
+        self.city_columns = {}
+        # заполненность секций: строка заголовка -> маска (город × метрика)
+        self.filled = {}
+        # секции, заполнение которых уже обработано (блок прошлого года, письмо)
+        self.completed = set()
+        self.last_row = ws.max_row
+        self.max_column = ws.max_column
+
+        for row, (value,) in enumerate(
+            ws.iter_rows(min_col=1, max_col=1, values_only=True), start=1
+        ):
+            if isinstance(value, str) and SECTION_HEADER_RE.match(value):
+                self.add_section(value, row)
+
+        for row in self.header_rows:
+            for col in range(2, self.max_column + 1):
+                value = ws.cell(row, col).value
+                if value:
+                    self.add_city(row, str(value), col)
+
+        # ws._cells читается напрямую: ws.cell создал бы пустые ячейки
+        cells = ws._cells
+        for row in self.header_rows:
+            mask = 0
+            for col in self.filled_columns:
+                for i in range(len(HEADERS)):
+                    cell = cells.get((row + 1 + i, col))
+                    if cell is not None and cell.value is not None:
+                        mask |= self.metric_bits(col, 1) << i
+            self.filled[row] = mask
+            if mask == self.full_mask:
+                # дата была заполнена до запуска: событие уже отработало
+                self.completed.add(row)
+
+    def to_dict(self) -> dict:
+        """
+        Копия состояния индекса для файла-спутника книги (ключи JSON — строки)
+        """
+        return {
+            "sections": dict(self.sections),
+            "header_rows": list(self.header_rows),
+            "city_columns": {
+                str(row): dict(cols) for row, cols in self.city_columns.items()
+            },
+            "filled": {str(row): mask for row, mask in self.filled.items()},
+            "completed": sorted(self.completed),
+            "last_row": self.last_row,
+            "max_column": self.max_column,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict, city_count: int = len(CITY_ORDER)) -> "SheetIndex":
+        """
+        Индекс из файла-спутника — без чтения листа
+        """
+        index = cls.__new__(cls)
+        index.set_city_count(city_count)
+        index.sections = dict(data["sections"])
+        index.header_rows = list(data["header_rows"])
+        index.city_columns = {
+            int(row): dict(cols) for row, cols in data["city_columns"].items()
+        }
+        index.filled = {int(row): mask for row, mask in data["filled"].items()}
+        index.completed = set(data["completed"])
+        index.last_row = data["last_row"]
+        index.max_column = data["max_column"]
+        return index
+
+    def set_city_count(self, city_count: int):
+        self.filled_columns = range(2, 2 + city_count)
+        self.full_mask = (1 << (city_count * len(HEADERS))) - 1
+
+    def metric_bits(self, col: int, count: int = len(HEADERS)) -> int:
+        """
+        Биты первых count метрик города в маске заполненности секции
+        """
+        if col not in self.filled_columns:
+            return 0
+        return ((1 << count) - 1) << ((col - self.filled_columns.start) * len(HEADERS))
+
+    def add_section(self, header: str, row: int):
+        self.sections.setdefault(header, row)
+        insort(self.header_rows, row)
+        self.city_columns.setdefault(row, {})
+        self.touch(row, 1)
+
+    def add_city(self, row: int, city: str, col: int):
+        self.city_columns.setdefault(row, {}).setdefault(city.lower().strip(), col)
+        self.touch(row, col)
+
+    def touch(self, row: int, col: int):
+        if row > self.last_row:
+            self.last_row = row
+        if col > self.max_column:
+            self.max_column = col
+
+    def fill(self, row: int, col: int, count: int = len(HEADERS)):
+        """
+        Отмечает записанными первые count метрик города в секции
+        """
+        self.filled[row] = self.filled.get(row, 0) | self.metric_bits(col, count)
+
+    def is_complete(self, row: int) -> bool:
+        return self.filled.get(row, 0) == self.full_mask
+
+    def complete_once(self, row: int) -> bool:
+        """
+        True только при первом полном заполнении секции
+        """
+        if row in self.completed or not self.is_complete(row):
+            return False
+        self.completed.add(row)
+        return True
+
+    def find_section(self, header: str) -> int:
+        return self.sections.get(header)
+
+    def find_city(self, row: int, city: str) -> int:
+        city = city.lower().strip()
+        columns = self.city_columns.get(row, {})
+        if city in columns:
+            return columns[city]
+        # в заголовке может быть указан не только город (например, "Москва (МСК)")
+        for cell_city, col in sorted(columns.items(), key=lambda item: item[1]):
+            if city in cell_city:
+                return col
+        return None
+
+    def last_city_column(self, row: int) -> int:
+        return max(self.city_columns.get(row, {}).values(), default=1)
+
+    def next_header_row(self, row: int) -> int:
+        """
+        Первая строка заголовка секции ниже указанной строки
+        """
+        pos = bisect_right(self.header_rows, row)
+        if pos < len(self.header_rows):
+            return self.header_rows[pos]
+        return None
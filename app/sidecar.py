@@ -0,0 +1,65 @@
+import hashlib
+import json
+
+from app.dedup import file_signature
+from app.snapshot import replace_file
+from logger.logger import setup_logger
+
+logger = setup_logger(module_name=__name__)
+
+
+def sidecar_path(path: str) -> str:
+    return f"{path}.index.json"
+
+
+def file_digest(path: str) -> str:
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        while chunk := f.read(1 << 20):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def write_sidecar(path: str, indexes: dict):
+    """
+    Сохраняет индексы листов книги рядом с ней вместе с подписью файла.
+    Вызывается, когда сама книга уже записана на диск
+    """
+    signature = file_signature(path)
+    if signature is None:
+        return
+    data = {
+        "size": signature[1],
+        "mtime_ns": signature[0],
+        "sha1": file_digest(path),
+        "sheets": indexes,
+    }
+    replace_file(
+        sidecar_path(path),
+        lambda f: f.write(json.dumps(data, ensure_ascii=False).encode()),
+    )
+
+
+def read_sidecar(path: str) -> dict:
+    """
+    Индексы листов {лист: SheetIndex.to_dict()} или None,
+    если файла индекса нет или книга с тех пор менялась
+    """
+    try:
+        with open(sidecar_path(path), encoding="utf-8") as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning(f"index sidecar of {path} is unreadable: {e}")
+        return None
+    signature = file_signature(path)
+    if signature is None:
+        return None
+    # хэш считается, только если совпали размер и mtime
+    valid = (data.get("mtime_ns"), data.get("size")) == signature
+    if not valid or data.get("sha1") != file_digest(path):
+        logger.warning(f"index sidecar of {path} is stale, sheets will be rescanned")
+        return None
+    logger.info(f"index sidecar of {path} loaded: {len(data['sheets'])} sheets")
+    return data["sheets"]
@@ -0,0 +1,137 @@
+import os
+import threading
+
+from concurrent.futures import Future
+
+from app import metrics
+from logger.logger import setup_logger
+
+logger = setup_logger(module_name=__name__)
+
+
+def replace_file(path: str, write):
+    """
+    Атомарно подменяет файл: write(f) пишет во временный файл рядом,
+    затем fsync и os.replace. При сбое на диске остаётся прежняя версия
+    """
+    # у каждого потока свой временный файл: один и тот же файл могут
+    # записывать несколько процессов и потоков
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    if hasattr(os, "O_DIRECTORY"):
+        # переименование переживёт сбой питания только после fsync каталога
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+class SnapshotSaver:
+    """
+    Фоновая запись снимков книги: поток получает уже сериализованные файлы,
+    пишет их через replace_file и выполняет действия после сохранения.
+    Ждёт записи не больше одного снимка: новый снимок заменяет ещё не начатый
+    старый, который к этому моменту уже устарел. При ошибке запись повторяется,
+    пока не получится, — подтверждения сообщений ждут её
+    """
+
+    def __init__(self, retry_interval: float = 1.0):
+        self.retry_interval = retry_interval
+        self.condition = threading.Condition()
+        # ожидающий снимок: ({путь: содержимое}, [действия после записи], [futures])
+        self.pending = None
+        self.stopping = False
+        self.thread = threading.Thread(
+            target=self.run, name="snapshot-saver", daemon=True
+        )
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self, timeout: float = None):
+        """
+        Записывает ожидающий снимок и останавливает поток
+        """
+        with self.condition:
+            self.stopping = True
+            self.condition.notify()
+        self.thread.join(timeout)
+
+    def submit(self, files: list, callback=None) -> Future:
+        """
+        Ставит снимок [(путь, содержимое)] в очередь. Future завершается,
+        когда файлы на диске, а callback выполнен
+        """
+        future = Future()
+        with self.condition:
+            if self.pending is None:
+                self.pending = ({}, [], [])
+            else:
+                metrics.inc("snapshots_dropped_total")
+                logger.info("stale snapshot dropped, newer one queued")
+            pending_files, callbacks, futures = self.pending
+            pending_files.update(files)
+            if callback is not None:
+                callbacks.append(callback)
+            futures.append(future)
+            self.condition.notify()
+        return future
+
+    def take(self):
+        with self.condition:
+            while self.pending is None and not self.stopping:
+                self.condition.wait()
+            snapshot, self.pending = self.pending, None
+            return snapshot
+
+    def run(self):
+        while True:
+            snapshot = self.take()
+            if snapshot is None:
+                return
+            self.write(*snapshot)
+
+    def write(self, files: dict, callbacks: list, futures: list):
+        while True:
+            try:
+                with metrics.timed("snapshot_write"):
+                    for path, payload in files.items():
+                        replace_file(path, lambda f: f.write(payload))
+                break
+            except Exception as e:
+                logger.error(f"❌ snapshot write error: {str(e)}")
+                metrics.inc("snapshot_errors_total")
+                with self.condition:
+                    if self.stopping:
+                        for future in futures:
+                            future.set_exception(e)
+                        return
+                    self.condition.wait(self.retry_interval)
+                    if self.pending is not None:
+                        # пока ждали, пришёл снимок новее: пишем вместе
+                        newer_files, newer_callbacks, newer_futures = self.pending
+                        self.pending = None
+                        files = {**files, **newer_files}
+                        callbacks = callbacks + newer_callbacks
+                        futures = futures + newer_futures
+
+        metrics.inc("bytes_written_total", sum(map(len, files.values())))
+        logger.success(f"💾 snapshot written: {len(files)} files")
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"❌ after-save action error: {str(e)}")
+        for future in futures:
+            future.set_result(list(files))
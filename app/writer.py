@@ -0,0 +1,279 @@
+import asyncio
+import json
+
+from concurrent.futures import ThreadPoolExecutor
+
+from app import metrics
+from app.config import BATCH_MAX_SIZE, BATCH_MAX_WAIT, WRITER_QUEUE_SIZE
+from app.excel_processor import ExcelProcessor
+from logger.logger import setup_logger
+
+logger = setup_logger(module_name=__name__)
+
+
+class ExcelWriter:
+    """
+    Единственный поток-писатель, владеющий ExcelProcessor.
+    Сообщения поступают из asyncio-очереди, работа с openpyxl и SMTP выполняется
+    вне event loop, а подтверждение отправляется только после сохранения в файл
+    """
+
+    def __init__(
+        self,
+        processor: ExcelProcessor,
+        maxsize: int = WRITER_QUEUE_SIZE,
+        batch_max_size: int = BATCH_MAX_SIZE,
+        batch_max_wait: float = BATCH_MAX_WAIT,
+    ):
+        self.processor = processor
+        self.batch_max_size = max(batch_max_size, 1)
+        self.batch_max_wait = batch_max_wait
+        self.queue = asyncio.Queue(maxsize)
+        # у каждого отчёта свой поток-писатель, в логах он виден по имени потока
+        name = f"excel-writer-{processor.name}" if processor.name else "excel-writer"
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+        # сообщения, применённые к книге, но ещё не сохранённые на диск
+        self.pending = []
+        # подтверждение последней сохранённой пачки: пачки подтверждаются по порядку,
+        # в фоновом режиме — после записи снимка на диск
+        self.acking = None
+        self.saving_messages = 0
+        self.tasks = []
+        # в режиме журнала запись в SQLite идёт в своём потоке, не дожидаясь Excel
+        self.journal_executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="journal"
+        )
+        self.journal_updated = asyncio.Event()
+
+    async def call(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
+
+    async def submit(self, message):
+        await self.queue.put(message)
+
+    def start(self):
+        self.tasks.append(asyncio.create_task(self.run()))
+        if self.processor.journal is not None:
+            self.tasks.append(asyncio.create_task(self.materialize()))
+            # догоняем строки, записанные в журнал до перезапуска
+            self.journal_updated.set()
+        if self.processor.flush_interval > 0:
+            self.tasks.append(asyncio.create_task(self.flush_periodically()))
+        if self.processor.assemble_interval > 0:
+            self.tasks.append(asyncio.create_task(self.assemble_periodically()))
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks.clear()
+        if self.processor.journal is not None:
+            # переносим в книгу всё, что успело попасть в журнал
+            await self.call(self.processor.refresh_from_journal)
+        # дожидаемся операции, которая уже выполняется в потоке-писателе
+        self.executor.shutdown(wait=True)
+        self.journal_executor.shutdown(wait=True)
+        if self.acking is not None:
+            await self.acking
+
+    def _flush_if_due(self) -> bool:
+        try:
+            self.processor.maybe_flush()
+        except Exception as e:
+            # сообщения остаются неподтверждёнными до следующего удачного сохранения
+            logger.error(f"❌ excel save error, messages left unacked: {str(e)}")
+        return not self.processor.is_dirty
+
+    async def ack_pending(self, count: int, saving=None):
+        """
+        Подтверждает первые count сообщений, изменения которых уже сохранены в файл.
+        saving — Future фонового снимка с этими изменениями: подтверждение уйдёт
+        после его записи, а поток-писатель тем временем продолжит работу
+        """
+        messages = self.pending[:count]
+        if not messages:
+            return
+        del self.pending[: len(messages)]
+        self.saving_messages += len(messages)
+        self.acking = asyncio.create_task(self.ack_saved(messages, saving, self.acking))
+        if saving is None:
+            await self.acking
+
+    async def ack_covered(self, last, saving=None):
+        """
+        Подтверждает сообщения до last включительно. Пока шло сохранение, часть
+        из них могла подтвердить другая задача (flush_periodically или run),
+        поэтому число сообщений считается по текущему pending
+        """
+        for i, message in enumerate(self.pending):
+            if message is last:
+                await self.ack_pending(i + 1, saving)
+                return
+
+    async def ack_saved(self, messages: list, saving, previous):
+        if previous is not None:
+            await previous
+        if saving is not None:
+            try:
+                await asyncio.wrap_future(saving)
+            except Exception as e:
+                logger.error(f"❌ snapshot was not written, messages left unacked: {e}")
+                return
+        try:
+            # один multi-ack подтверждает все доставки до указанной включительно
+            await messages[-1].ack(multiple=True)
+        except Exception as e:
+            logger.error(f"❌ ack error: {str(e)}")
+        self.saving_messages -= len(messages)
+        metrics.set_gauge("unacked_messages", len(self.pending) + self.saving_messages)
+
+    async def next_batch(self) -> list:
+        """
+        Ждёт первое сообщение и добирает пачку до batch_max_size или batch_max_wait
+        """
+        batch = [await self.queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.batch_max_wait
+        while len(batch) < self.batch_max_size:
+            if not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    def decode(self, message) -> dict:
+        try:
+            with metrics.timed("decode"):
+                data = json.loads(message.body.decode())
+            logger.debug(
+                "📩 received message: {date} {city}",
+                date=data["Date"],
+                city=data["City"],
+            )
+            return data
+        except Exception as e:
+            logger.error(f"❌ message processing error: {str(e)}")
+            metrics.inc("decode_errors_total")
+            import traceback
+
+            traceback.print_exc()
+            return None
+
+    async def run(self):
+        while True:
+            messages = await self.next_batch()
+            metrics.inc("messages_total", len(messages))
+            metrics.set_gauge("writer_queue_depth", self.queue.qsize())
+            decoded = list(map(self.decode, messages))
+            if self.processor.journal is not None:
+                batch = [data for data in decoded if data is not None]
+                await self.write_journal(messages, batch)
+            else:
+                await self.write_workbook(messages, decoded)
+            for _ in messages:
+                self.queue.task_done()
+
+    async def skip_duplicates(self, messages: list, decoded: list) -> tuple:
+        """
+        Сразу подтверждает сообщения, значения которых уже есть в книге,
+        и возвращает остальные
+        """
+        duplicates = await self.call(
+            lambda: [
+                data is not None and self.processor.is_duplicate(data)
+                for data in decoded
+            ]
+        )
+        rest = []
+        for message, data, duplicate in zip(messages, decoded, duplicates):
+            if not duplicate:
+                rest.append((message, data))
+                continue
+            metrics.inc("duplicates_total")
+            logger.debug(
+                "⏭️ {date} {city} already in workbook, acked",
+                date=data["Date"],
+                city=data["City"],
+            )
+            try:
+                await message.ack()
+            except Exception as e:
+                logger.error(f"❌ ack error: {str(e)}")
+        return [message for message, _ in rest], [data for _, data in rest]
+
+    async def write_workbook(self, messages: list, decoded: list):
+        if self.processor.fingerprints is not None:
+            messages, decoded = await self.skip_duplicates(messages, decoded)
+            if not messages:
+                return
+        batch = [data for data in decoded if data is not None]
+        try:
+            if self.batch_max_size > 1:
+                # пачка применяется целиком и сохраняется одним файлом
+                await self.call(self.processor.process_batch, batch)
+            else:
+                for data in batch:
+                    await self.call(self.processor.process_message, data)
+        except Exception as e:
+            logger.error(f"❌ message processing error: {str(e)}")
+
+        self.pending.extend(messages)
+        metrics.set_gauge("unacked_messages", len(self.pending) + self.saving_messages)
+        # сохранение покрывает сообщения, применённые к книге до него
+        last = self.pending[-1] if self.pending else None
+        if await self.call(self._flush_if_due):
+            await self.ack_covered(last, self.processor.saving)
+
+    async def write_journal(self, messages: list, batch: list):
+        """
+        Записывает пачку в журнал и подтверждает её сразу после fsync;
+        книга обновляется из журнала отдельно
+        """
+        rows = self.processor.parse_batch(batch)
+
+        loop = asyncio.get_running_loop()
+        try:
+            changed = await loop.run_in_executor(
+                self.journal_executor, self.processor.journal.append_many, rows
+            )
+        except Exception as e:
+            logger.error(f"❌ journal write error: {str(e)}")
+            for message in messages:
+                await message.nack(requeue=True)
+            return
+
+        self.pending.extend(messages)
+        await self.ack_pending(len(self.pending))
+        if changed:
+            self.journal_updated.set()
+
+    async def materialize(self):
+        while True:
+            await self.journal_updated.wait()
+            self.journal_updated.clear()
+            try:
+                await self.call(self.processor.refresh_from_journal)
+            except Exception as e:
+                logger.error(f"❌ journal refresh error: {str(e)}")
+
+    async def flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.processor.flush_interval)
+            last = self.pending[-1] if self.pending else None
+            if await self.call(self._flush_if_due):
+                await self.ack_covered(last, self.processor.saving)
+
+    async def assemble_periodically(self):
+        while True:
+            await asyncio.sleep(self.processor.assemble_interval)
+            try:
+                await self.call(self.processor.assemble_report)
+            except Exception as e:
+                logger.error(f"❌ report assembly error: {str(e)}")
@@ -0,0 +1,168 @@
+import argparse
+import os
+import sys
+
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from app.config import (
+    CITY_ORDER,
+    DEDUP_CACHE_PATH,
+    DEDUP_CACHE_SIZE,
+    EXCEL_PATH,
+    EXCEL_STORAGE,
+    JOURNAL_PATH,
+)
+from app.dedup import FingerprintCache
+from app.decode import decode_batch
+from app.excel_processor import ExcelProcessor
+from app.journal import Journal
+from app.send_email import send_email_with_attachment
+from app.sharded_processor import ShardedExcelProcessor
+from loguru import logger
+
+CHUNK_SIZE = 5000
+
+
+def read_chunks(paths: list, size: int = CHUNK_SIZE):
+    """
+    Строки JSONL пачками: [(файл, номер строки, строка)]
+    """
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            numbered = ((path, number, line) for number, line in enumerate(f, 1))
+            while chunk := list(islice(numbered, size)):
+                yield chunk
+
+
+def parse_chunk(chunk: list) -> tuple:
+    """
+    Разбирает и проверяет пачку строк в процессе пула (по столбцам, decode_batch).
+    Возвращает ([(дата, город, значения)], [(файл, строка, ошибка)])
+    """
+    lines = [(path, number, line) for path, number, line in chunk if line.strip()]
+    decoded = decode_batch([line for _, _, line in lines])
+    errors = [(*lines[position][:2], error) for position, error in decoded.errors]
+    return decoded.rows(), errors
+
+
+def load_rows(paths: list, workers: int) -> tuple:
+    """
+    Строки всех файлов, по одной на (дата, город) — побеждает последняя,
+    отсортированные по дате и порядку городов в отчёте
+    """
+    latest = {}
+    errors = []
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(parse_chunk, read_chunks(paths)))
+    else:
+        results = map(parse_chunk, read_chunks(paths))
+    for rows, chunk_errors in results:
+        for date, city, values in rows:
+            latest[(date, city)] = values
+        errors.extend(chunk_errors)
+
+    def order(key):
+        date, city = key
+        position = CITY_ORDER.index(city) if city in CITY_ORDER else len(CITY_ORDER)
+        return date, position, city
+
+    rows = [
+        (date, city, latest[(date, city)]) for date, city in sorted(latest, key=order)
+    ]
+    return rows, errors
+
+
+def backfill(processor: ExcelProcessor, rows: list) -> int:
+    """
+    Записывает строки в книгу и сохраняет её один раз.
+    В режиме журнала строки сначала попадают в журнал, а в книгу идёт то,
+    чего в ней ещё нет. Возвращает число записанных строк
+    """
+    journal = processor.journal
+    if journal is not None:
+        journal.append_many(rows)
+        pending = journal.since(processor.journal_version)
+        rows = [(date, city, values) for _, date, city, values in pending]
+        if pending:
+            processor.journal_version = pending[-1][0]
+    for date, city, values in rows:
+        processor.apply_values(date, city, values)
+    # письма по отдельным датам не нужны: о загрузке сообщается одним письмом
+    processor.pending_reports.clear()
+    processor.flush()
+    return len(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Загрузка исторических сообщений statScraper (JSON Lines) в отчёт без RabbitMQ"
+    )
+    parser.add_argument("input", nargs="+", help="файлы JSONL, по сообщению в строке")
+    parser.add_argument("--excel", default=EXCEL_PATH)
+    parser.add_argument(
+        "--storage", choices=["single", "monthly"], default=EXCEL_STORAGE
+    )
+    parser.add_argument("--journal", default=JOURNAL_PATH)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="процессы для разбора сообщений",
+    )
+    parser.add_argument(
+        "--no-previous-year",
+        action="store_true",
+        help="не добавлять блоки прошлого года",
+    )
+    parser.add_argument(
+        "--email", action="store_true", help="отправить отчёт одним письмом"
+    )
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+
+    # лог каждой строки замедляет загрузку, по умолчанию оставляем предупреждения
+    logger.remove()
+    logger.add(sys.stderr, level=args.log_level)
+
+    rows, errors = load_rows(args.input, args.workers)
+    for path, number, error in errors:
+        logger.warning(f"{path}:{number} skipped: {error}")
+    if not rows:
+        logger.error("nothing to backfill")
+        sys.exit(1)
+
+    journal = Journal(args.journal) if args.journal else None
+    fingerprints = (
+        FingerprintCache(DEDUP_CACHE_PATH, DEDUP_CACHE_SIZE)
+        if DEDUP_CACHE_PATH
+        else None
+    )
+    processor_class = (
+        ShardedExcelProcessor if args.storage == "monthly" else ExcelProcessor
+    )
+    processor = processor_class(
+        args.excel,
+        journal=journal,
+        fingerprints=fingerprints,
+        previous_year_blocks=not args.no_previous_year,
+    )
+    try:
+        written = backfill(processor, rows)
+        first, last = rows[0][0], rows[-1][0]
+        logger.success(
+            f"{written} rows backfilled ({first:%d.%m.%Y} - {last:%d.%m.%Y}), "
+            f"{len(errors)} lines skipped"
+        )
+        if args.email and written:
+            send_email_with_attachment(
+                f"Отчет дополнен данными за {first:%d.%m.%Y} - {last:%d.%m.%Y}",
+                f"В отчёт загружены исторические данные: {written} строк.\nФайл во вложении.",
+                processor.report_path(),
+            )
+    finally:
+        if journal is not None:
+            journal.close()
+        if fingerprints is not None:
+            fingerprints.close()
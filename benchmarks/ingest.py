@@ -0,0 +1,382 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import openpyxl
+
+from app.config import (
+    BATCH_MAX_SIZE,
+    BATCH_MAX_WAIT,
+    EXCEL_FLUSH_INTERVAL,
+    EXCEL_FLUSH_MAX_MESSAGES,
+    EXCEL_STORAGE,
+    QUEUE_NAME,
+    RABBITMQ_PREFETCH_COUNT,
+)
+from app.excel_processor import ExcelProcessor, parse_message
+from app.journal import Journal
+from app.memory_broker import InMemoryChannel
+from app.mq_consumer import consume
+from app.previous_year import PreviousYearReader
+from app.report_writer import collect_sections, write_report
+from app.sharded_processor import ShardedExcelProcessor
+from app.send_email import SMTPConnection, start_dispatcher, stop_dispatcher
+from app.writer import ExcelWriter
+from benchmarks.messages import encode, generate_messages
+from loguru import logger
+
+try:
+    import resource
+except ImportError:
+    # Windows: пиковую память не измеряем
+    resource = None
+
+
+def peak_rss() -> int:
+    """
+    Пиковый RSS процесса в байтах (None, если платформа не умеет). Растёт
+    только вверх, поэтому каждый сценарий запускается в своём процессе
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдаёт килобайты, macOS — байты
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(int(round(q / 100 * len(ordered))) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def latency_summary(latencies: list) -> dict:
+    return {
+        "count": len(latencies),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3) if latencies else None,
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3) if latencies else None,
+        "max_ms": round(max(latencies) * 1000, 3) if latencies else None,
+    }
+
+
+class NullSMTP:
+    """
+    SMTP-сервер в памяти: принимает письма и только считает их
+    """
+
+    def __init__(self):
+        self.messages = 0
+        self.bytes = 0
+
+    def noop(self):
+        return 250, b"OK"
+
+    def sendmail(self, from_address, recipients, message):
+        self.messages += 1
+        self.bytes += len(message)
+
+    def quit(self):
+        pass
+
+
+class TimedChannel(InMemoryChannel):
+    """
+    Канал в памяти, который замеряет время от выдачи сообщения до подтверждения
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.delivered_at = {}
+        self.latencies = []
+
+    def deliver(self, body: bytes, queue=None):
+        message = super().deliver(body, queue)
+        self.delivered_at[message.delivery_tag] = time.perf_counter()
+        return message
+
+    def ack(self, delivery_tag: int, multiple: bool = False):
+        now = time.perf_counter()
+        if multiple:
+            tags = [tag for tag in self.delivered_at if tag <= delivery_tag]
+        else:
+            tags = [delivery_tag] if delivery_tag in self.delivered_at else []
+        for tag in tags:
+            self.latencies.append(now - self.delivered_at.pop(tag))
+        super().ack(delivery_tag, multiple)
+
+
+class TimedSaves:
+    """
+    Примесь к ExcelProcessor: записывает длительность каждого сохранения
+    и размер сохранённых файлов
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.applied = 0
+        self.saves = []
+
+    def mark_dirty(self):
+        super().mark_dirty()
+        self.applied += 1
+
+    def save(self) -> list:
+        started = time.perf_counter()
+        saved = super().save()
+        self.saves.append(
+            {
+                "messages": self.applied,
+                "file_bytes": sum(map(os.path.getsize, saved)),
+                "seconds": round(time.perf_counter() - started, 6),
+            }
+        )
+        return saved
+
+
+class TimedProcessor(TimedSaves, ExcelProcessor):
+    pass
+
+
+class TimedShardedProcessor(TimedSaves, ShardedExcelProcessor):
+    pass
+
+
+def build_previous_year(path: Path, start, days: int, seed: int):
+    """
+    Синтетический отчёт за прошлый год с запасом в неделю по краям
+    """
+    prev_start = start.replace(year=start.year - 1) - timedelta(days=7)
+    rows = []
+    for data in generate_messages(prev_start, days + 14, seed + 1):
+        parsed = parse_message(data)
+        if parsed is not None:
+            rows.append(parsed)
+    write_report(path, collect_sections(rows))
+
+
+def make_processor(path: Path, args, previous_year_path: Path, journal=None):
+    if args.storage == "monthly":
+        processor_class = TimedShardedProcessor
+    else:
+        processor_class = TimedProcessor
+    processor = processor_class(
+        path,
+        flush_max_messages=args.flush_max_messages,
+        flush_interval=args.flush_interval,
+        journal=journal,
+    )
+    if previous_year_path is not None:
+        processor.previous_year = PreviousYearReader(previous_year_path)
+    return processor
+
+
+def save_summary(saves: list) -> dict:
+    total = sum(save["seconds"] for save in saves)
+    return {
+        "count": len(saves),
+        "total_seconds": round(total, 3),
+        "mean_ms": round(total / len(saves) * 1000, 3) if saves else None,
+        # длительность сохранения в зависимости от размера книги
+        "by_size": saves,
+    }
+
+
+def bench_process_message(messages: list, workdir: Path, args, previous_year_path):
+    """
+    Прямые вызовы ExcelProcessor.process_message без брокера
+    """
+    processor = make_processor(workdir / "direct.xlsx", args, previous_year_path)
+    smtp = NullSMTP()
+    start_dispatcher(connection=SMTPConnection(connect=lambda: smtp), coalesce_window=0)
+    latencies = []
+    started = time.perf_counter()
+    for data in messages:
+        begin = time.perf_counter()
+        processor.process_message(data)
+        latencies.append(time.perf_counter() - begin)
+    processor.flush()
+    elapsed = time.perf_counter() - started
+    stop_dispatcher()
+    return {
+        "messages": len(messages),
+        "seconds": round(elapsed, 3),
+        "msgs_per_sec": round(len(messages) / elapsed, 1),
+        "latency": latency_summary(latencies),
+        "saves": save_summary(processor.saves),
+        "emails": {"sent": smtp.messages, "bytes": smtp.bytes},
+        "peak_rss_bytes": peak_rss(),
+    }
+
+
+async def run_consumer(messages: list, processor: ExcelProcessor, args) -> TimedChannel:
+    channel = TimedChannel()
+    queue = await channel.declare_queue(QUEUE_NAME, durable=True)
+    for data in messages:
+        queue.publish(encode(data))
+    queue.close()
+    writer = ExcelWriter(
+        processor,
+        batch_max_size=args.batch_max_size,
+        batch_max_wait=args.batch_max_wait,
+    )
+    await consume(channel, processor, QUEUE_NAME, args.prefetch, writer)
+    return channel
+
+
+def bench_consumer(messages: list, workdir: Path, args, previous_year_path):
+    """
+    Полный цикл mq_consumer: канал в памяти, поток-писатель, подтверждения
+    """
+    journal = Journal(str(workdir / "journal.sqlite3")) if args.journal else None
+    processor = make_processor(
+        workdir / "consumer.xlsx", args, previous_year_path, journal
+    )
+    smtp = NullSMTP()
+    start_dispatcher(connection=SMTPConnection(connect=lambda: smtp), coalesce_window=0)
+    started = time.perf_counter()
+    channel = asyncio.run(run_consumer(messages, processor, args))
+    processor.flush()
+    elapsed = time.perf_counter() - started
+    stop_dispatcher()
+    if journal is not None:
+        journal.close()
+    return {
+        "messages": len(messages),
+        "acked": channel.acked,
+        "seconds": round(elapsed, 3),
+        "msgs_per_sec": round(len(messages) / elapsed, 1),
+        # от выдачи сообщения брокером до подтверждения
+        "latency": latency_summary(channel.latencies),
+        "saves": save_summary(processor.saves),
+        "emails": {"sent": smtp.messages, "bytes": smtp.bytes},
+        "peak_rss_bytes": peak_rss(),
+    }
+
+
+SCENARIOS = {
+    "process_message": bench_process_message,
+    "consumer": bench_consumer,
+}
+
+
+def run_scenario(name: str, messages: list, workdir: Path, args, previous_year_path):
+    """
+    Сценарий в отдельном процессе: пиковый RSS не включает прошлые сценарии
+    """
+    logger.remove()
+    logger.add(sys.stderr, level=args.log_level)
+    return SCENARIOS[name](messages, workdir, args, previous_year_path)
+
+
+def compare(results: dict, baseline: dict):
+    """
+    Печатает изменение ключевых показателей относительно прошлого запуска
+    """
+    for name, current in results["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(name)
+        if previous is None:
+            continue
+        for label, path in (
+            ("msgs/sec", ("msgs_per_sec",)),
+            ("p50 ms", ("latency", "p50_ms")),
+            ("p99 ms", ("latency", "p99_ms")),
+            ("peak rss", ("peak_rss_bytes",)),
+        ):
+            old, new = previous, current
+            for key in path:
+                old, new = (old or {}).get(key), (new or {}).get(key)
+            if old and new is not None:
+                print(f"  {name:16} {label:9} {old:>12} -> {new:<12} {new / old:6.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Бенчмарк приёма сообщений: ExcelProcessor и mq_consumer"
+    )
+    parser.add_argument("--start", default="2025-01-01", help="первая дата, ГГГГ-ММ-ДД")
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--shuffle", action="store_true")
+    parser.add_argument(
+        "--scenario",
+        action="append",
+        choices=sorted(SCENARIOS),
+        help="по умолчанию все",
+    )
+    parser.add_argument(
+        "--flush-max-messages", type=int, default=EXCEL_FLUSH_MAX_MESSAGES
+    )
+    parser.add_argument("--flush-interval", type=float, default=EXCEL_FLUSH_INTERVAL)
+    parser.add_argument("--prefetch", type=int, default=RABBITMQ_PREFETCH_COUNT)
+    parser.add_argument("--batch-max-size", type=int, default=BATCH_MAX_SIZE)
+    parser.add_argument("--batch-max-wait", type=float, default=BATCH_MAX_WAIT)
+    parser.add_argument("--journal", action="store_true", help="режим журнала SQLite")
+    parser.add_argument(
+        "--storage", choices=["single", "monthly"], default=EXCEL_STORAGE
+    )
+    parser.add_argument("--no-previous-year", action="store_true")
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--output", default="bench_ingest.json", help="файл JSON")
+    parser.add_argument("--baseline", help="JSON прошлого запуска для сравнения")
+    args = parser.parse_args()
+
+    # логи каждого сообщения искажают замеры, по умолчанию оставляем предупреждения
+    logger.remove()
+    logger.add(sys.stderr, level=args.log_level)
+
+    start = datetime.strptime(args.start, "%Y-%m-%d")
+    messages = generate_messages(start, args.days, args.seed, args.shuffle)
+    results = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "openpyxl": openpyxl.__version__,
+        "params": vars(args),
+        "scenarios": {},
+    }
+
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = Path(tmp)
+        previous_year_path = None
+        if not args.no_previous_year:
+            previous_year_path = workdir / "previous_year.xlsx"
+            build_previous_year(previous_year_path, start, args.days, args.seed)
+        # spawn: дочерний процесс не наследует память родителя и прошлых сценариев
+        context = multiprocessing.get_context("spawn")
+        for name in args.scenario or list(SCENARIOS):
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                result = pool.submit(
+                    run_scenario, name, messages, workdir, args, previous_year_path
+                ).result()
+            results["scenarios"][name] = result
+            print(
+                f"{name:16} {result['msgs_per_sec']:>9} msgs/sec  "
+                f"p50 {result['latency']['p50_ms']} ms  "
+                f"p99 {result['latency']['p99_ms']} ms  "
+                f"saves {result['saves']['count']} "
+                f"({result['saves']['total_seconds']} s)  "
+                f"peak rss {result['peak_rss_bytes']}"
+            )
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+import argparse
+import json
+import random
+import sys
+
+from datetime import datetime, timedelta
+
+from app.config import CITY_MAPPING
+
+
+def make_message(date, city_key: str, rng: random.Random) -> dict:
+    """
+    Сообщение в формате statScraper для одного города за одну дату
+    """
+    total = rng.randint(0, 400)
+    lost = rng.randint(0, total // 3) if total else 0
+    transferred = rng.randint(0, max(total - lost, 0) // 10)
+    return {
+        "Date": date.strftime("%Y-%m-%d"),
+        "City": city_key,
+        "ВСЕГО:": str(total),
+        "Потеряно:": str(lost),
+        "Переведено:": str(transferred),
+        "Успешно завершено:": str(total - lost),
+        "Клиенты, не дождавшиеся ответа, ждали в среднем:": str(
+            round(rng.uniform(0, 90), 2)
+        ),
+        "В среднем клиенты ждут:": str(round(rng.uniform(0, 40), 2)),
+        "В среднем разговор длится:": str(round(rng.uniform(30, 300), 2)),
+    }
+
+
+def generate_messages(
+    start, days: int, seed: int = 0, shuffle: bool = False, cities=None
+) -> list:
+    """
+    Сообщения по всем городам за days дней начиная со start.
+    shuffle перемешивает города внутри даты, как при параллельной выгрузке
+    """
+    rng = random.Random(seed)
+    cities = list(cities or CITY_MAPPING)
+    messages = []
+    for day in range(days):
+        date = start + timedelta(days=day)
+        batch = [make_message(date, city_key, rng) for city_key in cities]
+        if shuffle:
+            rng.shuffle(batch)
+        messages.extend(batch)
+    return messages
+
+
+def encode(data: dict) -> bytes:
+    return json.dumps(data, ensure_ascii=False).encode()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Генератор синтетических сообщений statScraper (JSON Lines)"
+    )
+    parser.add_argument("--start", default="2025-01-01", help="первая дата, ГГГГ-ММ-ДД")
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--shuffle", action="store_true")
+    args = parser.parse_args()
+
+    start = datetime.strptime(args.start, "%Y-%m-%d")
+    for data in generate_messages(start, args.days, args.seed, args.shuffle):
+        sys.stdout.write(json.dumps(data, ensure_ascii=False) + "\n")
@@ -1,19 +1,95 @@
+import atexit
+import os
 import sys
+import threading
+import time
 from pathlib import Path
+
+from dotenv import load_dotenv
 from loguru import logger
 
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+load_dotenv()
+# dev — цветная консоль и debug.log с уровня DEBUG; production — JSON-записи
+# с уровня INFO через пакетный sink, в консоль только предупреждения и ошибки
+LOG_PROFILE = os.getenv("LOG_PROFILE", "dev").lower()
+# как часто пакетный sink сбрасывает накопленные записи в файл (секунды)
+LOG_FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", "1"))
 
-def setup_logger(module_name: str, log_dir: str = "logs"):
-    log_path = BASE_DIR / log_dir
-    log_path.mkdir(parents=True, exist_ok=True)
+_configured = False
+_lock = threading.Lock()
+
+
+class BatchedFileSink:
+    """
+    Неблокирующий файловый sink: запись только добавляет строку в буфер,
+    отдельный поток раз в interval (или при накоплении batch_size строк)
+    пишет буфер в файл одним вызовом. Файл больше max_bytes переименовывается
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        interval: float = LOG_FLUSH_INTERVAL,
+        batch_size: int = 1000,
+        max_bytes: int = 10 * 1024 * 1024,
+    ):
+        self.path = path
+        self.interval = interval
+        self.batch_size = batch_size
+        self.max_bytes = max_bytes
+        self.buffer = []
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopping = False
+        self.file = open(path, "a", encoding="utf-8")
+        self.thread = threading.Thread(target=self.run, name="log-writer", daemon=True)
+        self.thread.start()
+        atexit.register(self.stop)
+
+    def write(self, message):
+        with self.lock:
+            self.buffer.append(message)
+            full = len(self.buffer) >= self.batch_size
+        if full:
+            self.wakeup.set()
+
+    def run(self):
+        while not self.stopping:
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+            self.write_batch()
+
+    def write_batch(self):
+        with self.lock:
+            batch, self.buffer = self.buffer, []
+        if not batch or self.file.closed:
+            return
+        self.file.write("".join(batch))
+        self.file.flush()
+        if self.file.tell() > self.max_bytes:
+            self.file.close()
+            stamp = time.strftime("%Y-%m-%d_%H-%M-%S")
+            os.replace(
+                self.path,
+                self.path.with_name(f"{self.path.stem}.{stamp}{self.path.suffix}"),
+            )
+            self.file = open(self.path, "a", encoding="utf-8")
 
-    logger.remove()
+    def stop(self):
+        # вызывается loguru при удалении sink и при выходе из процесса
+        if self.stopping:
+            return
+        self.stopping = True
+        self.wakeup.set()
+        self.thread.join()
+        self.write_batch()
+        self.file.close()
 
-    file_format = "{time:YYYY-MM-DD HH:mm:ss} | {level: <8} | {name}:{line} | {message}"
 
+def add_dev_sinks(log_path: Path, file_format: str):
     console_format = (
         "<green>{time:HH:mm:ss}</green> | "
         "<level>{level: <8}</level> | "
@@ -29,15 +105,6 @@ def setup_logger(module_name: str, log_dir: str = "logs"):
         enqueue=True,
     )
 
-    logger.add(
-        log_path / "errors.log",
-        rotation="10 MB",
-        retention="3 months",
-        format=file_format,
-        level="ERROR",
-        enqueue=True,
-    )
-
     logger.add(
         sys.stderr,
         format=console_format,
@@ -46,4 +113,54 @@ def setup_logger(module_name: str, log_dir: str = "logs"):
         backtrace=False,
     )
 
+
+def add_production_sinks(log_path: Path, file_format: str):
+    # записи сериализуются в JSON: поля, переданные в лог именованными
+    # аргументами, попадают в record.extra
+    logger.add(
+        BatchedFileSink(log_path / "app.jsonl"),
+        serialize=True,
+        level="INFO",
+    )
+
+    logger.add(
+        sys.stderr,
+        format=file_format,
+        colorize=False,
+        level="WARNING",
+        backtrace=False,
+    )
+
+
+def setup_logger(module_name: str, log_dir: str = "logs"):
+    """
+    Настраивает sink'и один раз на процесс и возвращает логгер модуля
+    """
+    global _configured
+    with _lock:
+        if not _configured:
+            log_path = BASE_DIR / log_dir
+            log_path.mkdir(parents=True, exist_ok=True)
+
+            logger.remove()
+
+            file_format = (
+                "{time:YYYY-MM-DD HH:mm:ss} | {level: <8} | {name}:{line} | {message}"
+            )
+
+            if LOG_PROFILE == "production":
+                add_production_sinks(log_path, file_format)
+            else:
+                add_dev_sinks(log_path, file_format)
+
+            logger.add(
+                log_path / "errors.log",
+                rotation="10 MB",
+                retention="3 months",
+                format=file_format,
+                level="ERROR",
+                enqueue=True,
+            )
+            _configured = True
+
     return logger.bind(module=module_name)
@@ -1,29 +1,127 @@
 import asyncio
 
-from app.config import EXCEL_PATH
+from app import metrics
+from app.config import (
+    DEDUP_CACHE_PATH,
+    DEDUP_CACHE_SIZE,
+    EMAIL_OUTBOX_PATH,
+    EXCEL_BACKGROUND_SAVE,
+    EXCEL_PATH,
+    EXCEL_STORAGE,
+    JOURNAL_PATH,
+    PARTITION_ID,
+    PARTITIONS,
+    QUEUE_NAME,
+    REPORTS_CONFIG,
+)
+from app.dedup import FingerprintCache
 from app.excel_processor import ExcelProcessor
-from app.mq_consumer import process_messages
-from logger.logger import setup_logger
+from app.journal import Journal
+from app.mq_consumer import process_messages, process_reports
+from app.outbox import ReportOutbox, default_outbox_path
+from app.partitioning import partition_path, partition_queue_name
+from app.reports import open_reports
+from app.sharded_processor import ShardedExcelProcessor
+from app.snapshot import SnapshotSaver
+from app.send_email import EMAIL_ASYNC, start_dispatcher, stop_dispatcher
+from logger.logger import LOG_PROFILE, setup_logger
 
 logger = setup_logger(__name__)
 
+
+def open_single_report() -> tuple:
+    queue_name = QUEUE_NAME
+    journal_path, dedup_path = JOURNAL_PATH, DEDUP_CACHE_PATH
+    outbox_path = EMAIL_OUTBOX_PATH or default_outbox_path(EXCEL_PATH)
+    if PARTITIONS:
+        # воркер партиции: своя очередь, только свои книги месяцев и свои файлы
+        # журнала, кэша отпечатков и outbox
+        queue_name = partition_queue_name(PARTITION_ID)
+        journal_path = journal_path and partition_path(journal_path, PARTITION_ID)
+        dedup_path = dedup_path and partition_path(dedup_path, PARTITION_ID)
+        outbox_path = (
+            partition_path(EMAIL_OUTBOX_PATH, PARTITION_ID)
+            if EMAIL_OUTBOX_PATH
+            else default_outbox_path(EXCEL_PATH, f".p{PARTITION_ID}")
+        )
+        logger.info(f"partition worker {PARTITION_ID} of {PARTITIONS}: {queue_name}")
+    journal = Journal(journal_path) if journal_path else None
+    fingerprints = (
+        FingerprintCache(dedup_path, DEDUP_CACHE_SIZE) if dedup_path else None
+    )
+    snapshots = SnapshotSaver().start() if EXCEL_BACKGROUND_SAVE else None
+    outbox = ReportOutbox(outbox_path)
+    kwargs = dict(
+        journal=journal, fingerprints=fingerprints, snapshots=snapshots, outbox=outbox
+    )
+    if EXCEL_STORAGE == "monthly" or PARTITIONS:
+        processor = ShardedExcelProcessor(EXCEL_PATH, **kwargs)
+    else:
+        processor = ExcelProcessor(EXCEL_PATH, **kwargs)
+    return processor, queue_name
+
+
+def close_report(processor):
+    # сбрасываем на диск изменения, накопленные в режиме отложенного сохранения
+    try:
+        if processor.flush():
+            logger.info(f"excel file saved before exit: {processor.file_path}")
+    except Exception as e:
+        logger.error(f"error while saving excel file: {str(e)}")
+    # дописываем последний снимок; письма по нему уходят в диспетчер
+    if processor.snapshots is not None:
+        processor.snapshots.stop()
+    # при хранении по месяцам общий файл отчёта собирается из свежих книг
+    try:
+        if processor.assemble_report():
+            logger.info(f"report assembled before exit: {processor.file_path}")
+    except Exception as e:
+        logger.error(f"error while assembling report: {str(e)}")
+    if processor.journal is not None:
+        processor.journal.close()
+    if processor.fingerprints is not None:
+        processor.fingerprints.close()
+
+
 if __name__ == "__main__":
-    processor = ExcelProcessor(EXCEL_PATH)
-    need_save = True
+    if REPORTS_CONFIG:
+        if PARTITIONS:
+            raise ValueError("REPORTS_CONFIG и PARTITIONS не используются вместе")
+        reports = open_reports(REPORTS_CONFIG)
+    else:
+        reports = [open_single_report()]
+    if EMAIL_ASYNC:
+        start_dispatcher()
+    for processor, _ in reports:
+        # письма, которые не ушли до прошлой остановки
+        try:
+            processor.resend_unsent()
+        except Exception as e:
+            logger.error(f"failed to resend unsent reports: {str(e)}")
+    metrics_server = metrics.start_server()
+    # в production вместо строки на каждое сообщение — периодическая сводка
+    log_summary = metrics.LogSummary().start() if LOG_PROFILE == "production" else None
     try:
-        asyncio.run(process_messages(processor))
+        if REPORTS_CONFIG:
+            asyncio.run(process_reports(reports))
+        else:
+            asyncio.run(process_messages(*reports[0]))
     except KeyboardInterrupt:
         logger.info("application stopped by user")
-        need_save = False
     except Exception as e:
         logger.error(f"critical error: {str(e)}")
         import traceback
 
         traceback.print_exc()
     finally:
-        if need_save:
-            try:
-                processor.wb.save(EXCEL_PATH)
-                logger.info("excel file saved before exit")
-            except Exception as e:
-                logger.error(f"error while saving excel file: {str(e)}")
+        for processor, _ in reports:
+            close_report(processor)
+        # дожидаемся отправки писем, уже поставленных в очередь
+        stop_dispatcher()
+        for processor, _ in reports:
+            if processor.outbox is not None:
+                processor.outbox.close()
+        if metrics_server is not None:
+            metrics_server.shutdown()
+        if log_summary is not None:
+            log_summary.stop()
@@ -0,0 +1,77 @@
+import asyncio
+
+from datetime import datetime
+
+import pytest
+
+from app.excel_processor import ExcelProcessor
+from benchmarks.messages import encode, generate_messages
+
+
+class FakeMail:
+    """
+    Отправка писем без SMTP: запоминает темы, имена вложений и почту отчёта
+    """
+
+    def __init__(self):
+        self.sent = []
+        # настройки почты отчёта у каждого письма
+        self.settings = []
+        self.fail = False
+
+    def send_report(
+        self,
+        subject,
+        body,
+        file_path,
+        key=None,
+        payload=None,
+        on_sent=None,
+        mail=None,
+    ):
+        if self.fail:
+            return
+        self.sent.append((subject, file_path))
+        self.settings.append(mail)
+        if on_sent is not None:
+            on_sent()
+
+
+@pytest.fixture(autouse=True)
+def mail(monkeypatch):
+    mail = FakeMail()
+    monkeypatch.setattr("app.excel_processor.send_report", mail.send_report)
+    return mail
+
+
+@pytest.fixture
+def messages():
+    # два полных дня: 10 сообщений по пяти городам
+    return generate_messages(datetime(2025, 3, 1), 2, seed=1)
+
+
+@pytest.fixture
+def bodies(messages):
+    return [encode(data) for data in messages]
+
+
+@pytest.fixture
+def make_processor(tmp_path):
+    def make(cls=ExcelProcessor, name="report.xlsx", **kwargs):
+        kwargs.setdefault("previous_year_blocks", False)
+        kwargs.setdefault("last_year_path", str(tmp_path / "missing.xlsx"))
+        return cls(str(tmp_path / name), **kwargs)
+
+    return make
+
+
+async def wait_until(condition, timeout: float = 5):
+    """
+    Ждёт, пока condition() не станет истинным
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not condition():
+        if loop.time() > deadline:
+            raise TimeoutError("condition not reached")
+        await asyncio.sleep(0.01)
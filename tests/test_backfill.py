@@ -0,0 +1,67 @@
+import json
+
+from datetime import datetime
+
+from app.config import CITY_MAPPING, CITY_ORDER
+from app.decode import decode_batch
+from app.journal import Journal
+from backfill import backfill, load_rows
+from benchmarks.messages import generate_messages
+
+
+def write_jsonl(path, messages: list, extra_lines: list = ()):
+    with open(path, "w", encoding="utf-8") as f:
+        for data in messages:
+            f.write(json.dumps(data, ensure_ascii=False) + "\n")
+        for line in extra_lines:
+            f.write(line + "\n")
+
+
+def test_load_rows_last_wins_sorted_with_errors(tmp_path):
+    messages = generate_messages(datetime(2025, 3, 1), 2, seed=1, shuffle=True)
+    # более поздняя строка за ту же дату и город заменяет раннюю
+    fixed = dict(messages[0], **{"ВСЕГО:": "999", "Потеряно:": "0"})
+    first = tmp_path / "first.jsonl"
+    second = tmp_path / "second.jsonl"
+    write_jsonl(first, messages[::-1], ["", "{broken"])
+    write_jsonl(second, [fixed, dict(fixed, City="unknown")])
+
+    rows, errors = load_rows([str(first), str(second)], workers=1)
+    assert [(date.day, city) for date, city, _ in rows] == [
+        (day, city) for day in (1, 2) for city in CITY_ORDER
+    ]
+    latest = {(f"{date:%Y-%m-%d}", city): values for date, city, values in rows}
+    assert latest[(fixed["Date"], CITY_MAPPING[fixed["City"]])][0] == 999
+    # пустая строка пропускается молча, номера строк — по файлу
+    assert [(path, number) for path, number, _ in errors] == [
+        (str(first), 12),
+        (str(second), 2),
+    ]
+    assert errors[1][2] == "unknown city: unknown"
+    assert load_rows([str(first), str(second)], workers=2) == (rows, errors)
+
+
+def test_backfill_saves_once_without_emails(make_processor, messages, mail):
+    processor = make_processor()
+    saves = []
+    save = processor.save
+    processor.save = lambda: saves.append(1) or save()
+    rows = decode_batch(messages).rows()
+    assert backfill(processor, rows) == 10
+    assert saves == [1]
+    assert mail.sent == []
+    assert processor.get_sheet_index(processor.wb["Март 2025"]).is_complete(2)
+
+
+def test_backfill_through_journal_writes_only_new_rows(
+    make_processor, messages, tmp_path
+):
+    journal = Journal(str(tmp_path / "journal.sqlite3"))
+    processor = make_processor(journal=journal)
+    rows = decode_batch(messages).rows()
+    assert backfill(processor, rows[:5]) == 5
+    # повторная загрузка тех же строк в журнале ничего не меняет
+    assert backfill(processor, rows) == 5
+    assert backfill(processor, rows) == 0
+    assert journal.applied_version() == 10
+    journal.close()
@@ -0,0 +1,96 @@
+import asyncio
+
+from app.memory_broker import InMemoryChannel
+from app.mq_consumer import consume
+from app.writer import ExcelWriter
+from tests.conftest import wait_until
+
+
+async def consume_all(processor, bodies, prefetch_count=0, **writer_kwargs):
+    channel = InMemoryChannel()
+    queue = await channel.declare_queue("statScraper", durable=True)
+    for body in bodies:
+        queue.publish(body)
+    queue.close()
+    writer = ExcelWriter(processor, **writer_kwargs)
+    await asyncio.wait_for(
+        consume(channel, processor, "statScraper", prefetch_count, writer), 10
+    )
+    return channel
+
+
+def test_messages_acked_after_flush(make_processor, bodies, tmp_path):
+    processor = make_processor(flush_max_messages=5)
+    channel = asyncio.run(consume_all(processor, bodies))
+    assert channel.acked == len(bodies)
+    assert not channel.unacked
+    assert (tmp_path / "report.xlsx").exists()
+
+
+def test_prefetch_below_flush_threshold_does_not_stall(make_processor, bodies):
+    processor = make_processor(flush_max_messages=10)
+    channel = asyncio.run(
+        consume_all(processor, bodies, prefetch_count=3, batch_max_size=5)
+    )
+    assert channel.acked == len(bodies)
+    assert processor.flush_max_messages == 3
+
+
+def test_batches_acked_after_single_save(make_processor, bodies):
+    processor = make_processor()
+    saves = []
+    save = processor.save
+    processor.save = lambda: saves.append(1) or save()
+    channel = asyncio.run(
+        consume_all(processor, bodies, batch_max_size=5, batch_max_wait=0.5)
+    )
+    assert channel.acked == len(bodies)
+    assert len(saves) == 2
+
+
+def test_messages_unacked_until_saved(make_processor, bodies):
+    processor = make_processor(flush_max_messages=5)
+
+    async def run():
+        channel = InMemoryChannel()
+        queue = await channel.declare_queue("statScraper", durable=True)
+        writer = ExcelWriter(processor)
+        task = asyncio.create_task(
+            consume(channel, processor, "statScraper", 0, writer)
+        )
+        for body in bodies[:4]:
+            queue.publish(body)
+        await wait_until(lambda: len(writer.pending) == 4)
+        assert channel.acked == 0
+        queue.publish(bodies[4])
+        await wait_until(lambda: channel.acked == 5)
+        assert not writer.pending
+        queue.close()
+        await asyncio.wait_for(task, 10)
+
+    asyncio.run(run())
+
+
+def test_failed_save_leaves_messages_unacked(make_processor, bodies):
+    processor = make_processor(flush_max_messages=5)
+
+    def fail():
+        raise OSError("disk full")
+
+    processor.save = fail
+
+    async def run():
+        channel = InMemoryChannel()
+        queue = await channel.declare_queue("statScraper", durable=True)
+        writer = ExcelWriter(processor)
+        task = asyncio.create_task(
+            consume(channel, processor, "statScraper", 0, writer)
+        )
+        for body in bodies:
+            queue.publish(body)
+        await wait_until(lambda: writer.queue.empty() and len(writer.pending) == 10)
+        assert channel.acked == 0
+        assert len(channel.unacked) == len(bodies)
+        task.cancel()
+
+    asyncio.run(run())
@@ -0,0 +1,70 @@
+from datetime import datetime
+
+import pytest
+
+from app import decode
+from app.decode import decode_batch, parse_message
+from benchmarks.messages import encode, generate_messages
+
+
+def edge_messages() -> list:
+    """
+    Сообщения на границах формул: нет звонков, половинки при округлении,
+    значения вне точного диапазона float64, ошибки разбора
+    """
+    base = generate_messages(datetime(2025, 3, 1), 1, seed=2)[0]
+    edits = [
+        {"ВСЕГО:": "0", "Потеряно:": "0"},
+        {"ВСЕГО:": "8", "Потеряно:": "1"},
+        {"ВСЕГО:": "40", "Потеряно:": "1"},
+        {"В среднем клиенты ждут:": "2.5"},
+        {"В среднем клиенты ждут:": "-2.5"},
+        {"В среднем разговор длится:": "0.49999999999999994"},
+        {"ВСЕГО:": str(2**60), "Потеряно:": str(2**59)},
+        {"ВСЕГО:": str(2**70), "Потеряно:": "3"},
+        {"В среднем клиенты ждут:": "1e300"},
+        {"В среднем клиенты ждут:": "inf"},
+        {"В среднем клиенты ждут:": "nan"},
+        {"ВСЕГО:": "много"},
+        {"City": "unknown"},
+        {"Date": "2025-02-30"},
+    ]
+    messages = [dict(base, **edit) for edit in edits]
+    del messages[-1]["Потеряно:"]
+    return messages
+
+
+def scalar_results(messages: list) -> tuple:
+    rows, errors = [], []
+    for position, data in enumerate(messages):
+        try:
+            row = parse_message(data)
+        except Exception as e:
+            errors.append((position, f"{type(e).__name__}: {e}"))
+            continue
+        if row is None:
+            errors.append((position, f"unknown city: {data['City']}"))
+        else:
+            rows.append(row)
+    return rows, errors
+
+
+@pytest.fixture(params=["numpy", "python"])
+def backend(request, monkeypatch):
+    if request.param == "numpy":
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(decode, "np", None)
+    return request.param
+
+
+def test_decode_batch_matches_parse_message(backend):
+    messages = generate_messages(datetime(2025, 3, 1), 30, seed=3) + edge_messages()
+    batch = decode_batch([encode(data) for data in messages])
+    rows, errors = scalar_results(messages)
+    assert batch.rows() == rows
+    assert batch.errors == errors
+    # типы тоже совпадают: в книгу int и float пишутся по-разному
+    assert [[type(v) for v in values] for _, _, values in batch.rows()] == [
+        [type(v) for v in values] for _, _, values in rows
+    ]
@@ -0,0 +1,94 @@
+import asyncio
+import os
+
+from datetime import datetime
+
+from app.dedup import FingerprintCache
+from app.memory_broker import InMemoryChannel
+from app.mq_consumer import consume
+from app.writer import ExcelWriter
+
+
+async def consume_all(processor, bodies):
+    channel = InMemoryChannel()
+    queue = await channel.declare_queue("statScraper", durable=True)
+    for body in bodies:
+        queue.publish(body)
+    queue.close()
+    await asyncio.wait_for(
+        consume(channel, processor, "statScraper", 0, ExcelWriter(processor)), 10
+    )
+    return channel
+
+
+def stored_keys(path: str) -> set:
+    cache = FingerprintCache(path, 100)
+    keys = set(cache.entries)
+    cache.close()
+    return keys
+
+
+def test_redelivery_acked_without_save_or_email(make_processor, bodies, tmp_path, mail):
+    path = str(tmp_path / "fingerprints.sqlite3")
+    fingerprints = FingerprintCache(path, 100)
+    asyncio.run(consume_all(make_processor(fingerprints=fingerprints), bodies))
+    fingerprints.close()
+    assert len(mail.sent) == 2
+
+    # перезапуск и повторная доставка тех же сообщений
+    fingerprints = FingerprintCache(path, 100)
+    processor = make_processor(fingerprints=fingerprints)
+    saves = []
+    save = processor.save
+    processor.save = lambda: saves.append(1) or save()
+    channel = asyncio.run(consume_all(processor, bodies))
+    fingerprints.close()
+    assert channel.acked == len(bodies)
+    assert saves == []
+    assert len(mail.sent) == 2
+
+
+def test_fingerprints_persisted_only_after_save(make_processor, messages, tmp_path):
+    path = str(tmp_path / "fingerprints.sqlite3")
+    fingerprints = FingerprintCache(path, 100)
+    processor = make_processor(fingerprints=fingerprints, flush_max_messages=100)
+    for data in messages[:3]:
+        processor.process_message(data)
+    # книга не сохранена: на диске отпечатков нет
+    assert stored_keys(path) == set()
+    processor.flush()
+    assert len(stored_keys(path)) == 3
+    fingerprints.close()
+
+
+def test_fingerprints_of_changed_workbook_dropped(make_processor, messages, tmp_path):
+    path = str(tmp_path / "fingerprints.sqlite3")
+    fingerprints = FingerprintCache(path, 100)
+    processor = make_processor(fingerprints=fingerprints)
+    for data in messages[:3]:
+        processor.process_message(data)
+    fingerprints.close()
+    assert len(stored_keys(path)) == 3
+
+    # книгу поправили вручную: записанные значения могли измениться
+    stat = os.stat(processor.file_path)
+    os.utime(processor.file_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert stored_keys(path) == set()
+
+
+def test_evicted_fingerprints_removed_from_disk(tmp_path):
+    path = str(tmp_path / "fingerprints.sqlite3")
+    cache = FingerprintCache(path, 3)
+    for day in range(1, 4):
+        cache.remember(datetime(2025, 3, day), "Москва", [day], "report.xlsx")
+    cache.persist([])
+    # новые даты вытесняют давно не встречавшиеся: их строки удаляются и с диска
+    for day in range(4, 6):
+        cache.remember(datetime(2025, 3, day), "Москва", [day], "report.xlsx")
+    cache.persist([])
+    cache.close()
+    assert stored_keys(path) == {
+        ("2025-03-03", "Москва"),
+        ("2025-03-04", "Москва"),
+        ("2025-03-05", "Москва"),
+    }
@@ -0,0 +1,70 @@
+from datetime import date, datetime
+
+import openpyxl
+
+from app.history import HistoryStore
+from app.previous_year import PreviousYearReader
+
+
+def write_year(path, sections: dict):
+    """
+    Годовая книга: секции {заголовок: строки} через пустую строку
+    """
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = "Март 2024"
+    for header, rows in sections.items():
+        ws.append([header, "Санкт-Петербург", "Москва"])
+        for row in rows:
+            ws.append(row)
+        ws.append([])
+    wb.save(path)
+
+
+def test_archive_matches_previous_year_reader(make_processor, messages, tmp_path):
+    # книга прошлого года в том виде, как её пишет обработчик, плюс ячейки
+    # разных типов с равными значениями: 1 и 1.0 не должны слиться в пуле
+    report = make_processor(name="2024.xlsx")
+    for data in messages:
+        data = dict(data, Date=data["Date"].replace("2025", "2024"))
+        report.process_message(data)
+    ws = report.wb["Март 2024"]
+    ws.cell(3, 2).value = 1
+    ws.cell(4, 2).value = 1.0
+    ws.cell(5, 2).value = "1"
+    ws.cell(6, 2).value = True
+    report.flush()
+
+    target = str(tmp_path / "history.bin")
+    assert HistoryStore.build(target, [report.file_path]) == 2
+    store = HistoryStore(target)
+    reader = PreviousYearReader(report.file_path)
+    for day in (date(2024, 3, 1), datetime(2024, 3, 2)):
+        rows = store.get_section(day)
+        assert rows == reader.get_section(day)
+        assert [[type(v) for v in row] for row in rows] == [
+            [type(v) for v in row] for row in reader.get_section(day)
+        ]
+    assert store.get_section(date(2024, 3, 3)) is None
+
+
+def test_later_source_wins_and_lookup(tmp_path):
+    old, new = str(tmp_path / "old.xlsx"), str(tmp_path / "new.xlsx")
+    write_year(old, {"02.03.2023 (Чт)": [["ВСЕГО:", 10, 20]]})
+    write_year(
+        new,
+        {
+            "02.03.2023 (Чт)": [["ВСЕГО:", 11, 21]],
+            "29.02.2024 (Чт)": [["ВСЕГО:", 7, 8]],
+        },
+    )
+    target = str(tmp_path / "history.bin")
+    HistoryStore.build(target, [old, new], width=3)
+    store = HistoryStore(target)
+    assert store.get_section(date(2023, 3, 2)) == (
+        ("02.03.2023 (Чт)", "Санкт-Петербург", "Москва"),
+        ("ВСЕГО:", 11, 21),
+    )
+    # тот же день недели год и два года назад
+    assert store.lookup(datetime(2025, 2, 27), "Москва", years=1) == {"ВСЕГО:": 8}
+    assert store.lookup(datetime(2025, 2, 27), "Москва", years=2) == {"ВСЕГО:": 21}
@@ -0,0 +1,119 @@
+import asyncio
+import threading
+
+from app.journal import Journal
+from app.memory_broker import InMemoryChannel
+from app.mq_consumer import consume
+from app.writer import ExcelWriter
+from tests.conftest import wait_until
+
+
+async def start_consumer(processor):
+    channel = InMemoryChannel()
+    queue = await channel.declare_queue("statScraper", durable=True)
+    writer = ExcelWriter(processor)
+    task = asyncio.create_task(consume(channel, processor, "statScraper", 0, writer))
+    return channel, queue, writer, task
+
+
+async def finish(queue, task):
+    queue.close()
+    await asyncio.wait_for(task, 10)
+
+
+def test_messages_acked_only_after_journal_commit(make_processor, bodies, tmp_path):
+    journal = Journal(str(tmp_path / "journal.sqlite3"))
+    processor = make_processor(journal=journal)
+    started, release = threading.Event(), threading.Event()
+    append_many = journal.append_many
+
+    def slow_append(rows):
+        started.set()
+        release.wait(5)
+        return append_many(rows)
+
+    journal.append_many = slow_append
+
+    async def run():
+        channel, queue, _, task = await start_consumer(processor)
+        queue.publish(bodies[0])
+        await wait_until(started.is_set)
+        await asyncio.sleep(0.05)
+        # транзакция ещё не закоммичена: подтверждать нечего
+        assert channel.acked == 0
+        release.set()
+        await wait_until(lambda: channel.acked == 1)
+        assert len(journal.since(0)) == 1
+        await finish(queue, task)
+
+    asyncio.run(run())
+    journal.close()
+
+
+def test_restart_replays_rows_missing_from_workbook(
+    make_processor, bodies, tmp_path, mail
+):
+    path = str(tmp_path / "journal.sqlite3")
+    journal = Journal(path)
+    crashed = make_processor(journal=journal)
+    # книга не обновилась до сбоя, но сообщения уже в журнале и подтверждены
+    crashed.refresh_from_journal = lambda full=False: 0
+
+    async def first_run():
+        channel, queue, _, task = await start_consumer(crashed)
+        for body in bodies[:5]:
+            queue.publish(body)
+        await finish(queue, task)
+        return channel
+
+    assert asyncio.run(first_run()).acked == 5
+    assert journal.applied_version() == 0
+    assert mail.sent == []
+    journal.close()
+
+    journal = Journal(path)
+    processor = make_processor(journal=journal)
+
+    async def second_run():
+        channel, queue, _, task = await start_consumer(processor)
+        for body in bodies[5:]:
+            queue.publish(body)
+        await finish(queue, task)
+        return channel
+
+    assert asyncio.run(second_run()).acked == 5
+    # обе даты собраны: первая — из журнала, вторая — из новых сообщений
+    assert [subject for subject, _ in mail.sent] == [
+        "Отчет с данными за 01.03.2025",
+        "Отчет с данными за 02.03.2025",
+    ]
+    assert journal.applied_version() == 10
+    journal.close()
+
+
+def test_failed_journal_write_nacks_for_redelivery(make_processor, bodies, tmp_path):
+    journal = Journal(str(tmp_path / "journal.sqlite3"))
+    processor = make_processor(journal=journal)
+    failures = []
+    append_many = journal.append_many
+
+    def flaky_append(rows):
+        if not failures:
+            failures.append(rows)
+            raise OSError("disk I/O error")
+        return append_many(rows)
+
+    journal.append_many = flaky_append
+
+    async def run():
+        channel, queue, _, task = await start_consumer(processor)
+        queue.publish(bodies[0])
+        # сообщение вернулось в очередь и записалось со второй попытки
+        await wait_until(lambda: channel.acked == 1)
+        assert not channel.unacked
+        await finish(queue, task)
+
+    asyncio.run(run())
+    assert len(failures) == 1
+    assert len(journal.since(0)) == 1
+    journal.close()
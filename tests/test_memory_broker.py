@@ -0,0 +1,31 @@
+import asyncio
+
+from app.memory_broker import InMemoryChannel
+
+
+def test_nack_requeues_into_origin_queue():
+    async def run():
+        channel = InMemoryChannel()
+        calls = await channel.declare_queue("calls")
+        chat = await channel.declare_queue("chat")
+        chat.publish(b"chat message")
+        message = await chat.__anext__()
+        await message.nack(requeue=True)
+        assert calls.messages.empty()
+        assert chat.messages.get_nowait() == b"chat message"
+        assert not channel.unacked
+
+    asyncio.run(run())
+
+
+def test_nack_without_requeue_drops_message():
+    async def run():
+        channel = InMemoryChannel()
+        queue = await channel.declare_queue("calls")
+        queue.publish(b"message")
+        message = await queue.__anext__()
+        await message.nack(requeue=False)
+        assert queue.messages.empty()
+        assert not channel.unacked
+
+    asyncio.run(run())
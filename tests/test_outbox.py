@@ -0,0 +1,64 @@
+from datetime import datetime
+
+from app.outbox import ReportOutbox
+
+
+def test_completed_date_emailed_without_previous_year_blocks(
+    make_processor, messages, mail
+):
+    processor = make_processor(previous_year_blocks=False)
+    for data in messages:
+        processor.process_message(data)
+    assert [subject for subject, _ in mail.sent] == [
+        "Отчет с данными за 01.03.2025",
+        "Отчет с данными за 02.03.2025",
+    ]
+
+
+def test_unsent_report_resent_on_restart(make_processor, messages, mail, tmp_path):
+    outbox = ReportOutbox(str(tmp_path / "report.outbox.sqlite3"))
+    processor = make_processor(outbox=outbox)
+    mail.fail = True
+    for data in messages[:5]:
+        processor.process_message(data)
+    mail.fail = False
+    for data in messages[5:]:
+        processor.process_message(data)
+    assert outbox.unsent() == [datetime(2025, 3, 1)]
+    outbox.close()
+
+    # перезапуск: книга и outbox читаются с диска
+    outbox = ReportOutbox(str(tmp_path / "report.outbox.sqlite3"))
+    assert make_processor(outbox=outbox).resend_unsent() == 1
+    assert mail.sent[-1][0] == "Отчет с данными за 01.03.2025"
+    assert outbox.unsent() == []
+    assert make_processor(outbox=outbox).resend_unsent() == 0
+    outbox.close()
+
+
+def test_incomplete_date_waits_for_redelivery(make_processor, messages, tmp_path):
+    outbox = ReportOutbox(str(tmp_path / "report.outbox.sqlite3"))
+    # дата попала в outbox, но книга не успела сохраниться до сбоя
+    outbox.add(datetime(2025, 3, 1))
+    processor = make_processor(outbox=outbox)
+    for data in messages[:3]:
+        processor.process_message(data)
+    assert make_processor(outbox=outbox).resend_unsent() == 0
+    assert outbox.unsent() == [datetime(2025, 3, 1)]
+    outbox.close()
+
+
+def test_broken_previous_year_file_does_not_lose_email(
+    make_processor, messages, mail, tmp_path
+):
+    broken = tmp_path / "last_year.xlsx"
+    broken.write_bytes(b"not a workbook")
+    outbox = ReportOutbox(str(tmp_path / "report.outbox.sqlite3"))
+    processor = make_processor(
+        previous_year_blocks=True, last_year_path=str(broken), outbox=outbox
+    )
+    for data in messages[:5]:
+        processor.process_message(data)
+    assert [subject for subject, _ in mail.sent] == ["Отчет с данными за 01.03.2025"]
+    assert outbox.unsent() == []
+    outbox.close()
@@ -0,0 +1,11 @@
+import os
+
+from app.partitioning import partition_path
+
+
+def test_partition_files_do_not_collide():
+    paths = [
+        partition_path(os.path.join("data", "journal.sqlite3"), i) for i in range(3)
+    ]
+    assert paths[0] == os.path.join("data", "journal.p0.sqlite3")
+    assert len(set(paths)) == 3
@@ -0,0 +1,39 @@
+from datetime import datetime
+
+import openpyxl
+
+from app.decode import parse_message
+from app.journal import Journal
+from app.report_writer import regenerate_report
+from benchmarks.messages import generate_messages
+
+
+def sheet_values(path, title):
+    wb = openpyxl.load_workbook(path, read_only=True)
+    try:
+        return [row for row in wb[title].iter_rows(values_only=True)]
+    finally:
+        wb.close()
+
+
+def test_regenerate_replaces_only_requested_sheet(tmp_path):
+    journal = Journal(str(tmp_path / "journal.sqlite3"))
+    rows = [parse_message(data) for data in generate_messages(datetime(2025, 3, 30), 4)]
+    journal.append_many(rows)
+    target = str(tmp_path / "report.xlsx")
+    regenerate_report(journal, target)
+    april = sheet_values(target, "Апрель 2025")
+
+    march_day = [row for row in rows if row[0].month == 3]
+    journal.append_many([(date, city, [1] * 8) for date, city, _ in march_day])
+    # строки других месяцев для одного листа не читаются
+    journal.since = None
+    regenerate_report(journal, target, ["Март 2025"])
+
+    wb = openpyxl.load_workbook(target, read_only=True)
+    assert wb.sheetnames == ["Март 2025", "Апрель 2025"]
+    wb.close()
+    assert sheet_values(target, "Апрель 2025") == april
+    march = sheet_values(target, "Март 2025")
+    assert march[2][1] == 1
+    journal.close()
@@ -0,0 +1,86 @@
+import json
+
+from datetime import datetime
+
+import pytest
+
+from app.config import CITY_MAPPING
+from app.reports import create_processor, load_reports
+from benchmarks.messages import generate_messages
+
+
+def write_config(tmp_path, **report) -> str:
+    entry = {
+        "name": "chat",
+        "queue": "chatScraper",
+        "excel_path": str(tmp_path / "chat.xlsx"),
+        "last_year_path": str(tmp_path / "chat_last_year.xlsx"),
+    }
+    entry.update(report)
+    path = tmp_path / "reports.json"
+    path.write_text(json.dumps([entry], ensure_ascii=False), encoding="utf-8")
+    return str(path)
+
+
+def test_report_with_own_cities_completes_and_emails(tmp_path, mail):
+    path = write_config(
+        tmp_path,
+        cities={"piter": "Санкт-Петербург", "moscow": "Москва"},
+        recipients="chat@example.com, lead@example.com",
+        from_address="chat-reports@example.com",
+    )
+    (report,) = load_reports(path)
+    assert report["city_order"] == ["Санкт-Петербург", "Москва"]
+
+    processor = create_processor(report)
+    for data in generate_messages(
+        datetime(2025, 3, 1), 2, seed=1, cities=["piter", "moscow"]
+    ):
+        processor.process_message(data)
+    processor.outbox.close()
+
+    assert [subject for subject, _ in mail.sent] == [
+        "[chat] Отчет с данными за 01.03.2025",
+        "[chat] Отчет с данными за 02.03.2025",
+    ]
+    settings = mail.settings[0]
+    assert settings.recipients == ["chat@example.com", "lead@example.com"]
+    assert settings.from_address == "chat-reports@example.com"
+    ws = processor.wb["Март 2025"]
+    # в заголовке секции только города отчёта
+    assert [cell.value for cell in ws[2]][1:] == ["Санкт-Петербург", "Москва"]
+
+
+def test_city_order_must_come_from_cities(tmp_path):
+    path = write_config(
+        tmp_path,
+        cities={"piter": "Санкт-Петербург"},
+        city_order=["Санкт-Петербург", "Москва"],
+    )
+    with pytest.raises(ValueError, match="Москва"):
+        load_reports(path)
+
+
+def test_previous_year_block_keeps_all_report_cities(make_processor, tmp_path, mail):
+    cities = dict(CITY_MAPPING, kzn="Казань")
+    order = list(cities.values())
+    last_year = make_processor(
+        name="last_year.xlsx", city_mapping=cities, city_order=order
+    )
+    for data in generate_messages(datetime(2024, 3, 1), 3, seed=1, cities=cities):
+        last_year.process_message(data)
+
+    processor = make_processor(
+        city_mapping=cities,
+        city_order=order,
+        previous_year_blocks=True,
+        last_year_path=last_year.file_path,
+    )
+    for data in generate_messages(datetime(2025, 3, 1), 1, seed=2, cities=cities):
+        processor.process_message(data)
+
+    ws = processor.wb["Март 2025"]
+    # секция даты: заголовок и 8 метрик, блок прошлого года — через пустую строку
+    block_header = [cell.value for cell in ws[12]]
+    assert block_header == ["02.03.2024 (Сб)"] + order
+    assert ws.cell(13, 7).value is not None
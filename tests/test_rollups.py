@@ -0,0 +1,103 @@
+from datetime import datetime
+
+import openpyxl
+
+from app.rollups import MONTH_SHEET, WEEK_SHEET, Rollups
+from app.sharded_processor import ShardedExcelProcessor
+from benchmarks.messages import generate_messages
+
+
+def section_headers(path, title) -> list:
+    wb = openpyxl.load_workbook(path, read_only=True)
+    try:
+        return [
+            row[0]
+            for row in wb[title].iter_rows(values_only=True)
+            if row[1:2] == ("Санкт-Петербург",)
+        ]
+    finally:
+        wb.close()
+
+
+def test_rollup_sheets_stay_last(make_processor, tmp_path):
+    processor = make_processor(rollups=True)
+    for data in generate_messages(datetime(2025, 3, 30), 4):
+        processor.process_message(data)
+    processor.flush()
+    wb = openpyxl.load_workbook(tmp_path / "report.xlsx", read_only=True)
+    assert wb.sheetnames == ["Март 2025", "Апрель 2025", WEEK_SHEET, MONTH_SHEET]
+    wb.close()
+
+
+def test_partition_rollups_cover_all_months(make_processor, tmp_path):
+    # два воркера партиций с общим каталогом месяцев: у каждого свой месяц
+    messages = generate_messages(datetime(2025, 3, 30), 4)
+    workers = [
+        make_processor(
+            ShardedExcelProcessor,
+            shard_dir=str(tmp_path / "months"),
+            rollups=True,
+            partitioned=True,
+        )
+        for _ in range(2)
+    ]
+    for data in messages:
+        worker = workers[0] if data["Date"] < "2025-04" else workers[1]
+        worker.process_message(data)
+    for worker in workers:
+        worker.flush()
+    workers[1].report_path()
+    path = tmp_path / "report.xlsx"
+    assert section_headers(path, MONTH_SHEET) == ["Март 2025", "Апрель 2025"]
+    # неделя 30.03 — 05.04 собрана по книгам обоих воркеров
+    wb = openpyxl.load_workbook(path, read_only=True)
+    rows = list(wb[WEEK_SHEET].iter_rows(values_only=True))
+    wb.close()
+    header = next(
+        i for i, row in enumerate(rows) if row and str(row[0]).startswith("31.03")
+    )
+    expected = sum(
+        int(data["ВСЕГО:"])
+        for data in messages
+        if data["City"] == "spb" and data["Date"] >= "2025-03-31"
+    )
+    assert rows[header + 1][1] == expected
+
+
+def test_monthly_rollups_scan_shards_once(make_processor, tmp_path, monkeypatch):
+    # без партиций итоги ведутся на лету: книги месяцев сканируются при запуске
+    scanned = []
+    scan = Rollups.scan
+    monkeypatch.setattr(
+        Rollups, "scan", lambda self, ws: (scanned.append(ws.title), scan(self, ws))
+    )
+    shard_dir = str(tmp_path / "months")
+    messages = generate_messages(datetime(2025, 3, 30), 4)
+    processor = make_processor(ShardedExcelProcessor, shard_dir=shard_dir, rollups=True)
+    for data in messages[:8]:
+        processor.process_message(data)
+    processor.flush()
+    processor.report_path()
+    assert scanned == []
+
+    processor = make_processor(ShardedExcelProcessor, shard_dir=shard_dir, rollups=True)
+    for data in messages[8:]:
+        processor.process_message(data)
+    processor.flush()
+    processor.report_path()
+    processor.report_path()
+    assert scanned == ["Март 2025"]
+    assert section_headers(tmp_path / "report.xlsx", MONTH_SHEET) == [
+        "Март 2025",
+        "Апрель 2025",
+    ]
+    wb = openpyxl.load_workbook(tmp_path / "report.xlsx", read_only=True)
+    rows = list(wb[MONTH_SHEET].iter_rows(values_only=True))
+    wb.close()
+    header = next(i for i, row in enumerate(rows) if row and row[0] == "Апрель 2025")
+    expected = sum(
+        int(data["ВСЕГО:"])
+        for data in messages
+        if data["City"] == "spb" and data["Date"] >= "2025-04"
+    )
+    assert rows[header + 1][1] == expected
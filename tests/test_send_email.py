@@ -0,0 +1,78 @@
+import threading
+import time
+
+from app.send_email import EmailDispatcher, MailSettings, SMTPConnection
+
+
+class FakeServer:
+    def __init__(self, sent: list):
+        self.sent = sent
+        self.busy = False
+
+    def noop(self):
+        return 250, b"OK"
+
+    def sendmail(self, from_address, recipients, message):
+        self.envelope = (from_address, recipients)
+        # два потока внутри одного SMTP-диалога портят команды друг друга
+        assert not self.busy, "concurrent use of one SMTP session"
+        self.busy = True
+        time.sleep(0.001)
+        self.sent.append(message)
+        self.busy = False
+
+    def quit(self):
+        pass
+
+
+def test_connection_shared_between_threads():
+    sent = []
+    connection = SMTPConnection(lambda: FakeServer(sent))
+
+    def send():
+        for _ in range(20):
+            connection.send(["a@example.com"], b"report")
+
+    threads = [threading.Thread(target=send) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(sent) == 80
+
+
+def test_full_queue_does_not_drop_reports():
+    sent = []
+    connection = SMTPConnection(lambda: FakeServer(sent))
+    # поток отправки не запущен: очередь на одно письмо сразу заполнится
+    dispatcher = EmailDispatcher(
+        maxsize=1, coalesce_window=0, connection=connection, submit_timeout=0.01
+    )
+    assert dispatcher.submit("first", "", "a.xlsx", payload=b"1")
+    assert dispatcher.submit("second", "", "b.xlsx", payload=b"2")
+    assert len(sent) == 1
+    dispatcher.start()
+    dispatcher.stop(5)
+    assert len(sent) == 2
+
+
+def test_report_mail_settings_used_for_delivery():
+    sent, servers = [], []
+
+    class ReportMail(MailSettings):
+        def connect(self):
+            servers.append(FakeServer(sent))
+            return servers[-1]
+
+    mail = ReportMail(
+        recipients=["chat@example.com"],
+        from_address="chat-reports@example.com",
+        server="smtp.chat.example.com",
+    )
+    default = SMTPConnection(lambda: FakeServer([]))
+    dispatcher = EmailDispatcher(coalesce_window=0, connection=default).start()
+    dispatcher.submit("chat", "", "chat.xlsx", payload=b"1", mail=mail)
+    dispatcher.stop(5)
+    assert len(sent) == 1
+    assert servers[0].envelope == ("chat-reports@example.com", ["chat@example.com"])
+    assert default.server is None
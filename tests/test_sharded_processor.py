@@ -0,0 +1,40 @@
+import asyncio
+
+import openpyxl
+
+from app.sharded_processor import ShardedExcelProcessor
+from app.writer import ExcelWriter
+from tests.conftest import wait_until
+
+
+def test_report_assembled_in_date_mode(make_processor, messages, tmp_path):
+    processor = make_processor(
+        ShardedExcelProcessor, shard_dir=str(tmp_path / "months"), assemble_interval=0
+    )
+    for data in messages:
+        processor.process_message(data)
+    # письма с секцией даты общий файл не собирают
+    assert not (tmp_path / "report.xlsx").exists()
+    assert processor.assemble_report()
+    wb = openpyxl.load_workbook(tmp_path / "report.xlsx", read_only=True)
+    assert wb.sheetnames == ["Март 2025"]
+    wb.close()
+    assert not processor.assemble_report()
+
+
+def test_report_assembled_by_writer_timer(make_processor, messages, tmp_path):
+    processor = make_processor(
+        ShardedExcelProcessor,
+        shard_dir=str(tmp_path / "months"),
+        assemble_interval=0.05,
+    )
+    for data in messages:
+        processor.process_message(data)
+
+    async def run():
+        writer = ExcelWriter(processor)
+        writer.start()
+        await wait_until(lambda: (tmp_path / "report.xlsx").exists())
+        await writer.stop()
+
+    asyncio.run(run())
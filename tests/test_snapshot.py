@@ -0,0 +1,24 @@
+from app.sidecar import read_sidecar, write_sidecar
+from app.snapshot import SnapshotSaver
+
+
+def test_merged_snapshots_write_only_newest_sidecar(
+    make_processor, messages, monkeypatch
+):
+    written = []
+
+    def record(path, indexes):
+        written.append(indexes)
+        write_sidecar(path, indexes)
+
+    monkeypatch.setattr("app.excel_processor.write_sidecar", record)
+    # поток записи ещё не запущен: все снимки сливаются в один
+    snapshots = SnapshotSaver()
+    processor = make_processor(snapshots=snapshots, index_sidecar=True)
+    for data in messages[:7]:
+        processor.process_message(data)
+    snapshots.start().stop(5)
+
+    newest = {ws.title: processor.get_sheet_index(ws).to_dict() for ws in processor.wb}
+    assert written == [newest]
+    assert read_sidecar(processor.file_path) == newest
@@ -0,0 +1,45 @@
+import asyncio
+
+from app.memory_broker import InMemoryChannel
+from app.writer import ExcelWriter
+
+
+async def delivered(count: int) -> tuple:
+    channel = InMemoryChannel()
+    queue = await channel.declare_queue("statScraper")
+    for i in range(count):
+        queue.publish(f"{i}".encode())
+    return channel, [await queue.__anext__() for _ in range(count)]
+
+
+def test_ack_pending_counts_acked_messages(make_processor):
+    async def run():
+        channel, messages = await delivered(2)
+        writer = ExcelWriter(make_processor())
+        writer.pending.extend(messages)
+        # в pending меньше сообщений, чем просили подтвердить
+        await writer.ack_pending(5)
+        assert channel.acked == 2
+        assert writer.saving_messages == 0
+        # пустой срез ничего не подтверждает и не падает
+        await writer.ack_pending(1)
+        assert writer.saving_messages == 0
+
+    asyncio.run(run())
+
+
+def test_ack_covered_skips_messages_acked_by_other_task(make_processor):
+    async def run():
+        channel, messages = await delivered(4)
+        writer = ExcelWriter(make_processor())
+        writer.pending.extend(messages[:2])
+        last = writer.pending[-1]
+        # сохранение из другой задачи уже подтвердило эти сообщения,
+        # а следующие ещё не сохранены
+        await writer.ack_pending(2)
+        writer.pending.extend(messages[2:])
+        await writer.ack_covered(last)
+        assert channel.acked == 2
+        assert writer.pending == messages[2:]
+
+    asyncio.run(run())